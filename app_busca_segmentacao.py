@@ -4,14 +4,18 @@ import json
 import os
 import re
 import time
-import asyncio
-from unidecode import unidecode
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from datetime import datetime
 
-# Agno Imports
-from src.database import initialize_knowledge_base
-from src.agent import get_auditor_agent, ResultadoAuditoria
+# Módulos leves; os que importam agno/LanceDB são carregados sob demanda (ver AGNO INTEGRATION)
+from src.checkpoint import BatchCheckpoint, gerar_job_id
+from src.concurrency import AdaptiveLimiter, LoopDedicado
+from src.storage import COLS_FULL, ProcedureStore
+from src.upload import detectar_formato, ler_colunas, ler_em_chunks, resumir_arquivo
+from src.utils import normalizar_texto, limpar_valor, chave_consulta, chaves_consulta
 
 # --- CONFIGURAÇÃO INICIAL ---
 load_dotenv()
@@ -25,16 +29,22 @@ if os.getenv("API_PROJETOS_UNI_GMINAI"):
 DIR_BASES = "bases"
 FILE_PATH_MAIN = os.path.join(DIR_BASES, "classificacao_procedimentos.csv")
 FILE_PATH_ERRORS = os.path.join(DIR_BASES, "inconsistencias.csv")
+# Base transacional (SQLite); os CSVs acima são importados na primeira execução
+FILE_PATH_DB = os.path.join(DIR_BASES, "procedimentos.db")
 API_KEY = os.getenv("API_PROJETOS_UNI_GMINAI")
+# Concorrência inicial e máxima do controlador adaptativo (AIMD) de chamadas ao agente
 MAX_CONCURRENT_REQUESTS = 5
-
-# Colunas Oficiais
-COLS_FULL = [
-    "CODIGO", "DESCRICAO", "ABREVIATURA", "ITEM", "SEGMENTACAO",
-    "TERAPIA_ESPECIAL", "TIPO_MEDICAMENTO", "TIPO_CANCER",
-    "CODIGO_SUGERIDO", "DESCRICAO_SUGERIDA", "NIVEL_CONFIANCA",
-    "JUSTIFICATIVA", "DATA_MODIFICACAO"
-]
+MAX_CONCURRENT_LIMIT = 32
+# Linhas por chamada do agente no processamento em lote (1 = uma chamada por linha)
+TAMANHO_PACOTE = 10
+# Linhas processadas entre dois checkpoints do lote
+TAMANHO_CHUNK = 200
+# Linhas do resultado do lote gravadas nas bases por vez
+TAMANHO_MESCLA = 5_000
+# Resultados do enriquecimento acumulados antes de cada gravação da base
+TAMANHO_COMMIT_ENRIQUECIMENTO = 50
+# Opções de linhas por página da fila de correção
+TAMANHOS_PAGINA_CORRECAO = [50, 100, 200, 500]
 
 # Verifica e cria diretório de bases se não existir
 if not os.path.exists(DIR_BASES):
@@ -46,46 +56,171 @@ if not API_KEY:
 
 # --- FUNÇÕES UTILITÁRIAS ---
 
-def normalizar_texto(texto):
-    """Remove acentos, espaços extras e converte para maiúsculo."""
-    if not isinstance(texto, str):
-        return ""
-    return unidecode(texto).strip().upper()
-
-def carregar_dados():
-    """Carrega as bases de dados ou cria vazias se não existirem (Para UI e edição)."""
-    if "main_df" not in st.session_state:
-        if os.path.exists(FILE_PATH_MAIN):
-            st.session_state.main_df = pd.read_csv(FILE_PATH_MAIN, sep=";", dtype=str, encoding='latin1')
-        else:
-            st.session_state.main_df = pd.DataFrame(columns=COLS_FULL)
+@st.cache_resource
+def get_cached_store():
+    """Base transacional compartilhada pelo processo (migra os CSVs na primeira execução)."""
+    store = ProcedureStore(FILE_PATH_DB, COLS_FULL)
+    for tabela, csv_path in [("oficial", FILE_PATH_MAIN), ("inconsistencias", FILE_PATH_ERRORS)]:
+        if store.contar(tabela) == 0 and os.path.exists(csv_path):
+            store.importar_csv(tabela, csv_path)
+    return store
 
-    if "inconsistencias_df" not in st.session_state:
-        if os.path.exists(FILE_PATH_ERRORS):
-            st.session_state.inconsistencias_df = pd.read_csv(FILE_PATH_ERRORS, sep=";", dtype=str, encoding='latin1')
-        else:
-            st.session_state.inconsistencias_df = pd.DataFrame(columns=COLS_FULL)
+@st.cache_resource
+def get_bases():
+    """
+    DataFrames das bases (indexados pelo ID da base transacional), carregados uma vez
+    e compartilhados pelas sessões. São tratados como somente leitura: cada gravação
+    publica um novo DataFrame sob o lock, e quem já o lia continua com a versão anterior.
+    """
+    store = get_cached_store()
+    return {
+        "oficial": store.carregar("oficial"),
+        "inconsistencias": store.carregar("inconsistencias"),
+        "lock": threading.RLock(),
+    }
 
-def salvar_dados():
-    """Persiste os dataframes em CSV."""
-    st.session_state.main_df.to_csv(FILE_PATH_MAIN, sep=";", index=False, encoding='latin1')
-    st.session_state.inconsistencias_df.to_csv(FILE_PATH_ERRORS, sep=";", index=False, encoding='latin1')
+def inserir_registros(tabela, linhas):
+    """Grava novas linhas (DataFrame ou lista de dicts) na base e no DataFrame compartilhado. Retorna os novos IDs."""
+    linhas = pd.DataFrame(linhas).reindex(columns=COLS_FULL)
+    if linhas.empty:
+        return []
+    bases = get_bases()
+    with bases["lock"]:
+        linhas.index = get_cached_store().inserir(tabela, linhas)
+        bases[tabela] = pd.concat([bases[tabela], linhas])
+    if tabela == "oficial":
+        sincronizar_base_conhecimento(alterados=linhas)
+    return linhas.index.tolist()
+
+def gravar_alteracoes(tabela, linhas):
+    """
+    Grava na base as linhas alteradas (DataFrame indexado pelo ID) e publica a nova versão
+    do DataFrame. Linhas que outra sessão já moveu ou removeu são ignoradas. Retorna os IDs gravados.
+    """
+    if linhas.empty:
+        return []
+    bases = get_bases()
+    with bases["lock"]:
+        linhas = linhas.loc[get_cached_store().atualizar(tabela, linhas)]
+        linhas = linhas.loc[linhas.index.intersection(bases[tabela].index)]
+        if not linhas.empty:
+            atualizado = bases[tabela].copy()
+            atualizado.loc[linhas.index, linhas.columns] = linhas
+            bases[tabela] = atualizado
+    if tabela == "oficial":
+        sincronizar_base_conhecimento(alterados=linhas)
+    return linhas.index.tolist()
+
+def mover_registros(origem, destino, linhas):
+    """
+    Move linhas (indexadas pelo ID na origem, já com os valores finais) entre as bases,
+    numa transação. Retorna os novos IDs no destino.
+    """
+    if linhas.empty:
+        return []
+    linhas = linhas.reindex(columns=COLS_FULL)
+    bases = get_bases()
+    with bases["lock"]:
+        novos_ids = get_cached_store().mover(origem, destino, linhas)
+        bases[origem] = bases[origem].drop(index=linhas.index)
+        bases[destino] = pd.concat([bases[destino], linhas.set_axis(novos_ids)])
+    sincronizar_base_conhecimento(
+        alterados=linhas.set_axis(novos_ids) if destino == "oficial" else None,
+        removidos=linhas if origem == "oficial" else None,
+    )
+    return novos_ids
+
+def sincronizar_base_conhecimento(alterados=None, removidos=None):
+    """
+    Propaga as linhas novas/alteradas/removidas da Base Oficial (indexadas pelo ID na
+    Base Oficial) ao índice, ao cache e ao LanceDB, sem reiniciar o app.
+    """
+    from src.database import sync_knowledge_rows
+
+    # Só as consultas das linhas alteradas deixam de valer no cache; o resto continua
+    linhas = [df for df in (alterados, removidos) if df is not None and not df.empty]
+    if linhas:
+        get_cached_result_cache().invalidar(pd.concat([chaves_consulta(df) for df in linhas]))
+
+    try:
+        recursos = recursos_agente()
+        # O índice guarda o ID de cada linha: uma linha alterada sai e volta com os novos valores
+        # (se continuar completa e ALTO)
+        for df in linhas:
+            recursos["indice"].remover(df.index)
+        if alterados is not None:
+            recursos["indice"].adicionar(alterados)
+        sync_knowledge_rows(recursos["kb"], alterados, removidos)
+    except Exception as e:
+        st.toast(f"Falha ao sincronizar a Base de Conhecimento: {e}", icon="⚠️")
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def exportar_base_oficial(versao):
+    """CSV da Base Oficial, gerado uma vez por versão da base (não a cada rerun)."""
+    return get_bases()["oficial"].to_csv(sep=";", index=False, encoding='utf-8').encode("utf-8")
 
 # --- AGNO INTEGRATION ---
+# agno/LanceDB levam segundos para importar: os módulos que dependem deles são
+# importados dentro das funções, e o aquecimento roda em segundo plano.
+
+def _construir_recursos_agente(store, df_oficial):
+    """Índice de candidatos, Base de Conhecimento e pool de agentes (executado na thread de aquecimento)."""
+    from src.agent import get_auditor_agent
+    from src.database import initialize_knowledge_base
+    from src.maintenance import podar_sessoes
+    from src.retriever import CandidateRetriever
+    from src.routing import get_roteador
+
+    # Retenção e compactação das sessões do agente, uma vez por processo
+    podar_sessoes()
+    kb = initialize_knowledge_base(df_oficial)
+    # Lote e enriquecimento: cada linha é independente, sem sessão nem histórico; o modelo
+    # mais barato responde primeiro e só as respostas incertas/inválidas sobem de nível
+    roteador = get_roteador(kb, candidatos=True)
+    # Os candidatos da Base Oficial vão na consulta: os agentes respondem sem a ferramenta de busca
+    return {
+        "indice": CandidateRetriever(df_oficial),
+        "kb": kb,
+        # Busca individual: uma instância para todas as sessões, cada uma com seu session_id
+        # e histórico limitado às últimas execuções
+        "individual": get_auditor_agent(knowledge_base=kb, candidatos=True),
+        "roteador": roteador,
+        "linha": roteador.agent,
+        "lote": roteador.agent_lote,
+    }
 
 @st.cache_resource
-def get_cached_knowledge_base():
-    """Initializes Knowledge Base (Cached)."""
-    return initialize_knowledge_base()
-
-def initialize_agent():
-    """Initializes the Agent in Session State."""
-    if "auditor_agent" not in st.session_state:
+def get_aquecimento():
+    """Inicia, uma vez por processo e em segundo plano, a construção dos recursos do agente."""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aquecimento")
+    futuro = executor.submit(_construir_recursos_agente, get_cached_store(), get_bases()["oficial"])
+    executor.shutdown(wait=False)
+    return futuro
+
+def recursos_agente():
+    """Índice, Base de Conhecimento e agentes do processo, aguardando o aquecimento se ainda não terminou."""
+    futuro = get_aquecimento()
+    if not futuro.done():
         with st.spinner("Inicializando Agente e Base de Conhecimento..."):
-            kb = get_cached_knowledge_base()
-            st.session_state.auditor_agent = get_auditor_agent(knowledge_base=kb)
+            return futuro.result()
+    return futuro.result()
+
+@st.cache_resource
+def get_cached_result_cache():
+    """Cache persistente de classificações, versionado pela geração da base e configuração do agente."""
+    from src.agent import MODEL_TIERS, agent_config_signature
+    from src.cache import ResultCache, calcular_fingerprint
+
+    return ResultCache(fingerprint=calcular_fingerprint(get_cached_store().geracao(), agent_config_signature(MODEL_TIERS)))
+
+@st.cache_resource
+def get_cached_metricas():
+    """Métricas por chamada do agente (JSONL em tmp/), compartilhadas pelo processo."""
+    from src.metrics import MetricsRecorder
+
+    return MetricsRecorder()
 
-def exibir_resultado_agno(resultado: ResultadoAuditoria):
+def exibir_resultado_agno(resultado):
     """Exibe resultado estruturado vindo do objeto Pydantic do Agno."""
     st.markdown("### Resultado Encontrado (Agente)")
     # Seção Principal: 3 Colunas Grandes
@@ -118,70 +253,59 @@ def exibir_resultado_agno(resultado: ResultadoAuditoria):
     st.markdown("---")
     st.caption(f"📝 **Justificativa:** {resultado.justificativa_tecnica}")
 
-def result_to_dict(resultado: ResultadoAuditoria, input_cod="", input_desc=""):
-    """Converte objeto Pydantic para dicionário compatível com DataFrame."""
-    return {
-        "CODIGO": input_cod,
-        "DESCRICAO": input_desc,
-        "ABREVIATURA": resultado.abreviatura or "",
-        "ITEM": resultado.item or "",
-        "SEGMENTACAO": resultado.segmentacao or "",
-        "TERAPIA_ESPECIAL": resultado.terapia_especial or "NÃO",
-        "TIPO_MEDICAMENTO": resultado.tipo_medicamento or "",
-        "TIPO_CANCER": resultado.tipo_cancer or "",
-        "CODIGO_SUGERIDO": resultado.codigo_sugerido,
-        "DESCRICAO_SUGERIDA": resultado.descricao_procedimento,
-        "NIVEL_CONFIANCA": resultado.nivel_confianca,
-        "JUSTIFICATIVA": resultado.justificativa_tecnica,
-        "DATA_MODIFICACAO": datetime.now().strftime("%d/%m/%Y")
-    }
-
 # --- PROCESSAMENTO EM LOTE (COM AGNO) ---
 
-async def processar_linha_agno(agent, row, semaphore):
-    async with semaphore:
-        cod = str(row.get("CODIGO", "")).replace("nan", "")
-        desc = str(row.get("DESCRICAO_BUSCA", ""))
-
-        query = f"Código: {cod}, Descrição: {desc}" if cod else f"Descrição: {desc}"
-
-        try:
-            # We use add_history_to_context=False to treat each row independently
-            # and avoid polluting context or hitting token limits.
-            response = await asyncio.to_thread(agent.run, query, add_history_to_context=False)
-            resultado: ResultadoAuditoria = response.content
-            return result_to_dict(resultado, cod, desc)
-        except Exception as e:
-            # Fallback erro
-            return {
-                "CODIGO": cod, "DESCRICAO": desc,
-                "NIVEL_CONFIANCA": "ERRO",
-                "JUSTIFICATIVA": f"Erro Agente: {str(e)}",
-                 "DATA_MODIFICACAO": datetime.now().strftime("%d/%m/%Y")
-            }
-
-async def processar_lote_agno_async(df_batch):
-    agent = st.session_state.auditor_agent
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    tasks = []
-    for idx, row in df_batch.iterrows():
-        tasks.append(processar_linha_agno(agent, row, semaphore))
-
-    return await asyncio.gather(*tasks)
+def obter_limitador():
+    """Controlador de concorrência da sessão (o limite aprendido vale entre chunks e lotes)."""
+    if "limitador" not in st.session_state:
+        st.session_state.limitador = AdaptiveLimiter(inicial=MAX_CONCURRENT_REQUESTS, maximo=MAX_CONCURRENT_LIMIT)
+    return st.session_state.limitador
 
-# --- REIMPLEMENTAÇÃO AUTO-CLASSIFICAÇÃO (Agno) ---
+def leitor_arquivo(path):
+    """
+    Conteúdo para st.download_button: o arquivo só é aberto quando o download é pedido, e
+    o handle vai direto ao Streamlit (o app não lê o arquivo nem guarda uma cópia dele).
+    """
+    return lambda: open(path, "rb")
 
-def classificar_dados_agno():
+@st.cache_resource
+def get_loop_agentes():
     """
-    Classifica campos em branco/nulos da base usando IA (Agno Agent).
-    Versão simplificada e síncrona (loop com barra de progresso na UI).
+    Loop de eventos único do processo: os agentes assíncronos (lote e enriquecimento) são
+    compartilhados entre sessões e o cliente Gemini fica preso ao loop em que foi usado.
     """
-    if 'main_df' not in st.session_state or st.session_state.main_df.empty:
-        return
+    return LoopDedicado()
+
+def processar_lote_agno(df_batch):
+    """Classifica um trecho do upload (índice, regras e cache antes do agente), na ordem de entrada."""
+    from src.classifier import aclassificar_lote
+
+    # Recursos e limitador são obtidos aqui (a sessão do Streamlit só existe nesta thread)
+    recursos = recursos_agente()
+    return get_loop_agentes().executar(aclassificar_lote(
+        df_batch,
+        recursos["linha"],
+        recursos["lote"],
+        indice=recursos["indice"],
+        cache=get_cached_result_cache(),
+        limiter=obter_limitador(),
+        metricas=get_cached_metricas().com_fonte("lote"),
+        tamanho_pacote=TAMANHO_PACOTE,
+        retriever=recursos["indice"],
+        roteador=recursos["roteador"],
+    ))
+
+# --- REIMPLEMENTAÇÃO AUTO-CLASSIFICAÇÃO (Agno) ---
 
-    df = st.session_state.main_df
+def preenche_campos_vazios(row, res_dict):
+    """Indica se o resultado preenche ao menos um campo vazio da linha."""
+    for col in ["ITEM", "SEGMENTACAO", "TERAPIA_ESPECIAL", "ABREVIATURA", "TIPO_MEDICAMENTO", "TIPO_CANCER"]:
+        if not limpar_valor(row.get(col)) and res_dict.get(col):
+            return True
+    return False
 
-    # 1. Identificar linhas (mesma lógica original)
+def linhas_para_enriquecer(df):
+    """Índices da Base Oficial com ITEM/SEGMENTACAO/etc. em branco (mesma lógica original)."""
     mask_item_vazio = (df['ITEM'].isna()) | (df['ITEM'] == '')
     indices_item = df[mask_item_vazio & (df['DESCRICAO'] != '')].index.tolist()
 
@@ -201,106 +325,227 @@ def classificar_dados_agno():
     mask_tipo_cancer_vazio = (df['TIPO_CANCER'].isna()) | (df['TIPO_CANCER'] == '')
     indices_medicamento = df[mask_medicamento & (mask_tipo_med_vazio | mask_tipo_cancer_vazio) & (df['DESCRICAO'] != '')].index.tolist()
 
-    indices_processar = sorted(set(indices_item + indices_segmentacao + indices_terapia + indices_medicamento + indices_abreviatura))
+    return sorted(set(indices_item + indices_segmentacao + indices_terapia + indices_medicamento + indices_abreviatura))
 
-    if not indices_processar:
+def aplicar_enriquecimento(resultados):
+    """
+    Aplica resultados (ids, res_dict) do enriquecimento às linhas de origem (ids) da Base
+    Oficial, gravando só essas linhas. Linhas que não ficaram com confiança ALTO vão para
+    Inconsistências. Outras linhas com a mesma consulta não são tocadas.
+    """
+    if not resultados:
         return
 
-    st.info(f"Iniciando enriquecimento da base (Agno). Total: {len(indices_processar)}")
-    barra_progresso = st.progress(0)
-    status_text = st.empty()
+    oficial = get_bases()["oficial"]
+    # Cópia só das linhas de origem ainda presentes (outra sessão pode tê-las movido ou removido)
+    df = oficial.loc[oficial.index.intersection([idx for ids, _ in resultados for idx in ids])].copy()
+    atualizar = []
+    mover = []
 
-    agent = st.session_state.auditor_agent
-    total_items = len(indices_processar)
+    for ids, res_dict in resultados:
+        for linha_idx in df.index.intersection(ids):
+            # Update specific fields
+            for col in COLS_FULL:
+                if col not in ['DESCRICAO_SUGERIDA', 'NIVEL_CONFIANCA', 'JUSTIFICATIVA', 'DATA_MODIFICACAO']:
+                    valor_atual = df.at[linha_idx, col]
+                    if (pd.isna(valor_atual) or valor_atual == '') and res_dict.get(col):
+                        df.at[linha_idx, col] = res_dict[col]
 
-    for i, idx in enumerate(indices_processar):
-        progresso = (i + 1) / total_items
-        barra_progresso.progress(progresso)
+            for col in ['DESCRICAO_SUGERIDA', 'NIVEL_CONFIANCA', 'JUSTIFICATIVA', 'DATA_MODIFICACAO']:
+                df.at[linha_idx, col] = res_dict[col]
 
-        row = df.loc[idx]
-        cod = str(row.get('CODIGO', '')).strip()
-        desc = str(row.get('DESCRICAO', '')).strip()
+            # Move low confidence
+            if res_dict['NIVEL_CONFIANCA'] != "ALTO":
+                mover.append(linha_idx)
+            else:
+                atualizar.append(linha_idx)
+
+    gravar_alteracoes("oficial", df.loc[atualizar])
+    # Linhas movidas para Inconsistências saem do índice (sem reconstruí-lo)
+    mover_registros("oficial", "inconsistencias", df.loc[mover])
+
+@st.cache_resource
+def get_enrichment_state():
+    """Estado do enriquecimento compartilhado pelo processo (iniciado uma única vez, um worker por vez)."""
+    return {"worker": None, "iniciado": False, "lock": threading.Lock()}
 
-        status_text.markdown(f"Running... {i+1}/{total_items}: `{cod}` - *{desc}*")
+def classificar_dados_agno():
+    """
+    Classifica campos em branco/nulos da base usando IA (Agno Agent).
+    Regras e índice são aplicados na hora; o restante vai para um worker em segundo
+    plano, cujos resultados são gravados em lotes pelo painel da barra lateral.
+    """
+    from src.classifier import result_to_dict
+    from src.enrichment import EnrichmentWorker
+    from src.rules import preencher_por_regras
 
-        if not desc: continue
+    estado = get_enrichment_state()
+    if estado["worker"] is not None and estado["worker"].ativo:
+        return
 
-        query = f"Código: {cod}, Descrição: {desc}" if cod else f"Descrição: {desc}"
+    df = get_bases()["oficial"].copy()
+    if df.empty:
+        return
 
-        try:
-            # Synchronous run for startup process (simpler UI update)
-            response = agent.run(query, add_history_to_context=False)
-            resultado: ResultadoAuditoria = response.content
-            res_dict = result_to_dict(resultado, cod, desc)
+    # 0. Regras determinísticas (prompt_classificacao.md) preenchem a maioria dos casos de uma vez
+    gravar_alteracoes("oficial", df.loc[preencher_por_regras(df)])
 
-            # Update Logic
-            linha_idx = idx # Assuming index aligns if we didn't filter copy.
-            # Wait, df is reference to st.session_state.main_df?
-            # Yes: df = st.session_state.main_df
+    # 1. Identificar linhas
+    indices_processar = linhas_para_enriquecer(df)
+    if not indices_processar:
+        return
 
-            # Update specific fields
-            for col in COLS_FULL:
-                if col not in ['DESCRICAO_SUGERIDA', 'NIVEL_CONFIANCA', 'JUSTIFICATIVA', 'DATA_MODIFICACAO']:
-                    valor_atual = st.session_state.main_df.at[linha_idx, col]
-                    if pd.isna(valor_atual) or valor_atual == '':
-                         # Map from res_dict to DataFrame column
-                         if res_dict.get(col):
-                             st.session_state.main_df.at[linha_idx, col] = res_dict[col]
+    # 2. Itens já validados na Base Oficial: usa o índice se ele completar a linha
+    # (as próprias linhas em enriquecimento nunca respondem por si mesmas)
+    recursos = recursos_agente()
+    indice = recursos["indice"]
+    em_enriquecimento = set(indices_processar)
+    resultados_indice = []
+    itens = {}
+    for idx in indices_processar:
+        row = df.loc[idx]
+        cod = limpar_valor(row.get('CODIGO', ''))
+        desc = limpar_valor(row.get('DESCRICAO', ''))
+        if not desc:
+            continue
 
-            st.session_state.main_df.at[linha_idx, 'DESCRICAO_SUGERIDA'] = res_dict['DESCRICAO_SUGERIDA']
-            st.session_state.main_df.at[linha_idx, 'NIVEL_CONFIANCA'] = res_dict['NIVEL_CONFIANCA']
-            st.session_state.main_df.at[linha_idx, 'JUSTIFICATIVA'] = res_dict['JUSTIFICATIVA']
-            st.session_state.main_df.at[linha_idx, 'DATA_MODIFICACAO'] = res_dict['DATA_MODIFICACAO']
+        resultado = indice.buscar(cod, desc, excluir=em_enriquecimento)
+        res_dict = result_to_dict(resultado, cod, desc) if resultado else None
+        if res_dict is not None and preenche_campos_vazios(row, res_dict):
+            resultados_indice.append(([idx], res_dict))
+        else:
+            # Linhas com a mesma consulta são classificadas uma vez; o resultado volta para todas elas
+            itens.setdefault(chave_consulta(cod, desc), (cod, desc, []))[2].append(idx)
+
+    aplicar_enriquecimento(resultados_indice)
+
+    # 3. O restante é classificado pelo agente em segundo plano
+    if itens:
+        estado["worker"] = EnrichmentWorker(
+            recursos["linha"],
+            itens.values(),
+            cache=get_cached_result_cache(),
+            limiter=AdaptiveLimiter(inicial=MAX_CONCURRENT_REQUESTS, maximo=MAX_CONCURRENT_LIMIT),
+            metricas=get_cached_metricas().com_fonte("enriquecimento"),
+            retriever=indice,
+            roteador=recursos["roteador"],
+            excluir=em_enriquecimento,
+            loop=get_loop_agentes(),
+        ).iniciar()
+
+@st.fragment(run_every=5)
+def painel_enriquecimento():
+    """
+    Mostra o aquecimento e o andamento do enriquecimento, e grava os resultados em lotes.
+    A auto-classificação começa (uma vez por processo) assim que o aquecimento termina.
+    """
+    aquecimento = get_aquecimento()
+    if not aquecimento.done():
+        st.caption("⏳ Inicializando agente e base de conhecimento em segundo plano...")
+        return
+    if aquecimento.exception() is not None:
+        st.error(f"Falha ao inicializar o agente: {aquecimento.exception()}")
+        return
 
-            # Move low confidence
-            if res_dict['NIVEL_CONFIANCA'] != "ALTO":
-                 linha_para_mover = st.session_state.main_df.loc[linha_idx].to_dict()
-                 st.session_state.main_df.drop(linha_idx, inplace=True)
-                 st.session_state.inconsistencias_df = pd.concat(
-                    [st.session_state.inconsistencias_df, pd.DataFrame([linha_para_mover])],
-                    ignore_index=True
-                )
+    estado = get_enrichment_state()
+    with estado["lock"]:
+        iniciar = not estado["iniciado"]
+        estado["iniciado"] = True
+    if iniciar:
+        classificar_dados_agno()
 
-            salvar_dados()
+    worker = estado["worker"]
+    if worker is None:
+        return
 
-        except Exception as e:
-            # st.error(f"Erro item {idx}: {e}")
-            continue
+    aplicar_enriquecimento(worker.drenar(minimo=TAMANHO_COMMIT_ENRIQUECIMENTO))
 
-    status_text.text("Processo finalizado!")
-    time.sleep(1)
+    if worker.ativo:
+        st.caption(f"🔄 Enriquecendo base: {worker.concluidos}/{worker.total} ({worker.erros} erros)")
+        st.progress(worker.concluidos / max(worker.total, 1))
+    else:
+        st.caption(f"✅ Enriquecimento concluído: {worker.concluidos - worker.erros}/{worker.total} itens")
+
+def painel_metricas():
+    """Latência (p50/p95/p99), tokens e custo das chamadas ao agente desde o início do processo."""
+    metricas = get_cached_metricas()
+    resumo = metricas.resumo()
+    with st.expander("📊 Métricas do Agente"):
+        if resumo is None:
+            st.caption("Nenhuma chamada ao agente ainda.")
+            return
+        c1, c2, c3 = st.columns(3)
+        c1.metric("p50", f"{resumo['p50_s']:.1f}s")
+        c2.metric("p95", f"{resumo['p95_s']:.1f}s")
+        c3.metric("p99", f"{resumo['p99_s']:.1f}s")
+        st.caption(
+            f"{resumo['chamadas']} chamadas ({resumo['erros']} erros) · {resumo['linhas']} linhas · "
+            f"{resumo['ferramentas_por_chamada']:.1f} ferramentas/chamada · busca {resumo['busca_media_s']:.2f}s"
+        )
+        st.caption(
+            f"Tokens: {resumo['tokens_entrada']:,} entrada / {resumo['tokens_saida']:,} saída · "
+            f"Custo estimado: US$ {resumo['custo_usd']:.4f}"
+        )
+        por_fonte = {
+            fonte: metricas.resumo(fonte) for fonte in ["individual", "lote", "enriquecimento"]
+        }
+        st.dataframe(
+            pd.DataFrame([
+                {"Fonte": fonte, "Chamadas": r["chamadas"], "p50 (s)": round(r["p50_s"], 2),
+                 "p95 (s)": round(r["p95_s"], 2), "Custo (US$)": round(r["custo_usd"], 4)}
+                for fonte, r in por_fonte.items() if r is not None
+            ]),
+            hide_index=True,
+        )
+        painel_niveis(resumo["por_modelo"])
+        st.caption(f"Registros completos: `{metricas.path}`")
+
+def painel_niveis(por_modelo):
+    """Acertos e escalonamentos por nível de modelo (lote e enriquecimento), com o custo de cada modelo."""
+    # Sem esperar o aquecimento: a barra lateral não pode bloquear
+    aquecimento = get_aquecimento()
+    if not aquecimento.done() or aquecimento.exception() is not None:
+        return
+    estatisticas = [e for e in aquecimento.result()["roteador"].estatisticas() if e["linhas"]]
+    if not estatisticas:
+        return
+    st.caption("Roteamento por nível de modelo")
+    st.dataframe(
+        pd.DataFrame([
+            {"Modelo": e["nivel"], "Linhas": e["linhas"], "Aceitas": e["aceitas"],
+             "Escalonadas": e["escalonadas"], "Acerto": f"{e['taxa_acerto']:.0%}",
+             "Custo (US$)": round(por_modelo.get(e["nivel"], {}).get("custo_usd", 0.0), 4)}
+            for e in estatisticas
+        ]),
+        hide_index=True,
+    )
 
 # --- INICIALIZAÇÃO ---
 
-# 1. Carregar DataFrame
-carregar_dados()
-
-# 2. Inicializar Agente
-initialize_agent()
+# 1. Bases compartilhadas pelo processo (leitura do SQLite, sem agno)
+get_bases()
 
-# 3. Auto-Classificação na Inicialização (Agno)
-if "dados_classificados" not in st.session_state:
-    loading_placeholder = st.empty()
-    with loading_placeholder.container():
-        st.header("🚀 Iniciando Aplicação")
-        st.write("Aguarde enquanto enriquecemos a base de dados com Agno Agent...")
-        with st.spinner('Processando...'):
-             classificar_dados_agno()
+# 2. Índice, Base de Conhecimento e agentes aquecem em segundo plano; a página já é exibida.
+#    A auto-classificação começa pelo painel de enriquecimento quando o aquecimento termina.
+get_aquecimento()
 
-    loading_placeholder.empty()
-    st.session_state.dados_classificados = True
-    st.rerun()
+# 3. A sessão guarda apenas o identificador da conversa com o agente da busca individual
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
 
 # BARRA LATERAL
 st.sidebar.image("C:/Users/gustavo.santos/Documents/Imagens e Icones/Icones/hospital (1).png", width=60)
 st.sidebar.title("Classificador Agno")
+with st.sidebar:
+    painel_enriquecimento()
+    painel_metricas()
 page = st.sidebar.radio("Navegação", ["🔍 Busca Individual", "🚀 Busca em Lote", "🛠️ Corrigir e Treinar"])
 
 st.sidebar.markdown("---")
 st.sidebar.header("📩 Downloads")
 st.sidebar.download_button(
     "Baixar Base Oficial (.csv)",
-    st.session_state.main_df.to_csv(sep=";", index=False, encoding='utf-8').encode("utf-8"),
+    exportar_base_oficial(get_cached_store().versao()),
     "classificacao_procedimentos.csv"
 )
 
@@ -317,13 +562,22 @@ if page == "🔍 Busca Individual":
             st.warning("❗Por favor, insira pelo menos um campo.")
             st.stop()
 
-        query = f"Código: {input_cod}, Descrição: {input_desc}" if input_cod else f"Descrição: {input_desc}"
-
         with st.spinner("Consultando Agente Especialista..."):
             try:
-                agent = st.session_state.auditor_agent
-                response = agent.run(query)
-                resultado: ResultadoAuditoria = response.content
+                from src.classifier import classificar_item, result_to_dict
+
+                recursos = recursos_agente()
+                classificacao = classificar_item(
+                    recursos["individual"], input_cod, input_desc,
+                    indice=recursos["indice"],
+                    cache=get_cached_result_cache(),
+                    metricas=get_cached_metricas().com_fonte("individual"),
+                    retriever=recursos["indice"],
+                    # Agente compartilhado pelo processo: o histórico é o da sessão do usuário
+                    session_id=st.session_state.session_id,
+                )
+                resultado = classificacao.resultado
+                response = classificacao.response
 
                 exibir_resultado_agno(resultado)
 
@@ -331,20 +585,24 @@ if page == "🔍 Busca Individual":
                 res_dict = result_to_dict(resultado, input_cod, input_desc)
 
                 # Show tools usage if available
-                if hasattr(response, 'tools') and response.tools:
+                if classificacao.origem == "indice":
+                    st.caption("⚡ Item encontrado na Base Oficial (sem consulta ao agente).")
+                elif classificacao.origem == "cache":
+                    st.caption("⚡ Resultado recuperado do cache de classificações (sem consulta ao agente).")
+                elif classificacao.origem == "candidato":
+                    st.caption("⚡ Candidato quase idêntico na Base Oficial (sem consulta ao agente).")
+                elif hasattr(response, 'tools') and response.tools:
                     with st.expander("Ver Raciocínio (Tools)"):
                         st.write(response.tools)
 
                 # Persistência
                 if resultado.nivel_confianca == "ALTO":
-                    st.session_state.main_df = pd.concat([st.session_state.main_df, pd.DataFrame([res_dict])], ignore_index=True)
+                    inserir_registros("oficial", [res_dict])
                     st.toast("Salvo na Base Oficial", icon="✅")
                 else:
-                    st.session_state.inconsistencias_df = pd.concat([st.session_state.inconsistencias_df, pd.DataFrame([res_dict])], ignore_index=True)
+                    inserir_registros("inconsistencias", [res_dict])
                     st.toast("Enviado para Inconsistências", icon="⚠️")
 
-                salvar_dados()
-
             except Exception as e:
                 st.error(f"Erro no Agente: {e}")
 
@@ -356,77 +614,148 @@ elif page == "🚀 Busca em Lote":
     uploaded = st.file_uploader("Arquivo CSV", type=["csv"])
 
     if uploaded:
-        df_up = pd.read_csv(uploaded, sep=";", dtype=str, encoding='utf-8')
-        if "DESCRICAO_BUSCA" not in df_up.columns:
-            df_up = pd.read_csv(uploaded, sep=",", dtype=str, encoding='utf-8')
-
-        if "DESCRICAO_BUSCA" in df_up.columns:
-            st.info(f"{len(df_up)} registros carregados.")
-
-            if st.button("Iniciar Processamento"):
-                progress_bar = st.progress(0, "Iniciando...")
-
-                # Agno Agent might be rate limited if concurrent, but we try async wrapper
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                resultados = loop.run_until_complete(processar_lote_agno_async(df_up))
-
-                progress_bar.progress(100, "Concluído!")
-
-                novos_altos = [r for r in resultados if r.get("NIVEL_CONFIANCA") == "ALTO"]
-                novos_baixos = [r for r in resultados if r.get("NIVEL_CONFIANCA") != "ALTO"]
-
-                if novos_altos:
-                    st.session_state.main_df = pd.concat([st.session_state.main_df, pd.DataFrame(novos_altos)], ignore_index=True)
-                if novos_baixos:
-                    st.session_state.inconsistencias_df = pd.concat([st.session_state.inconsistencias_df, pd.DataFrame(novos_baixos)], ignore_index=True)
-
-                salvar_dados()
-
+        # Leitura em streaming: separador e encoding detectados, linhas lidas em chunks
+        formato = detectar_formato(uploaded)
+
+        if "DESCRICAO_BUSCA" in ler_colunas(uploaded, formato):
+            # O job id vem do conteúdo do arquivo: reenviar o mesmo arquivo retoma o job
+            job_id = st.text_input("ID do Job", value=gerar_job_id(uploaded))
+
+            # Uma passada pelas colunas de busca (contagem e duplicatas), uma vez por arquivo na sessão
+            resumos = st.session_state.setdefault("resumos_upload", {})
+            if job_id not in resumos:
+                resumos[job_id] = resumir_arquivo(uploaded, formato)
+            resumo = resumos[job_id]
+            total = resumo["linhas"]
+            st.info(
+                f"{total} registros ({formato.encoding}, separador `{formato.separador}`) · "
+                f"{resumo['unicas']} consultas distintas "
+                f"({resumo['taxa_deduplicacao']:.0%} repetidas, classificadas uma única vez)."
+            )
+
+            retomando = BatchCheckpoint.existe(job_id)
+            checkpoint = BatchCheckpoint(job_id, COLS_FULL, total=total)
+            if retomando and not checkpoint.concluido:
+                st.warning(f"Job interrompido encontrado: {checkpoint.processadas}/{checkpoint.total} linhas já processadas. O processamento continuará a partir daí.")
+
+            # Só quem adquire o job grava nele; outra sessão com o mesmo arquivo apenas acompanha
+            if st.button("Retomar Processamento" if checkpoint.processadas else "Iniciar Processamento"):
+                if not checkpoint.adquirir():
+                    st.warning("Este arquivo já está sendo processado em outra sessão.")
+                else:
+                    try:
+                        progress_bar = st.progress(checkpoint.processadas / max(total, 1), "Iniciando...")
+                        status_lote = st.empty()
+
+                        inicio = time.perf_counter()
+                        inicial = checkpoint.processadas
+                        for chunk in ler_em_chunks(uploaded, formato, TAMANHO_CHUNK, pular=checkpoint.processadas):
+                            checkpoint.append(processar_lote_agno(chunk))
+
+                            feitas = checkpoint.processadas
+                            taxa = (feitas - inicial) / max(time.perf_counter() - inicio, 1e-6)
+                            eta = (total - feitas) / taxa if taxa else 0
+                            progress_bar.progress(min(feitas / max(total, 1), 1.0), f"{feitas}/{total} linhas")
+                            limiter = obter_limitador()
+                            status_lote.caption(
+                                f"⏱️ {taxa:.1f} linhas/s · ETA {eta / 60:.1f} min · "
+                                f"Concorrência {int(limiter.limite)} · Job `{job_id}`"
+                            )
+
+                        progress_bar.progress(1.0, "Concluído!")
+                    finally:
+                        checkpoint.liberar()
+
+            if checkpoint.concluido:
+                # As bases só recebem o job uma vez, a partir do checkpoint completo, em partes;
+                # uma mescla interrompida continua depois da última parte gravada
+                if not checkpoint.meta["mesclado"] and checkpoint.adquirir():
+                    try:
+                        # adquirir() relê o progresso: outra sessão pode ter mesclado nesse meio tempo
+                        if not checkpoint.meta["mesclado"]:
+                            for parte in checkpoint.ler_resultados(chunksize=TAMANHO_MESCLA, pular=checkpoint.mescladas):
+                                novos_altos = parte[parte["NIVEL_CONFIANCA"] == "ALTO"]
+                                inserir_registros("oficial", novos_altos)
+                                inserir_registros("inconsistencias", parte[parte["NIVEL_CONFIANCA"] != "ALTO"])
+                                checkpoint.registrar_mescla(len(parte))
+                            checkpoint.marcar_mesclado()
+                        # Com a posse do job, a contagem fica guardada no checkpoint
+                        checkpoint.contar_confianca()
+                    finally:
+                        checkpoint.liberar()
+
+                confiancas = checkpoint.contar_confianca()
+                altos = confiancas.get("ALTO", 0)
                 c1, c2 = st.columns(2)
-                c1.success(f"✅ {len(novos_altos)} salvos na Base Oficial")
-                c2.warning(f"⚠️ {len(novos_baixos)} enviados para Inconsistências")
+                c1.success(f"✅ {altos} salvos na Base Oficial")
+                c2.warning(f"⚠️ {sum(confiancas.values()) - altos} enviados para Inconsistências")
 
-                df_resultado_lote = pd.DataFrame(resultados)
+                # O download é o próprio arquivo do checkpoint, lido só quando pedido
                 st.download_button(
                     "📥 Baixar Resultado",
-                    df_resultado_lote.to_csv(sep=";", index=False, encoding='utf-8').encode("utf-8"),
+                    leitor_arquivo(checkpoint.path_resultados),
                     "resultado_lote.csv",
                     "text/csv"
                 )
+        else:
+            st.error("❗O arquivo não tem a coluna DESCRICAO_BUSCA.")
 
-# PÁGINA 3: CORREÇÃO (MANTIDA IGUAL MAS SALVA NA BASE QUE SERÁ INPUT DO AGENTE)
+# PÁGINA 3: CORREÇÃO (FILA PAGINADA; SÓ AS LINHAS EDITADAS OU SELECIONADAS VÃO PARA A BASE OFICIAL)
 elif page == "🛠️ Corrigir e Treinar":
     st.header("Correção de Inconsistências")
+    store = get_cached_store()
+
+    if store.contar("inconsistencias"):
+        # Filtros e paginação rodam no SQLite: só a página exibida é carregada
+        f1, f2, f3, f4 = st.columns([1, 2, 2, 1])
+        confianca = f1.multiselect("Confiança", store.valores_distintos("inconsistencias", "NIVEL_CONFIANCA"))
+        segmentacoes = f2.multiselect("Segmentação", store.valores_distintos("inconsistencias", "SEGMENTACAO"))
+        periodo = f3.date_input("Data de modificação", value=(), format="DD/MM/YYYY")
+        tamanho_pagina = f4.selectbox("Linhas por página", TAMANHOS_PAGINA_CORRECAO)
+        data_inicio = periodo[0] if len(periodo) > 0 else None
+        data_fim = periodo[1] if len(periodo) > 1 else data_inicio
+
+        filtros = dict(confianca=confianca, segmentacoes=segmentacoes, data_inicio=data_inicio, data_fim=data_fim)
+        _, total = store.filtrar("inconsistencias", limite=0, **filtros)
+        n_paginas = max(1, -(-total // tamanho_pagina))
+        pagina = st.number_input(f"Página (de {n_paginas})", min_value=1, max_value=n_paginas, value=1, step=1)
+        df_pagina, total = store.filtrar(
+            "inconsistencias", limite=tamanho_pagina, deslocamento=(pagina - 1) * tamanho_pagina, **filtros
+        )
+        st.caption(f"{total} inconsistências no filtro · exibindo {len(df_pagina)}. Valide antes de trocar de página ou filtro.")
 
-    if not st.session_state.inconsistencias_df.empty:
-        df_edit = st.session_state.inconsistencias_df.copy()
-        df_edit.insert(0, "STATUS", df_edit["NIVEL_CONFIANCA"].apply(lambda x: "🔴" if x == "BAIXO" else "🟡"))
+        df_pagina.insert(0, "STATUS", df_pagina["NIVEL_CONFIANCA"].eq("BAIXO").map({True: "🔴", False: "🟡"}))
+        df_pagina.insert(0, "VALIDAR", False)
+        # Cada página/filtro tem seu próprio estado de edição
+        chave_editor = f"editor_fix_{hash((str(filtros), tamanho_pagina, pagina))}"
 
         edited_df = st.data_editor(
-            df_edit,
+            df_pagina,
             use_container_width=True,
             num_rows="fixed",
-            key="editor_fix",
+            key=chave_editor,
             column_config={
+                "VALIDAR": st.column_config.CheckboxColumn("Validar", width="small"),
                 "STATUS": st.column_config.TextColumn("Status", disabled=True, width="small"),
                 "JUSTIFICATIVA": st.column_config.TextColumn("Justificativa IA", disabled=True)
             },
             hide_index=True,
         )
 
-        if st.button("💾 Validar e Mover para Base Oficial"):
-            if "STATUS" in edited_df.columns:
-                edited_df = edited_df.drop(columns=["STATUS"])
+        # Linhas editadas (qualquer coluna) ou marcadas em "Validar"; o resto da fila não é tocado
+        posicoes = set(st.session_state[chave_editor]["edited_rows"]) | set(
+            (edited_df["VALIDAR"].to_numpy().nonzero()[0]).tolist()
+        )
+        selecionadas = edited_df.iloc[sorted(posicoes)]
 
-            edited_df["NIVEL_CONFIANCA"] = "ALTO"
-            edited_df["JUSTIFICATIVA"] = "Validado Manualmente"
+        if st.button(f"💾 Validar e Mover para Base Oficial ({len(selecionadas)})", disabled=selecionadas.empty):
+            linhas = selecionadas.drop(columns=["VALIDAR", "STATUS"])
+            linhas["NIVEL_CONFIANCA"] = "ALTO"
+            linhas["JUSTIFICATIVA"] = "Validado Manualmente"
 
-            st.session_state.main_df = pd.concat([st.session_state.main_df, edited_df], ignore_index=True)
-            st.session_state.inconsistencias_df = pd.DataFrame(columns=COLS_FULL)
+            mover_registros("inconsistencias", "oficial", linhas)
 
-            salvar_dados()
-            st.success("Base atualizada! (Nota: Reinicie o app para re-treinar a Base de Conhecimento com novos dados)")
+            st.success(f"{len(linhas)} linhas validadas! A Base de Conhecimento já foi sincronizada com os novos dados.")
             st.rerun()
     else:
         st.success("🎉 Nenhuma inconsistência pendente!")
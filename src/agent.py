@@ -2,7 +2,7 @@ from agno.agent import Agent
 from agno.models.google import Gemini
 from agno.db.sqlite import SqliteDb
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 
 class ResultadoAuditoria(BaseModel):
     codigo_sugerido: str = Field(
@@ -46,42 +46,129 @@ class ResultadoAuditoria(BaseModel):
         description="Abreviatura do procedimento, se houver."
     )
 
-def get_auditor_agent(knowledge_base, storage_path="tmp/agent_storage.db"):
+class ResultadoAuditoriaLinha(ResultadoAuditoria):
+    id_linha: str = Field(
+       ...,
+        description="Identificador da linha de entrada. Copie exatamente o valor recebido."
+    )
+
+class ResultadoLote(BaseModel):
+    resultados: List[ResultadoAuditoriaLinha] = Field(
+       ...,
+        description="Um resultado para cada linha de entrada, identificado pelo id_linha."
+    )
+
+AGENT_MODEL_ID = "gemini-2.0-flash"
+
+# Tiered routing (src/routing.py): rows go to the first model and move to the next one
+# only when the answer has one of ESCALATION_CONFIDENCE, fails the schema or has an
+# invalid code. With a single tier every row is answered by that model.
+MODEL_TIERS = ["gemini-2.0-flash-lite", AGENT_MODEL_ID]
+ESCALATION_CONFIDENCE = ["MEDIO", "BAIXO"]
+
+AGENT_DESCRIPTION = "Você é um Auditor Médico Senior especializado em codificação de procedimentos hospitalares (TUSS/CBHPM/ANS)."
+
+SEARCH_INSTRUCTION = "Consulte SEMPRE a base de conhecimento para encontrar o código correspondente."
+
+AGENT_INSTRUCTIONS = [
+    "Sua tarefa é classificar procedimentos médicos com base na descrição fornecida.",
+    SEARCH_INSTRUCTION,
+    "Se a descrição for exata ou muito similar, retorne o código da base e confiança ALTO.",
+    "Se houver dúvida ou ambiguidade, use confiança MEDIO ou BAIXO e justifique.",
+    "O campo 'codigo_sugerido' deve ter exatamente 8 dígitos numéricos. Se não encontrar, deixe vazio ou indique erro na justificativa.",
+    "Preencha todos os campos auxiliares (segmentacao, item, etc) conforme encontrado na base.",
+]
+
+BATCH_INSTRUCTIONS = [
+    "Você receberá várias linhas, uma por linha de texto, no formato 'id_linha | Código | Descrição'.",
+    "Classifique cada linha de forma independente e retorne exatamente um item em 'resultados' para cada id_linha recebido.",
+]
+
+# Replace SEARCH_INSTRUCTION when the candidates come in the query (src/retriever.py)
+CANDIDATE_INSTRUCTIONS = [
+    "A consulta já traz os candidatos mais próximos da Base Oficial, com código, descrição, campos e similaridade.",
+    "Escolha o candidato que corresponde à descrição e copie seu código e campos auxiliares.",
+    "Se nenhum candidato corresponder, use confiança BAIXO e explique na justificativa.",
+]
+
+# Session storage of the interactive agent (pruned by src.maintenance)
+STORAGE_PATH = "tmp/agent_storage.db"
+SESSION_TABLE = "auditor_sessions"
+# Previous runs resent to the model by the interactive agent
+HISTORY_RUNS = 3
+
+def agent_config_signature(tiers=None, escalation_confidence=ESCALATION_CONFIDENCE):
+    """
+    Returns a string describing the agent configuration that affects its answers
+    (model id, description and instructions). Used to invalidate cached results.
+    With tiers (tiered routing) the tier models and escalation levels replace the model id.
+    """
+    modelos = [AGENT_MODEL_ID] if tiers is None else [*tiers, *escalation_confidence]
+    return "\n".join([*modelos, AGENT_DESCRIPTION, *AGENT_INSTRUCTIONS, *BATCH_INSTRUCTIONS, *CANDIDATE_INSTRUCTIONS])
+
+def get_auditor_agent(
+    knowledge_base,
+    storage_path=STORAGE_PATH,
+    output_schema=ResultadoAuditoria,
+    instructions=None,
+    model=None,
+    num_history_runs=HISTORY_RUNS,
+    candidatos=False,
+    model_id=AGENT_MODEL_ID,
+):
     """
     Returns a configured Agno Agent for Medical Auditing.
+    With storage_path=None the agent is stateless: no session writes and no history,
+    for classification paths where every row is independent. Otherwise only the last
+    num_history_runs runs are resent to the model.
+    With candidatos=True the search tool is disabled and the agent answers from the
+    candidates injected in the query, in a single model turn.
+    `model` replaces the Gemini model (e.g. src.fakes.FakeAuditorModel in benchmarks);
+    model_id chooses the Gemini model otherwise.
     """
+    instructions = instructions or AGENT_INSTRUCTIONS
+    if candidatos:
+        instructions = [i for i in instructions if i != SEARCH_INSTRUCTION] + CANDIDATE_INSTRUCTIONS
 
     # Storage for sessions (history)
     db = SqliteDb(
-        table_name="auditor_sessions",
-        db_url=f"sqlite:///{storage_path}"
-    )
+        session_table=SESSION_TABLE,
+        db_file=storage_path,
+    ) if storage_path else None
 
     agent = Agent(
         name="Auditor Médico",
-        model=Gemini(
-            id="gemini-2.0-flash",
-            structured_outputs=True,
+        # Gemini uses native structured outputs for output_schema
+        model=model or Gemini(
+            id=model_id,
             temperature=0.1
         ),
         knowledge=knowledge_base,
-        search_knowledge=True,
+        search_knowledge=not candidatos,
         # Persist session history using SqliteDb (passed to 'db' param)
         db=db,
-        output_schema=ResultadoAuditoria,
-        description="Você é um Auditor Médico Senior especializado em codificação de procedimentos hospitalares (TUSS/CBHPM/ANS).",
-        instructions=[
-            "Sua tarefa é classificar procedimentos médicos com base na descrição fornecida.",
-            "Consulte SEMPRE a base de conhecimento para encontrar o código correspondente.",
-            "Se a descrição for exata ou muito similar, retorne o código da base e confiança ALTO.",
-            "Se houver dúvida ou ambiguidade, use confiança MEDIO ou BAIXO e justifique.",
-            "O campo 'codigo_sugerido' deve ter exatamente 8 dígitos numéricos. Se não encontrar, deixe vazio ou indique erro na justificativa.",
-            "Preencha todos os campos auxiliares (segmentacao, item, etc) conforme encontrado na base.",
-        ],
-        show_tool_calls=True,
+        output_schema=output_schema,
+        description=AGENT_DESCRIPTION,
+        instructions=instructions,
         markdown=True,
-        # We enable history accumulation by default for interactive sessions
-        add_history_to_messages=True,
+        # Interactive sessions keep a bounded history window; stateless agents keep none
+        add_history_to_context=db is not None,
+        num_history_runs=num_history_runs,
     )
 
     return agent
+
+def get_batch_auditor_agent(knowledge_base, storage_path=None, model=None, candidatos=False, model_id=AGENT_MODEL_ID):
+    """
+    Returns an Auditor Agent that classifies several rows per call (ResultadoLote output).
+    Stateless by default, since packed rows never need the session history.
+    """
+    return get_auditor_agent(
+        knowledge_base,
+        storage_path=storage_path,
+        output_schema=ResultadoLote,
+        instructions=AGENT_INSTRUCTIONS + BATCH_INSTRUCTIONS,
+        model=model,
+        candidatos=candidatos,
+        model_id=model_id,
+    )
@@ -0,0 +1,276 @@
+"""
+Headless batch classification.
+
+Splits an input CSV (with a DESCRICAO_BUSCA column) into contiguous shards and
+classifies them in parallel worker processes, each with its own agents, event loop
+and adaptive limiter. Workers stream their row range from the file, so memory does
+not grow with the input size. Every shard is checkpointed, so an interrupted job
+resumes where it stopped when run again with the same file (or --job-id). The
+combined results are written as official (ALTO) and inconsistency outputs.
+Rows go through the model tiers (src/routing.py): the cheapest model answers first
+and only uncertain or invalid answers are escalated.
+
+Usage:
+    python -m src.batch entrada.csv [--workers 8] [--saida tmp/saida_lote] [--mesclar]
+                        [--niveis gemini-2.0-flash-lite gemini-2.0-flash] [--escalonar MEDIO BAIXO]
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from dotenv import load_dotenv
+
+from src.agent import ESCALATION_CONFIDENCE, MODEL_TIERS, agent_config_signature
+from src.cache import ResultCache, calcular_fingerprint
+from src.checkpoint import BatchCheckpoint, gerar_job_id
+from src.classifier import aclassificar_lote
+from src.concurrency import AdaptiveLimiter
+from src.database import build_knowledge_base, initialize_knowledge_base, sync_knowledge_rows
+from src.metrics import MetricsRecorder
+from src.retriever import CandidateRetriever
+from src.routing import get_roteador, somar_estatisticas
+from src.storage import COLS_FULL, DB_PATH, ProcedureStore
+from src.upload import COLUNA_BUSCA, detectar_formato, ler_colunas, ler_em_chunks, resumir_arquivo
+from src.utils import chaves_consulta
+
+SAIDA_DIR = "tmp/saida_lote"
+# Rows per checkpoint inside each worker
+CHUNK_SIZE = 200
+# Rows per chunk when combining shards and writing the outputs
+CHUNK_SAIDA = 10_000
+# Rows per packed agent call (1 = one call per row)
+TAMANHO_PACOTE = 10
+# Initial and maximum AIMD concurrency of each worker
+CONCORRENCIA = 5
+CONCORRENCIA_MAX = 32
+
+
+def configurar_ambiente():
+    """Loads .env and exposes the project key as GOOGLE_API_KEY (also run in each worker)."""
+    load_dotenv()
+    if os.getenv("API_PROJETOS_UNI_GMINAI"):
+        os.environ["GOOGLE_API_KEY"] = os.getenv("API_PROJETOS_UNI_GMINAI")
+
+
+def abrir_entrada(csv_path):
+    """Sniffs the input CSV format (delimiter and encoding) and checks the DESCRICAO_BUSCA column."""
+    formato = detectar_formato(csv_path)
+    if COLUNA_BUSCA not in ler_colunas(csv_path, formato):
+        raise ValueError(f"{csv_path} não tem a coluna {COLUNA_BUSCA}.")
+    return formato
+
+
+def _job_id_arquivo(csv_path):
+    with open(csv_path, "rb") as f:
+        return gerar_job_id(f)
+
+
+def _id_fatia(job_id, workers, fatia):
+    # Shard boundaries depend on the number of workers, so it is part of the shard id
+    return f"{job_id}-{workers}w-{fatia:03d}"
+
+
+def _limites_fatias(total, workers):
+    # Contiguous [inicio, fim) row ranges, the first `total % workers` one row longer
+    base, resto = divmod(total, workers)
+    inicio = 0
+    for fatia in range(workers):
+        fim = inicio + base + (fatia < resto)
+        yield inicio, fim
+        inicio = fim
+
+
+def _processar_fatia(fatia, csv_path, formato, inicio_fatia, fim_fatia, job_id, opcoes):
+    """Worker process: streams rows [inicio_fatia, fim_fatia) of the input and classifies them into its own checkpoint."""
+    configurar_ambiente()
+    total = fim_fatia - inicio_fatia
+    checkpoint = BatchCheckpoint(_id_fatia(job_id, opcoes["workers"], fatia), COLS_FULL, total=total)
+    if checkpoint.concluido:
+        return fatia, checkpoint.processadas, []
+
+    # The parent already synced the knowledge base; workers only read it
+    kb = build_knowledge_base()
+    # Stateless agents per model tier: rows are independent, so nothing is written to session storage
+    # Candidates from the local retriever go in the query, so the agents skip the search tool
+    roteador = get_roteador(kb, opcoes["niveis"], opcoes["escalonar"], candidatos=True)
+
+    store = ProcedureStore(opcoes["db_path"])
+    indice = CandidateRetriever(store.carregar("oficial"))
+    cache = ResultCache(fingerprint=calcular_fingerprint(
+        store.geracao(), agent_config_signature(opcoes["niveis"], opcoes["escalonar"])
+    ))
+    limiter = AdaptiveLimiter(inicial=opcoes["concorrencia"], maximo=opcoes["concorrencia_max"])
+    metricas = MetricsRecorder(fonte="lote-cli")
+
+    async def _executar():
+        inicio = time.perf_counter()
+        inicial = checkpoint.processadas
+        pular = inicio_fatia + checkpoint.processadas
+        for chunk in ler_em_chunks(csv_path, formato, opcoes["chunk_size"], pular=pular):
+            chunk = chunk.iloc[:total - checkpoint.processadas]
+            if chunk.empty:
+                break
+            checkpoint.append(await aclassificar_lote(
+                chunk, roteador.agent, roteador.agent_lote, indice=indice, cache=cache, limiter=limiter,
+                metricas=metricas, tamanho_pacote=opcoes["tamanho_pacote"], retriever=indice, roteador=roteador,
+            ))
+            taxa = (checkpoint.processadas - inicial) / max(time.perf_counter() - inicio, 1e-6)
+            print(
+                f"[fatia {fatia}] {checkpoint.processadas}/{total} linhas | "
+                f"{taxa:.1f} linhas/s | concorrência {int(limiter.limite)}",
+                flush=True,
+            )
+
+    with checkpoint:
+        asyncio.run(_executar())
+    return fatia, checkpoint.processadas, roteador.estatisticas()
+
+
+def classificar_csv(
+    csv_path,
+    saida_dir=SAIDA_DIR,
+    workers=None,
+    job_id=None,
+    chunk_size=CHUNK_SIZE,
+    tamanho_pacote=TAMANHO_PACOTE,
+    concorrencia=CONCORRENCIA,
+    concorrencia_max=CONCORRENCIA_MAX,
+    mesclar=False,
+    db_path=DB_PATH,
+    niveis=MODEL_TIERS,
+    confianca_escalonar=ESCALATION_CONFIDENCE,
+    log=print,
+):
+    """
+    Classifies csv_path across `workers` processes and writes resultado.csv,
+    oficial.csv and inconsistencias.csv to saida_dir. With mesclar=True the results
+    are also inserted into the store (once per job). `niveis` are the model tiers and
+    confianca_escalonar the confidence levels escalated to the next tier.
+    Returns run stats, with the per-tier hit/escalation counts of this run.
+    """
+    formato = abrir_entrada(csv_path)
+    resumo = resumir_arquivo(csv_path, formato)
+    total = resumo["linhas"]
+    workers = max(1, min(workers or os.cpu_count() or 1, total or 1))
+    job_id = job_id or _job_id_arquivo(csv_path)
+    checkpoint = BatchCheckpoint(job_id, COLS_FULL, total=total)
+    store = ProcedureStore(db_path)
+
+    # One sync before the workers start, so they never race on the knowledge base
+    kb = initialize_knowledge_base(store.carregar("oficial"))
+    cache = ResultCache(fingerprint=calcular_fingerprint(store.geracao(), agent_config_signature(niveis, confianca_escalonar)))
+
+    # The job checkpoint is owned for the whole run, so another run of the same job cannot write to it
+    with checkpoint:
+        inicio = time.perf_counter()
+        estatisticas_niveis = []
+        if not checkpoint.concluido:
+            opcoes = {
+                "chunk_size": chunk_size, "tamanho_pacote": tamanho_pacote,
+                "concorrencia": concorrencia, "concorrencia_max": concorrencia_max, "db_path": db_path, "workers": workers,
+                "niveis": list(niveis), "escalonar": list(confianca_escalonar),
+            }
+            fatias = list(_limites_fatias(total, workers))
+            log(f"Job {job_id}: {total} linhas em {workers} processos ({formato.encoding}, separador {formato.separador!r})")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+                futuros = [
+                    executor.submit(_processar_fatia, fatia, csv_path, formato, inicio_fatia, fim_fatia, job_id, opcoes)
+                    for fatia, (inicio_fatia, fim_fatia) in enumerate(fatias)
+                ]
+                for futuro in as_completed(futuros):
+                    fatia, processadas, niveis_fatia = futuro.result()
+                    estatisticas_niveis.append(niveis_fatia)
+                    log(f"Fatia {fatia} concluída ({processadas} linhas)")
+
+            # Shards are appended in input order to the job checkpoint, skipping the rows
+            # an interrupted previous run already committed
+            ja_gravadas = checkpoint.processadas
+            for fatia, (inicio_fatia, fim_fatia) in enumerate(fatias):
+                parcial = BatchCheckpoint(_id_fatia(job_id, workers, fatia), COLS_FULL, total=fim_fatia - inicio_fatia)
+                for parte in parcial.ler_resultados(chunksize=CHUNK_SAIDA):
+                    pular = min(ja_gravadas, len(parte))
+                    ja_gravadas -= pular
+                    if len(parte) > pular:
+                        checkpoint.append(parte.iloc[pular:].to_dict("records"))
+
+        # Outputs and merge stream the job checkpoint in chunks
+        os.makedirs(saida_dir, exist_ok=True)
+        path_resultado = os.path.join(saida_dir, "resultado.csv")
+        path_oficial = os.path.join(saida_dir, "oficial.csv")
+        path_inconsistencias = os.path.join(saida_dir, "inconsistencias.csv")
+        mesclar = mesclar and not checkpoint.meta["mesclado"]
+        n_altos = n_baixos = 0
+        for n, parte in enumerate(checkpoint.ler_resultados(chunksize=CHUNK_SAIDA)):
+            altos = parte[parte["NIVEL_CONFIANCA"] == "ALTO"]
+            baixos = parte[parte["NIVEL_CONFIANCA"] != "ALTO"]
+            modo, cabecalho = ("w", True) if n == 0 else ("a", False)
+            parte.to_csv(path_resultado, sep=";", index=False, encoding="utf-8", mode=modo, header=cabecalho)
+            altos.to_csv(path_oficial, sep=";", index=False, encoding="utf-8", mode=modo, header=cabecalho)
+            baixos.to_csv(path_inconsistencias, sep=";", index=False, encoding="utf-8", mode=modo, header=cabecalho)
+            n_altos += len(altos)
+            n_baixos += len(baixos)
+
+            # An interrupted merge resumes after the last chunk it recorded
+            if mesclar and n * CHUNK_SAIDA >= checkpoint.mescladas:
+                store.inserir("oficial", altos)
+                store.inserir("inconsistencias", baixos)
+                sync_knowledge_rows(kb, altos)
+                # Cached answers of the merged queries (under any fingerprint) give way to the new rows
+                cache.invalidar(chaves_consulta(altos))
+                checkpoint.registrar_mescla(len(parte))
+        if mesclar:
+            checkpoint.marcar_mesclado()
+
+    decorrido = time.perf_counter() - inicio
+    linhas = n_altos + n_baixos
+    return {
+        "job_id": job_id,
+        "linhas": linhas,
+        "consultas_unicas": resumo["unicas"],
+        "taxa_deduplicacao": resumo["taxa_deduplicacao"],
+        "oficial": n_altos,
+        "inconsistencias": n_baixos,
+        "workers": workers,
+        "segundos": round(decorrido, 2),
+        "linhas_por_segundo": round(linhas / decorrido, 1) if decorrido else 0.0,
+        "niveis": somar_estatisticas(*estatisticas_niveis),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classificação em lote sem interface (multiprocesso).")
+    parser.add_argument("csv", help="CSV de entrada com a coluna DESCRICAO_BUSCA (';' ou ',', utf-8).")
+    parser.add_argument("--saida", default=SAIDA_DIR, help="Diretório dos CSVs de saída.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processos de classificação.")
+    parser.add_argument("--job-id", default=None, help="ID do job (padrão: hash do arquivo, para retomar).")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Linhas por checkpoint em cada processo.")
+    parser.add_argument("--pacote", type=int, default=TAMANHO_PACOTE, help="Linhas por chamada do agente.")
+    parser.add_argument("--concorrencia", type=int, default=CONCORRENCIA, help="Chamadas simultâneas iniciais por processo.")
+    parser.add_argument("--concorrencia-max", type=int, default=CONCORRENCIA_MAX, help="Chamadas simultâneas máximas por processo.")
+    parser.add_argument("--mesclar", action="store_true", help="Grava os resultados na Base Oficial/Inconsistências.")
+    parser.add_argument("--niveis", nargs="+", default=MODEL_TIERS, help="Modelos em ordem de escalonamento (mais barato primeiro).")
+    parser.add_argument("--escalonar", nargs="+", default=ESCALATION_CONFIDENCE, help="Níveis de confiança enviados ao próximo modelo.")
+    args = parser.parse_args()
+
+    configurar_ambiente()
+    stats = classificar_csv(
+        args.csv,
+        saida_dir=args.saida,
+        workers=args.workers,
+        job_id=args.job_id,
+        chunk_size=args.chunk_size,
+        tamanho_pacote=args.pacote,
+        concorrencia=args.concorrencia,
+        concorrencia_max=args.concorrencia_max,
+        mesclar=args.mesclar,
+        niveis=args.niveis,
+        confianca_escalonar=args.escalonar,
+    )
+    print(f"Lote concluído: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Offline benchmark suite.
+
+Runs the main code paths against synthetic official bases, with FakeAuditorModel and
+FakeEmbedder (src/fakes.py) in place of Gemini, so throughput can be compared across
+changes without network access or API costs. Each run writes a JSON report (plus a
+flat CSV) to tmp/benchmarks; pass --comparar with a previous report to print ratios.
+
+Usage:
+    python -m src.benchmark [--tamanhos 1000 10000 100000] [--concorrencias 1 5 10 20]
+                            [--latencia 0.5] [--taxa-erro 0.02] [--comparar tmp/benchmarks/<run>.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from src.agent import get_auditor_agent, get_batch_auditor_agent
+from src.cache import ResultCache
+from src.classifier import aclassificar_lote, classificar_item
+from src.concurrency import AdaptiveLimiter
+from src.database import initialize_knowledge_base, sync_knowledge_rows
+from src.enrichment import EnrichmentWorker
+from src.fakes import FakeAuditorModel, FakeEmbedder
+from src.lookup import LookupIndex
+from src.retriever import CandidateRetriever
+from src.routing import get_roteador
+from src.rules import preencher_por_regras
+from src.storage import COLS_FULL, ProcedureStore
+from src.vector_index import manter_indices
+
+RELATORIOS_DIR = "tmp/benchmarks"
+TAMANHOS = [1_000, 10_000, 100_000]
+CONCORRENCIAS = [1, 5, 10, 20]
+# Upper bound of rows sent to the (fake) agent per scenario, so 100k bases stay practical
+LINHAS_AGENTE = 2_000
+CONSULTAS = 1_000
+
+_PALAVRAS = [
+    "SESSAO", "CONSULTA", "FISIOTERAPIA", "HEMOGRAMA", "DIARIA", "TAXA", "CURATIVO",
+    "RESSONANCIA", "TOMOGRAFIA", "DIPIRONA", "SORO", "SERINGA", "AVALIACAO", "TERAPIA",
+    "OCUPACIONAL", "FONOAUDIOLOGIA", "GLICEMIA", "URINA", "CATETER", "ANTIBIOTICO",
+]
+_ITENS = ["SERVIÇO", "MEDICAMENTOS", "MATERIAIS", "TAXAS", "DIARIAS"]
+_SEGMENTACOES = ["SAT", "SAD", "LABORATORIO", "HONORARIO MEDICO", "PACOTE"]
+
+
+def gerar_base(n, seed=0, taxa_vazios=0.1):
+    """Synthetic official base with n unique rows; taxa_vazios of them lack ITEM/SEGMENTACAO."""
+    rng = random.Random(seed)
+    linhas = []
+    for i in range(n):
+        vazio = rng.random() < taxa_vazios
+        linhas.append({
+            "CODIGO": f"{10_000_000 + i:08d}",
+            "DESCRICAO": " ".join(rng.sample(_PALAVRAS, 3)) + f" {i}",
+            "ITEM": "" if vazio else rng.choice(_ITENS),
+            "SEGMENTACAO": "" if vazio else rng.choice(_SEGMENTACOES),
+            "NIVEL_CONFIANCA": "ALTO",
+            "DATA_MODIFICACAO": "01/01/2025",
+        })
+    return pd.DataFrame(linhas).reindex(columns=COLS_FULL).fillna("")
+
+
+def gerar_upload(n, seed=1):
+    """Synthetic batch upload (DESCRICAO_BUSCA only, none of it known to the base)."""
+    rng = random.Random(seed)
+    return pd.DataFrame({"DESCRICAO_BUSCA": [" ".join(rng.sample(_PALAVRAS, 4)) + f" NOVO {i}" for i in range(n)]})
+
+
+def _cronometrar(funcao, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcao(*args, **kwargs)
+    return resultado, time.perf_counter() - inicio
+
+
+class Benchmark:
+    """Runs every scenario for one base size inside a scratch directory."""
+
+    def __init__(self, tamanho, dir_trabalho, concorrencias, latencia, taxa_erro, linhas_agente, seed=0):
+        self.tamanho = tamanho
+        self.dir = dir_trabalho
+        self.concorrencias = concorrencias
+        self.latencia = latencia
+        self.taxa_erro = taxa_erro
+        self.linhas_agente = min(linhas_agente, tamanho)
+        self.seed = seed
+        self.metricas = []
+        self.base = gerar_base(tamanho, seed)
+
+    def _caminho(self, nome):
+        return os.path.join(self.dir, nome)
+
+    def _registrar(self, cenario, metrica, valor, unidade, parametro=""):
+        self.metricas.append({
+            "tamanho": self.tamanho, "cenario": cenario, "parametro": str(parametro),
+            "metrica": metrica, "valor": round(valor, 6), "unidade": unidade,
+        })
+        print(f"[{self.tamanho}] {cenario} {parametro} {metrica}: {valor:.4f} {unidade}", flush=True)
+
+    def _modelo(self, **kwargs):
+        return FakeAuditorModel(**{"latencia": self.latencia, "taxa_erro": self.taxa_erro, "seed": self.seed, **kwargs})
+
+    def _roteador(self):
+        # Cheap tier: half the latency and fewer ALTO answers; the strong tier is the usual fake model
+        modelos = {
+            "rapido": self._modelo(id="fake-rapido", latencia=self.latencia / 2, taxa_alto=0.7),
+            "forte": self._modelo(id="fake-forte", taxa_alto=0.9),
+        }
+        return get_roteador(self.kb, niveis=list(modelos), candidatos=True, models=modelos)
+
+    def _agentes(self, nome=None, candidatos=False):
+        # With a name the single-row agent keeps a session (interactive use); otherwise stateless
+        storage = self._caminho(f"agent_{nome}.db") if nome else None
+        return (
+            get_auditor_agent(self.kb, storage_path=storage, model=self._modelo(), candidatos=candidatos),
+            get_batch_auditor_agent(self.kb, model=self._modelo(), candidatos=candidatos),
+        )
+
+    # --- cenários ---
+
+    def ingestao(self):
+        kwargs = dict(
+            embedder=FakeEmbedder(), uri=self._caminho("lancedb"), state_path=self._caminho("sync.json"),
+            embed_cache_path=self._caminho("embeddings.db"),
+        )
+        self.kb, segundos = _cronometrar(initialize_knowledge_base, self.base, **kwargs)
+        self._registrar("ingestao", "linhas_por_segundo", self.tamanho / segundos, "linhas/s", "inicial")
+        _, segundos = _cronometrar(initialize_knowledge_base, self.base, **kwargs)
+        self._registrar("ingestao", "segundos", segundos, "s", "resync_sem_mudancas")
+        _, segundos = _cronometrar(manter_indices, self.kb.vector_db, forcar=True)
+        self._registrar("ingestao", "segundos", segundos, "s", "indices_reconstrucao")
+
+    def consultas(self):
+        indice, segundos = _cronometrar(LookupIndex, self.base)
+        self._registrar("consultas", "segundos", segundos, "s", "indice_construcao")
+
+        rng = random.Random(self.seed)
+        amostra = [self.base.iloc[rng.randrange(self.tamanho)] for _ in range(CONSULTAS)]
+        agent, _ = self._agentes("consultas")
+        cache = ResultCache(path=self._caminho("cache.db"), fingerprint="benchmark")
+
+        inicio = time.perf_counter()
+        for linha in amostra:
+            classificar_item(agent, linha["CODIGO"], linha["DESCRICAO"], indice=indice, cache=cache)
+        self._registrar("consultas", "microsegundos_por_consulta", (time.perf_counter() - inicio) / CONSULTAS * 1e6, "us", "indice")
+
+        retriever, segundos = _cronometrar(CandidateRetriever, self.base)
+        self._registrar("consultas", "segundos", segundos, "s", "candidatos_construcao")
+        inicio = time.perf_counter()
+        for linha in amostra:
+            retriever.candidatos(linha["CODIGO"], linha["DESCRICAO"])
+        self._registrar("consultas", "microsegundos_por_consulta", (time.perf_counter() - inicio) / CONSULTAS * 1e6, "us", "candidatos")
+
+        latencias = []
+        for linha in amostra[:50]:
+            _, segundos = _cronometrar(self.kb.vector_db.search, linha["DESCRICAO"], limit=5)
+            latencias.append(segundos)
+        self._registrar("consultas", "ms_p50", statistics.median(latencias) * 1e3, "ms", "busca_vetorial")
+
+        desconhecidas = gerar_upload(20, seed=self.seed + 7)["DESCRICAO_BUSCA"]
+        erros = 0
+        inicio = time.perf_counter()
+        for desc in desconhecidas:
+            try:
+                classificar_item(agent, "", desc, indice=indice, add_history_to_context=False)
+            except Exception:
+                # Interactive lookups are not retried; simulated 429s surface as errors
+                erros += 1
+        self._registrar("consultas", "segundos_por_consulta", (time.perf_counter() - inicio) / len(desconhecidas), "s", "agente")
+        self._registrar("consultas", "erros", erros, "consultas", "agente")
+
+    def lote(self):
+        upload = gerar_upload(self.linhas_agente, seed=self.seed + 1)
+        indice = CandidateRetriever(self.base)
+        # "busca": the agent calls the search tool; "candidatos": candidates go in the query;
+        # "niveis": candidates plus tiered routing (cheap model first, escalation of uncertain rows)
+        for modo in ("busca", "candidatos", "niveis"):
+            retriever = indice if modo != "busca" else None
+            for concorrencia in self.concorrencias:
+                roteador = self._roteador() if modo == "niveis" else None
+                agent, agent_lote = (roteador.agent, roteador.agent_lote) if roteador else self._agentes(candidatos=retriever is not None)
+                limiter = AdaptiveLimiter(inicial=concorrencia, maximo=concorrencia)
+                resultados, segundos = _cronometrar(asyncio.run, aclassificar_lote(
+                    upload, agent, agent_lote, indice=indice, limiter=limiter, retriever=retriever, roteador=roteador,
+                ))
+                erros = sum(r["NIVEL_CONFIANCA"] == "ERRO" for r in resultados)
+                parametro = f"{modo},concorrencia={concorrencia}"
+                self._registrar("lote", "linhas_por_segundo", len(upload) / segundos, "linhas/s", parametro)
+                self._registrar("lote", "erros", erros, "linhas", parametro)
+                self._registrar("lote", "alto", sum(r["NIVEL_CONFIANCA"] == "ALTO" for r in resultados), "linhas", parametro)
+                for nivel in roteador.estatisticas() if roteador else []:
+                    self._registrar("lote", "taxa_acerto", nivel["taxa_acerto"], "fração", f"{parametro},{nivel['nivel']}")
+
+    def enriquecimento(self):
+        df = self.base.copy()
+        alteradas, segundos = _cronometrar(preencher_por_regras, df)
+        self._registrar("enriquecimento", "segundos", segundos, "s", "regras")
+        self._registrar("enriquecimento", "linhas", len(alteradas), "linhas", "regras")
+
+        vazias = df[(df["ITEM"] == "") | (df["SEGMENTACAO"] == "")].head(self.linhas_agente)
+        agent, _ = self._agentes()
+        worker = EnrichmentWorker(
+            agent, zip(vazias["CODIGO"], vazias["DESCRICAO"], ([id_linha] for id_linha in vazias.index)),
+            limiter=AdaptiveLimiter(inicial=max(self.concorrencias), maximo=max(self.concorrencias)),
+        )
+        inicio = time.perf_counter()
+        worker.iniciar()
+        while worker.ativo:
+            time.sleep(0.05)
+        segundos = time.perf_counter() - inicio
+        self._registrar("enriquecimento", "linhas_por_segundo", worker.total / max(segundos, 1e-9), "linhas/s", "agente")
+        self._registrar("enriquecimento", "erros", worker.erros, "linhas", "agente")
+
+    def gravacao(self):
+        # Old salvar_dados cost (full CSV rewrite) next to the row-level store operations
+        _, segundos = _cronometrar(self.base.to_csv, self._caminho("base.csv"), sep=";", index=False, encoding="latin1")
+        self._registrar("gravacao", "segundos", segundos, "s", "csv_completo")
+
+        store = ProcedureStore(self._caminho("procedimentos.db"), COLS_FULL)
+        _, segundos = _cronometrar(store.importar_csv, "oficial", self._caminho("base.csv"))
+        self._registrar("gravacao", "linhas_por_segundo", self.tamanho / segundos, "linhas/s", "importacao")
+
+        df = store.carregar("oficial")
+        _, segundos = _cronometrar(store.inserir, "oficial", self.base.head(1))
+        self._registrar("gravacao", "ms", segundos * 1e3, "ms", "inserir_1")
+
+        alteradas = df.head(100).assign(ITEM="SERVIÇO")
+        _, segundos = _cronometrar(store.atualizar, "oficial", alteradas)
+        self._registrar("gravacao", "ms", segundos * 1e3, "ms", "atualizar_100")
+
+        _, segundos = _cronometrar(store.mover, "oficial", "inconsistencias", df.iloc[100:200])
+        self._registrar("gravacao", "ms", segundos * 1e3, "ms", "mover_100")
+
+        _, segundos = _cronometrar(sync_knowledge_rows, self.kb, alteradas, None, self._caminho("sync.json"))
+        self._registrar("gravacao", "ms", segundos * 1e3, "ms", "sincronizar_kb_100")
+
+    def executar(self, cenarios):
+        # The knowledge base is needed by every other scenario
+        self.ingestao()
+        for cenario in cenarios:
+            if cenario != "ingestao":
+                getattr(self, cenario)()
+        return self.metricas
+
+
+CENARIOS = ["ingestao", "consultas", "lote", "enriquecimento", "gravacao"]
+
+
+def executar_benchmarks(
+    tamanhos=TAMANHOS,
+    concorrencias=CONCORRENCIAS,
+    latencia=0.5,
+    taxa_erro=0.0,
+    linhas_agente=LINHAS_AGENTE,
+    cenarios=CENARIOS,
+    seed=0,
+):
+    """Runs the selected scenarios for each base size and returns the report dict."""
+    metricas = []
+    for tamanho in tamanhos:
+        dir_trabalho = tempfile.mkdtemp(prefix=f"benchmark_{tamanho}_")
+        try:
+            metricas += Benchmark(
+                tamanho, dir_trabalho, concorrencias, latencia, taxa_erro, linhas_agente, seed
+            ).executar(cenarios)
+        finally:
+            shutil.rmtree(dir_trabalho, ignore_errors=True)
+
+    return {
+        "executado_em": datetime.now().isoformat(timespec="seconds"),
+        "ambiente": {"python": platform.python_version(), "plataforma": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": {
+            "tamanhos": tamanhos, "concorrencias": concorrencias, "latencia": latencia,
+            "taxa_erro": taxa_erro, "linhas_agente": linhas_agente, "cenarios": cenarios, "seed": seed,
+        },
+        "metricas": metricas,
+    }
+
+
+def salvar_relatorio(relatorio, relatorios_dir=RELATORIOS_DIR):
+    """Writes <timestamp>.json and <timestamp>.csv; returns the JSON path."""
+    os.makedirs(relatorios_dir, exist_ok=True)
+    nome = datetime.now().strftime("%Y%m%d_%H%M%S")
+    caminho = os.path.join(relatorios_dir, f"{nome}.json")
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    pd.DataFrame(relatorio["metricas"]).to_csv(os.path.join(relatorios_dir, f"{nome}.csv"), sep=";", index=False)
+    return caminho
+
+
+def comparar(relatorio, referencia_path):
+    """DataFrame with each metric of relatorio next to the reference run and their ratio."""
+    with open(referencia_path, "r", encoding="utf-8") as f:
+        referencia = json.load(f)
+    chaves = ["tamanho", "cenario", "parametro", "metrica", "unidade"]
+    atual = pd.DataFrame(relatorio["metricas"])
+    anterior = pd.DataFrame(referencia["metricas"]).rename(columns={"valor": "referencia"})
+    df = atual.merge(anterior, on=chaves, how="left")
+    df["razao"] = df["valor"] / df["referencia"]
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks offline (modelo e embedder locais).")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS, help="Linhas das bases sintéticas.")
+    parser.add_argument("--concorrencias", type=int, nargs="+", default=CONCORRENCIAS, help="Concorrências do lote.")
+    parser.add_argument("--latencia", type=float, default=0.5, help="Latência simulada do modelo (s).")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="Fração de chamadas com erro 429 simulado.")
+    parser.add_argument("--linhas-agente", type=int, default=LINHAS_AGENTE, help="Máximo de linhas enviadas ao agente por cenário.")
+    parser.add_argument("--cenarios", nargs="+", choices=CENARIOS, default=CENARIOS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--saida", default=RELATORIOS_DIR, help="Diretório dos relatórios.")
+    parser.add_argument("--comparar", default=None, help="Relatório JSON anterior para comparação.")
+    args = parser.parse_args()
+
+    relatorio = executar_benchmarks(
+        tamanhos=args.tamanhos,
+        concorrencias=args.concorrencias,
+        latencia=args.latencia,
+        taxa_erro=args.taxa_erro,
+        linhas_agente=args.linhas_agente,
+        cenarios=args.cenarios,
+        seed=args.seed,
+    )
+    print(f"Relatório salvo em {salvar_relatorio(relatorio, args.saida)}")
+
+    if args.comparar:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(comparar(relatorio, args.comparar).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
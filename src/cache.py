@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from src.agent import ResultadoAuditoria
+from src.utils import chave_consulta
+
+# Path to the persistent classification cache (next to the agent storage)
+CACHE_PATH = "tmp/result_cache.db"
+MAX_ENTRIES = 100_000
+# Eviction check frequency (in inserts); COUNT(*) is not free on large caches
+EVICT_EVERY = 500
+
+
+def calcular_fingerprint(geracao_base, config_signature=""):
+    """
+    Returns a fingerprint of the official base generation (ProcedureStore.geracao) plus
+    the agent configuration. Cached results tagged with a different fingerprint are
+    ignored. Row-level changes of the base do not touch the fingerprint: every path that
+    writes the official base (app, storage import, batch merge) drops the keys of the
+    changed rows with ResultCache.invalidar.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(geracao_base).encode("utf-8"))
+    digest.update(config_signature.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Disk-backed (SQLite) cache mapping a normalized query to its ResultadoAuditoria.
+    Entries are keyed by (query, fingerprint) and evicted by least recent access once
+    the cache grows beyond max_entries. Processes with other fingerprints (e.g. a batch
+    CLI run with other model tiers) share the file without overwriting each other's
+    entries, which age out through the eviction. Only ALTO results are stored: MEDIO
+    and BAIXO answers depend on what the knowledge base lacked when they were given,
+    so they are asked again instead of outliving a knowledge base change.
+    """
+
+    def __init__(self, path=CACHE_PATH, fingerprint="", max_entries=MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._insercoes = 0
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        chaves_primarias = [linha[1] for linha in self._conn.execute("PRAGMA table_info(resultados)") if linha[5]]
+        if chaves_primarias == ["chave"]:
+            # Caches keyed by query alone (one fingerprint per query) are rebuilt
+            self._conn.execute("DROP TABLE resultados")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS resultados (
+                chave TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                resultado TEXT NOT NULL,
+                acessado_em REAL NOT NULL,
+                PRIMARY KEY (chave, fingerprint)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_resultados_acesso ON resultados (acessado_em)")
+        self._conn.commit()
+        with self._lock:
+            self._evict()
+            self._conn.commit()
+
+    def get(self, cod, desc) -> Optional[ResultadoAuditoria]:
+        chave = chave_consulta(cod, desc)
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT resultado FROM resultados WHERE chave = ? AND fingerprint = ?",
+                (chave, self.fingerprint),
+            ).fetchone()
+            if linha is None:
+                return None
+            self._conn.execute(
+                "UPDATE resultados SET acessado_em = ? WHERE chave = ? AND fingerprint = ?",
+                (time.time(), chave, self.fingerprint),
+            )
+            self._conn.commit()
+        try:
+            return ResultadoAuditoria.model_validate(json.loads(linha[0]))
+        except Exception:
+            return None
+
+    def set(self, cod, desc, resultado: ResultadoAuditoria):
+        if resultado.nivel_confianca != "ALTO":
+            return
+        chave = chave_consulta(cod, desc)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO resultados (chave, fingerprint, resultado, acessado_em) VALUES (?, ?, ?, ?)",
+                (chave, self.fingerprint, resultado.model_dump_json(), time.time()),
+            )
+            self._insercoes += 1
+            if self._insercoes % EVICT_EVERY == 0:
+                self._evict()
+            self._conn.commit()
+
+    def invalidar(self, chaves):
+        """Drops the entries of the given chave_consulta keys, under every fingerprint (e.g. of rows just changed in the base)."""
+        chaves = [(chave,) for chave in set(chaves)]
+        if not chaves:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM resultados WHERE chave = ?", chaves)
+            self._conn.commit()
+
+    def limpar_obsoletos(self):
+        """Deletes every entry tagged with another fingerprint."""
+        with self._lock:
+            self._conn.execute("DELETE FROM resultados WHERE fingerprint != ?", (self.fingerprint,))
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM resultados").fetchone()[0]
+        excesso = total - self.max_entries
+        if excesso > 0:
+            # Remove a little more than needed so eviction does not run on every insert
+            excesso += self.max_entries // 10
+            self._conn.execute(
+                "DELETE FROM resultados WHERE rowid IN (SELECT rowid FROM resultados ORDER BY acessado_em LIMIT ?)",
+                (excesso,),
+            )
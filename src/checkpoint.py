@@ -0,0 +1,234 @@
+import csv
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Directory holding one sub-directory per batch job
+JOBS_DIR = "tmp/jobs"
+
+
+class JobEmUsoError(RuntimeError):
+    """The batch job is owned by another session or process."""
+
+
+def _travar(arquivo):
+    # Non-blocking exclusive OS lock, released by the OS if the owner dies
+    try:
+        if fcntl is not None:
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(arquivo.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _destravar(arquivo):
+    if fcntl is not None:
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+    else:
+        arquivo.seek(0)
+        msvcrt.locking(arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def gerar_job_id(conteudo) -> str:
+    """
+    Job id derived from the uploaded file contents (bytes or a binary file object, hashed
+    in blocks), so re-uploading the same file resumes it.
+    """
+    if isinstance(conteudo, bytes):
+        return hashlib.sha256(conteudo).hexdigest()[:16]
+    digest = hashlib.sha256()
+    conteudo.seek(0)
+    for bloco in iter(lambda: conteudo.read(1 << 20), b""):
+        digest.update(bloco)
+    conteudo.seek(0)
+    return digest.hexdigest()[:16]
+
+
+class BatchCheckpoint:
+    """
+    Durable progress of a batch job.
+
+    Results are appended to <jobs_dir>/<job_id>/resultados.csv after each chunk and
+    meta.json records how many rows (and bytes) were committed.
+
+    Any session may open a checkpoint to read its progress, but only the owner
+    (adquirir(), backed by an OS lock on <job_id>/lock) writes to it. On taking
+    ownership the CSV is truncated to the last committed size, so a crash mid-write
+    never duplicates rows and a live writer in another session is never cut short.
+    Used as a context manager, the checkpoint is owned for the block.
+    """
+
+    def __init__(self, job_id, colunas, total=None, jobs_dir=JOBS_DIR):
+        self.job_id = job_id
+        self.colunas = list(colunas)
+        self.dir = os.path.join(jobs_dir, job_id)
+        self.path_resultados = os.path.join(self.dir, "resultados.csv")
+        self.path_meta = os.path.join(self.dir, "meta.json")
+        self.path_trava = os.path.join(self.dir, "lock")
+        os.makedirs(self.dir, exist_ok=True)
+
+        self._total = total
+        self._trava = None
+        self._carregar_meta()
+
+    def _carregar_meta(self):
+        self.meta = self._ler_meta() or {
+            "job_id": self.job_id,
+            "total": self._total,
+            "processadas": 0,
+            "bytes": 0,
+            "mesclado": False,
+            "criado_em": time.time(),
+            "atualizado_em": time.time(),
+        }
+        if self._total is not None:
+            self.meta["total"] = self._total
+
+    def adquirir(self) -> bool:
+        """
+        Takes ownership of the job without waiting. Returns False while another session
+        or process owns it. The owner reloads the committed progress and discards an
+        interrupted write.
+        """
+        if self._trava is not None:
+            return True
+        arquivo = open(self.path_trava, "a+b")
+        arquivo.seek(0)
+        if not _travar(arquivo):
+            arquivo.close()
+            return False
+        self._trava = arquivo
+        self._carregar_meta()
+        self._descartar_escrita_incompleta()
+        return True
+
+    def liberar(self):
+        """Gives up ownership of the job."""
+        if self._trava is not None:
+            _destravar(self._trava)
+            self._trava.close()
+            self._trava = None
+
+    @property
+    def dono(self):
+        return self._trava is not None
+
+    def __enter__(self):
+        if not self.adquirir():
+            raise JobEmUsoError(f"Job {self.job_id} em uso por outra sessão ou processo.")
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+    def _exigir_posse(self):
+        if self._trava is None:
+            raise JobEmUsoError(f"Job {self.job_id}: adquirir() antes de gravar.")
+
+    @classmethod
+    def existe(cls, job_id, jobs_dir=JOBS_DIR):
+        return os.path.exists(os.path.join(jobs_dir, job_id, "meta.json"))
+
+    @property
+    def processadas(self):
+        return self.meta["processadas"]
+
+    @property
+    def total(self):
+        return self.meta["total"]
+
+    @property
+    def concluido(self):
+        return self.total is not None and self.processadas >= self.total
+
+    def append(self, linhas):
+        """Appends a chunk of result dicts and commits the new progress (owner only)."""
+        self._exigir_posse()
+        novo_arquivo = self.meta["bytes"] == 0
+        with open(self.path_resultados, "a", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.colunas, delimiter=";", extrasaction="ignore", restval="")
+            if novo_arquivo:
+                writer.writeheader()
+            writer.writerows(linhas)
+            f.flush()
+            os.fsync(f.fileno())
+            tamanho = f.tell()
+
+        self.meta["processadas"] += len(linhas)
+        self.meta["bytes"] = tamanho
+        self._salvar_meta()
+
+    @property
+    def mescladas(self):
+        return self.meta.get("mescladas", 0)
+
+    def registrar_mescla(self, linhas):
+        """Records that `linhas` more result rows were merged, so an interrupted merge resumes after them."""
+        self._exigir_posse()
+        self.meta["mescladas"] = self.mescladas + linhas
+        self._salvar_meta()
+
+    def marcar_mesclado(self):
+        """Records that the results were merged into the official/inconsistency bases."""
+        self._exigir_posse()
+        self.meta["mesclado"] = True
+        self._salvar_meta()
+
+    def ler_resultados(self, chunksize=None, usecols=None, pular=0):
+        """
+        Committed results as one DataFrame or, with chunksize, as an iterator of
+        DataFrames (bounded memory for large jobs), skipping the first `pular` rows.
+        """
+        if self.meta["bytes"] == 0:
+            vazio = pd.DataFrame(columns=usecols or self.colunas)
+            return iter([vazio]) if chunksize else vazio
+        return pd.read_csv(
+            self.path_resultados, sep=";", dtype=str, encoding="utf-8", keep_default_na=False,
+            chunksize=chunksize, usecols=usecols, skiprows=(lambda i: 0 < i <= pular) if pular else None,
+        )
+
+    def contar_confianca(self, chunksize=100_000):
+        """
+        Rows per NIVEL_CONFIANCA, read one column at a time (cached in meta once the job
+        is done, when this checkpoint owns the job).
+        """
+        if self.concluido and "confiancas" in self.meta:
+            return self.meta["confiancas"]
+        contagem = {}
+        for parte in self.ler_resultados(chunksize=chunksize, usecols=["NIVEL_CONFIANCA"]):
+            for nivel, n in parte["NIVEL_CONFIANCA"].value_counts().items():
+                contagem[nivel] = contagem.get(nivel, 0) + int(n)
+        if self.concluido and self.dono:
+            self.meta["confiancas"] = contagem
+            self._salvar_meta()
+        return contagem
+
+    def _descartar_escrita_incompleta(self):
+        # Anything written after the last committed chunk belongs to an interrupted write
+        if os.path.exists(self.path_resultados) and os.path.getsize(self.path_resultados) > self.meta["bytes"]:
+            with open(self.path_resultados, "r+b") as f:
+                f.truncate(self.meta["bytes"])
+
+    def _ler_meta(self):
+        if not os.path.exists(self.path_meta):
+            return None
+        with open(self.path_meta, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _salvar_meta(self):
+        self.meta["atualizado_em"] = time.time()
+        tmp_path = f"{self.path_meta}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.path_meta)
@@ -0,0 +1,436 @@
+import asyncio
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from agno.run.base import RunStatus
+from agno.utils.log import log_warning
+
+from src.agent import ResultadoAuditoria, ResultadoLote
+from src.retriever import candidatos_fracos, formatar_candidatos, resultado_por_candidato
+from src.rules import aplicar_regras, resultado_por_regra
+from src.utils import chave_consulta, limpar_valor, montar_query
+
+NIVEIS_CONFIANCA = {"ALTO", "MEDIO", "BAIXO"}
+# Seconds before an agent call is abandoned (and retried, when a limiter is used)
+AGENT_TIMEOUT = 120
+
+
+class Classificacao(NamedTuple):
+    resultado: ResultadoAuditoria
+    # "indice", "regra", "cache", "candidato" or "agente"
+    origem: str
+    # Agent RunResponse when the agent was actually called
+    response: Optional[Any] = None
+
+
+class AgentRunError(RuntimeError):
+    """The agent run ended with an error status (agno reports model errors this way instead of raising)."""
+
+
+def _verificar_resposta(response):
+    # Raising lets the limiter see 429s/timeouts and back off
+    if getattr(response, "status", None) == RunStatus.error:
+        raise AgentRunError(str(response.content))
+    return response
+
+
+def result_to_dict(resultado: ResultadoAuditoria, input_cod="", input_desc=""):
+    """Converte objeto Pydantic para dicionário compatível com DataFrame."""
+    return {
+        "CODIGO": input_cod,
+        "DESCRICAO": input_desc,
+        "ABREVIATURA": resultado.abreviatura or "",
+        "ITEM": resultado.item or "",
+        "SEGMENTACAO": resultado.segmentacao or "",
+        "TERAPIA_ESPECIAL": resultado.terapia_especial or "NÃO",
+        "TIPO_MEDICAMENTO": resultado.tipo_medicamento or "",
+        "TIPO_CANCER": resultado.tipo_cancer or "",
+        "CODIGO_SUGERIDO": resultado.codigo_sugerido,
+        "DESCRICAO_SUGERIDA": resultado.descricao_procedimento,
+        "NIVEL_CONFIANCA": resultado.nivel_confianca,
+        "JUSTIFICATIVA": resultado.justificativa_tecnica,
+        "DATA_MODIFICACAO": datetime.now().strftime("%d/%m/%Y")
+    }
+
+
+def resultado_erro(cod, desc, mensagem):
+    """Result row for items the agent could not classify."""
+    return {
+        "CODIGO": cod, "DESCRICAO": desc,
+        "NIVEL_CONFIANCA": "ERRO",
+        "JUSTIFICATIVA": f"Erro Agente: {mensagem}",
+        "DATA_MODIFICACAO": datetime.now().strftime("%d/%m/%Y")
+    }
+
+
+def consultar_local(cod, desc, indice=None, cache=None, regra=None) -> Optional[Classificacao]:
+    """Answers from the exact-match index, a rule result or the result cache, without the agent."""
+    if indice is not None:
+        resultado = indice.buscar(cod, desc)
+        if resultado is not None:
+            return Classificacao(resultado, "indice")
+    if regra is not None:
+        return Classificacao(regra, "regra")
+    if cache is not None:
+        resultado = cache.get(cod, desc)
+        if resultado is not None:
+            return Classificacao(resultado, "cache")
+    return None
+
+
+def _guardar_cache(cache, cod, desc, resultado):
+    # A busy or broken cache must not cost an answer the agent already gave
+    if cache is None:
+        return
+    try:
+        cache.set(cod, desc, resultado)
+    except Exception as e:
+        log_warning(f"Result cache write failed for {chave_consulta(cod, desc)}: {e}")
+
+
+def consultar_candidatos(retriever, cod, desc, excluir=(), knowledge_base=None):
+    """
+    Top-k candidates from a CandidateRetriever (src/retriever.py) and, when the best
+    one is near-exact, its Classificacao (so the agent is skipped). (None, None) without a retriever.
+    Rows whose ID is in `excluir` are never candidates. With a knowledge_base, the
+    LanceDB search fills in when the local candidates are missing or weak.
+    """
+    if retriever is None:
+        return None, None
+    candidatos = retriever.candidatos(cod, desc, knowledge_base=knowledge_base, excluir=excluir)
+    resultado = resultado_por_candidato(candidatos[0] if candidatos else None, cod, desc)
+    return (Classificacao(resultado, "candidato") if resultado else None), candidatos
+
+
+async def aconsultar_candidatos(retriever, cod, desc, excluir=(), knowledge_base=None):
+    automatico, candidatos = consultar_candidatos(retriever, cod, desc, excluir)
+    if knowledge_base is None or automatico is not None or not candidatos_fracos(candidatos):
+        return automatico, candidatos
+    # The knowledge base search embeds the query (a blocking call), so it leaves the event loop
+    return await asyncio.to_thread(consultar_candidatos, retriever, cod, desc, excluir, knowledge_base)
+
+
+def _base_conhecimento(agent):
+    # Candidate agents skip the search tool, so their knowledge base is searched for them
+    return getattr(agent, "knowledge", None)
+
+
+def _query(cod, desc, candidatos=None):
+    query = montar_query(cod, desc)
+    return query if candidatos is None else f"{query}\n{formatar_candidatos(candidatos)}"
+
+
+def _niveis(agent, roteador=None, lote=False):
+    # (tier name, agent) pairs tried in order; without a router (src/routing.py) just the given agent
+    if roteador is None:
+        return [(None, agent)]
+    return [(nivel.nome, nivel.agent_lote if lote else nivel.agent) for nivel in roteador.niveis]
+
+
+def _decidir(roteador, nivel, ultimo, classificacao, melhor):
+    """
+    Tier decision for one single-row answer. Returns (final, melhor): final is the
+    accepted Classificacao, or None when the row moves to the next tier; melhor is the
+    valid lower-tier answer kept in case the escalation fails.
+    """
+    if roteador is None:
+        return classificacao, melhor
+    motivo = roteador.motivo_escalonamento(classificacao.resultado)
+    # The last tier's answer is final, whatever its confidence
+    if motivo is None or (ultimo and motivo == "confianca"):
+        roteador.registrar(nivel)
+        return classificacao, melhor
+    roteador.registrar(nivel, motivo)
+    if motivo == "confianca":
+        melhor = classificacao
+    return (melhor or classificacao if ultimo else None), melhor
+
+
+def classificar_item(agent, cod, desc, indice=None, cache=None, regra=None, metricas=None, retriever=None, roteador=None, **run_kwargs) -> Classificacao:
+    """
+    Classifies one (code, description) pair: exact-match index first, then a
+    deterministic rule result (see src/rules.py) when given, the persistent result
+    cache, a near-exact retriever candidate, and only then the agent. With a
+    retriever the candidates go into the query, so `agent` should be built with
+    candidatos=True (no search tool); its knowledge base is then searched by the
+    retriever when the local candidates are missing or weak. With a roteador (src/routing.py) its model
+    tiers replace `agent`, escalating uncertain or invalid answers. Agent answers are
+    cached and, with a MetricsRecorder (src/metrics.py), every agent call is recorded.
+    """
+    local = consultar_local(cod, desc, indice, cache, regra)
+    if local is not None:
+        return local
+    automatico, candidatos = consultar_candidatos(retriever, cod, desc, knowledge_base=_base_conhecimento(agent))
+    if automatico is not None:
+        return automatico
+
+    query = _query(cod, desc, candidatos)
+    ids = [chave_consulta(cod, desc)]
+    niveis = _niveis(agent, roteador)
+    final = melhor = None
+    for n, (nivel, agente) in enumerate(niveis):
+        inicio = time.perf_counter()
+        try:
+            response = _verificar_resposta(agente.run(query, **run_kwargs))
+        except Exception as e:
+            if metricas is not None:
+                metricas.registrar(inicio, ids=ids, erro=e)
+            if roteador is not None:
+                roteador.registrar(nivel, "erro")
+            if melhor is None:
+                raise
+            final = melhor
+            break
+        if metricas is not None:
+            metricas.registrar(inicio, response, ids=ids)
+        final, melhor = _decidir(roteador, nivel, n == len(niveis) - 1, Classificacao(response.content, "agente", response), melhor)
+        if final is not None:
+            break
+    _guardar_cache(cache, cod, desc, final.resultado)
+    return final
+
+
+async def _arun(agent, query, limiter=None, metricas=None, ids=(), **run_kwargs):
+    """
+    Native async agent call, optionally under an AdaptiveLimiter (with retry on
+    429/timeouts). Each attempt is recorded in `metricas` when given.
+    """
+    async def _chamar():
+        inicio = time.perf_counter()
+        try:
+            response = _verificar_resposta(await agent.arun(query, **run_kwargs))
+        except BaseException as e:
+            if metricas is not None:
+                metricas.registrar(inicio, ids=ids, erro=e)
+            raise
+        if metricas is not None:
+            metricas.registrar(inicio, response, ids=ids)
+        return response
+
+    if limiter is None:
+        return await _chamar()
+    return await limiter.executar(_chamar, timeout=AGENT_TIMEOUT)
+
+
+async def aclassificar_item(agent, cod, desc, indice=None, cache=None, regra=None, limiter=None, metricas=None, retriever=None, roteador=None, excluir=(), **run_kwargs) -> Classificacao:
+    """
+    Async counterpart of classificar_item, using the agent's async run API.
+    Row IDs in `excluir` never serve as retriever candidates (see EnrichmentWorker).
+    """
+    local = consultar_local(cod, desc, indice, cache, regra)
+    if local is not None:
+        return local
+    automatico, candidatos = await aconsultar_candidatos(retriever, cod, desc, excluir, _base_conhecimento(agent))
+    if automatico is not None:
+        return automatico
+
+    query = _query(cod, desc, candidatos)
+    niveis = _niveis(agent, roteador)
+    final = melhor = None
+    for n, (nivel, agente) in enumerate(niveis):
+        try:
+            response = await _arun(agente, query, limiter, metricas, [chave_consulta(cod, desc)], **run_kwargs)
+        except Exception:
+            if roteador is not None:
+                roteador.registrar(nivel, "erro")
+            if melhor is None:
+                raise
+            final = melhor
+            break
+        final, melhor = _decidir(roteador, nivel, n == len(niveis) - 1, Classificacao(response.content, "agente", response), melhor)
+        if final is not None:
+            break
+    _guardar_cache(cache, cod, desc, final.resultado)
+    return final
+
+
+def resultado_valido(resultado) -> bool:
+    """Checks the fields the agent most often gets wrong (confidence level and 8-digit code)."""
+    if resultado.nivel_confianca not in NIVEIS_CONFIANCA:
+        return False
+    codigo = (resultado.codigo_sugerido or "").strip()
+    return not codigo or re.fullmatch(r"\d{8}", codigo) is not None
+
+
+def montar_query_lote(itens: List[Tuple[str, str, str]], candidatos: Optional[Dict[str, List[Dict]]] = None) -> str:
+    """Builds the packed query for (id_linha, cod, desc) items, each followed by its candidates when given."""
+    linhas = []
+    for id_linha, cod, desc in itens:
+        linhas.append(f"{id_linha} | {cod or '-'} | {desc}")
+        if candidatos is not None:
+            linhas.append(formatar_candidatos(candidatos.get(id_linha), recuo="    "))
+    return "Classifique as linhas abaixo (id_linha | Código | Descrição):\n" + "\n".join(linhas)
+
+
+async def _arun_pacote(agent_lote, itens, candidatos, limiter=None, metricas=None, **run_kwargs):
+    """Rows returned by one packed call, {id_linha: (ResultadoAuditoriaLinha, response)}; None when the call failed."""
+    try:
+        ids = [chave_consulta(cod, desc) for _, cod, desc in itens]
+        response = await _arun(agent_lote, montar_query_lote(itens, candidatos), limiter, metricas, ids, **run_kwargs)
+    except Exception:
+        return None
+    linhas = {}
+    if isinstance(response.content, ResultadoLote):
+        ids_esperados = {id_linha for id_linha, _, _ in itens}
+        for linha in response.content.resultados:
+            if linha.id_linha in ids_esperados:
+                linhas.setdefault(linha.id_linha, (linha, response))
+    return linhas
+
+
+async def aclassificar_pacote(agent_lote, agent, itens, cache=None, limiter=None, metricas=None, retriever=None, roteador=None, **run_kwargs) -> Dict[str, Classificacao]:
+    """
+    Classifies several (id_linha, cod, desc) items with a single agent_lote call.
+    Every id must come back with a valid result; missing or malformed rows are
+    retried one by one with the single-row agent (of the last tier, with a roteador). With a retriever, near-exact rows
+    are answered locally and the others carry their candidates in the query.
+    With a roteador the pack goes to its first tier and the rows to escalate are
+    packed again for the next one, so only hard rows reach the stronger models.
+    Returns {id_linha: Classificacao}.
+    """
+    classificacoes: Dict[str, Classificacao] = {}
+    candidatos = None
+    if retriever is not None:
+        consultas = await asyncio.gather(
+            *(aconsultar_candidatos(retriever, cod, desc, knowledge_base=_base_conhecimento(agent_lote)) for _, cod, desc in itens)
+        )
+        candidatos = {}
+        for (id_linha, _, _), (automatico, candidatos[id_linha]) in zip(itens, consultas):
+            if automatico is not None:
+                classificacoes[id_linha] = automatico
+        itens_agente = [item for item in itens if item[0] not in classificacoes]
+    else:
+        itens_agente = itens
+
+    niveis = _niveis(agent_lote, roteador, lote=True)
+    # Valid but uncertain lower-tier answers, kept when the escalation fails
+    provisorias: Dict[str, Classificacao] = {}
+    pendentes = itens_agente
+    for n, (nivel, agente_lote) in enumerate(niveis):
+        if not pendentes:
+            break
+        ultimo = n == len(niveis) - 1
+        # None: the whole pack failed, so every row escalates (or falls back to an individual call below)
+        linhas = await _arun_pacote(agente_lote, pendentes, candidatos, limiter, metricas, **run_kwargs)
+        escalar = []
+        for item in pendentes:
+            linha, response = (linhas or {}).get(item[0], (None, None))
+            classificacao = None
+            if linha is not None and resultado_valido(linha):
+                resultado = ResultadoAuditoria.model_validate(linha.model_dump(exclude={"id_linha"}))
+                classificacao = Classificacao(resultado, "agente", response)
+            if roteador is None:
+                if classificacao is not None:
+                    classificacoes[item[0]] = classificacao
+                continue
+            motivo = "erro" if linhas is None else roteador.motivo_escalonamento(linha)
+            if motivo is None or (ultimo and motivo == "confianca"):
+                roteador.registrar(nivel)
+                classificacoes[item[0]] = classificacao
+                continue
+            roteador.registrar(nivel, motivo)
+            if motivo == "confianca":
+                provisorias[item[0]] = classificacao
+            escalar.append(item)
+        pendentes = escalar
+    for id_linha, classificacao in provisorias.items():
+        classificacoes.setdefault(id_linha, classificacao)
+
+    # Rows still without an answer get one single-row call on the strongest tier; the
+    # router already counted them there, so it neither restarts nor counts them again
+    faltantes = [item for item in itens if item[0] not in classificacoes]
+    if faltantes:
+        agente_final = roteador.niveis[-1].agent if roteador is not None else agent
+        individuais = await asyncio.gather(
+            *(aclassificar_item(agente_final, cod, desc, limiter=limiter, metricas=metricas, retriever=retriever, **run_kwargs)
+              for _, cod, desc in faltantes),
+            return_exceptions=True,
+        )
+        for (id_linha, _, _), classificacao in zip(faltantes, individuais):
+            if not isinstance(classificacao, BaseException):
+                classificacoes[id_linha] = classificacao
+
+    for id_linha, cod, desc in itens:
+        if id_linha in classificacoes:
+            _guardar_cache(cache, cod, desc, classificacoes[id_linha].resultado)
+
+    return classificacoes
+
+
+async def _classificar_linha(agent, cod, desc, limiter, cache=None, metricas=None, retriever=None, roteador=None, **run_kwargs):
+    try:
+        classificacao = await aclassificar_item(
+            agent, cod, desc, cache=cache, limiter=limiter, metricas=metricas, retriever=retriever, roteador=roteador, **run_kwargs
+        )
+        return result_to_dict(classificacao.resultado, cod, desc)
+    except Exception as e:
+        # Fallback erro (após esgotar as tentativas do limitador)
+        return resultado_erro(cod, desc, str(e))
+
+
+async def _classificar_pacote(agent_lote, agent, itens, limiter, cache=None, metricas=None, retriever=None, roteador=None, **run_kwargs):
+    classificacoes = await aclassificar_pacote(
+        agent_lote, agent, itens, cache, limiter=limiter, metricas=metricas, retriever=retriever, roteador=roteador, **run_kwargs
+    )
+    return [
+        result_to_dict(classificacoes[id_linha].resultado, cod, desc) if id_linha in classificacoes
+        else resultado_erro(cod, desc, "linha não retornada pelo agente")
+        for id_linha, cod, desc in itens
+    ]
+
+
+async def aclassificar_lote(
+    df_batch, agent, agent_lote=None, indice=None, cache=None, limiter=None, metricas=None,
+    col_codigo="CODIGO", col_descricao="DESCRICAO_BUSCA", tamanho_pacote=10, retriever=None, roteador=None,
+) -> List[Dict[str, Any]]:
+    """
+    Classifies every row of df_batch and returns the result dicts in input order.
+    The index, deterministic rules and the cache answer what is already known; the
+    remaining rows are grouped by chave_consulta and one row per group goes to
+    agent_lote in packs of tamanho_pacote (or to the single-row agent when
+    tamanho_pacote is 1 or no agent_lote is given); its result is fanned out to the
+    whole group. With a retriever, each pending row is answered by a near-exact
+    candidate or sent with its candidates. With a roteador (src/routing.py) the
+    agent calls go through its model tiers (pass roteador.agent/roteador.agent_lote).
+    Each row is independent, so the agent history is never added to the context.
+    """
+    regras = aplicar_regras(df_batch, col_codigo, col_descricao).to_dict("records")
+
+    resultados: List[Optional[Dict[str, Any]]] = [None] * len(df_batch)
+    # Rows with the same chave_consulta (accents, case and spacing aside) are classified once
+    grupos: Dict[str, List[Tuple[int, str, str]]] = {}
+    for pos, (row, regra) in enumerate(zip(df_batch.to_dict("records"), regras)):
+        cod = limpar_valor(row.get(col_codigo, ""))
+        desc = limpar_valor(row.get(col_descricao, ""))
+        chave = chave_consulta(cod, desc)
+        if chave in grupos:
+            grupos[chave].append((pos, cod, desc))
+            continue
+        resultado_regra = resultado_por_regra(regra, cod, desc) if regra["AUTOMATICO"] else None
+        local = consultar_local(cod, desc, indice, cache, resultado_regra)
+        if local is not None:
+            resultados[pos] = result_to_dict(local.resultado, cod, desc)
+        else:
+            grupos[chave] = [(pos, cod, desc)]
+    pendentes = [(str(linhas[0][0]), linhas[0][1], linhas[0][2]) for linhas in grupos.values()]
+
+    if agent_lote is not None and tamanho_pacote > 1:
+        pacotes = [pendentes[i:i + tamanho_pacote] for i in range(0, len(pendentes), tamanho_pacote)]
+        saidas = await asyncio.gather(
+            *(_classificar_pacote(agent_lote, agent, pacote, limiter, cache, metricas, retriever, roteador, add_history_to_context=False) for pacote in pacotes)
+        )
+        linhas_agente = [linha for saida in saidas for linha in saida]
+    else:
+        linhas_agente = await asyncio.gather(
+            *(_classificar_linha(agent, cod, desc, limiter, cache, metricas, retriever, roteador, add_history_to_context=False) for _, cod, desc in pendentes)
+        )
+
+    # Fan-out: every row of a group gets the group result with its own input values
+    for linhas, linha in zip(grupos.values(), linhas_agente):
+        for pos, cod, desc in linhas:
+            resultados[pos] = {**linha, "CODIGO": cod, "DESCRICAO": desc}
+
+    return resultados
+
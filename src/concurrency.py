@@ -0,0 +1,124 @@
+import asyncio
+import concurrent.futures
+import random
+import threading
+import time
+
+# Substrings that identify rate-limit / overload / timeout errors from Gemini and httpx
+ERROS_SOBRECARGA = (
+    "429", "resource_exhausted", "rate limit", "ratelimit", "quota",
+    "503", "unavailable", "overloaded", "timeout", "timed out", "deadline",
+)
+
+
+def eh_sobrecarga(erro: BaseException) -> bool:
+    """True for errors that mean "slow down and retry" (429s, 503s and timeouts)."""
+    if isinstance(erro, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    mensagem = f"{type(erro).__name__} {erro}".lower()
+    return any(trecho in mensagem for trecho in ERROS_SOBRECARGA)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter for agent calls.
+
+    The limit grows additively (about +1 per window of successful calls) while
+    latency stays under latencia_alvo, and is cut multiplicatively on rate-limit
+    or timeout errors, at most once per cooldown so a burst of 429s counts once.
+    """
+
+    def __init__(self, inicial=5, minimo=1, maximo=32, latencia_alvo=15.0, fator_reducao=0.5, cooldown=5.0):
+        self.limite = float(inicial)
+        self.minimo = minimo
+        self.maximo = maximo
+        self.latencia_alvo = latencia_alvo
+        self.fator_reducao = fator_reducao
+        self.cooldown = cooldown
+        self.em_uso = 0
+        self.sucessos = 0
+        self.sobrecargas = 0
+        self._ultima_reducao = 0.0
+        self._cond = None
+        self._loop = None
+
+    def _condicao(self):
+        # asyncio primitives are bound to one event loop; each Streamlit run creates its own
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._cond = asyncio.Condition()
+            self.em_uso = 0
+        return self._cond
+
+    async def acquire(self):
+        cond = self._condicao()
+        async with cond:
+            await cond.wait_for(lambda: self.em_uso < int(self.limite))
+            self.em_uso += 1
+
+    async def release(self):
+        cond = self._condicao()
+        async with cond:
+            self.em_uso -= 1
+            cond.notify_all()
+
+    def registrar_sucesso(self, latencia):
+        self.sucessos += 1
+        if latencia <= self.latencia_alvo:
+            self.limite = min(self.maximo, self.limite + 1.0 / self.limite)
+
+    def registrar_sobrecarga(self):
+        self.sobrecargas += 1
+        agora = time.monotonic()
+        if agora - self._ultima_reducao >= self.cooldown:
+            self.limite = max(self.minimo, self.limite * self.fator_reducao)
+            self._ultima_reducao = agora
+
+    async def executar(self, fabrica, max_tentativas=5, timeout=None):
+        """
+        Runs `await fabrica()` under the limiter. Overload errors are retried with
+        jittered exponential backoff up to max_tentativas; other errors are raised.
+        """
+        for tentativa in range(max_tentativas):
+            await self.acquire()
+            inicio = time.perf_counter()
+            try:
+                if timeout:
+                    resultado = await asyncio.wait_for(fabrica(), timeout)
+                else:
+                    resultado = await fabrica()
+            except Exception as e:
+                if not eh_sobrecarga(e) or tentativa == max_tentativas - 1:
+                    raise
+                self.registrar_sobrecarga()
+            else:
+                self.registrar_sucesso(time.perf_counter() - inicio)
+                return resultado
+            finally:
+                await self.release()
+
+            # Full jitter backoff, outside the limiter so the slot is free meanwhile
+            await asyncio.sleep(random.uniform(0, min(60.0, 2.0 ** (tentativa + 1))))
+
+
+class LoopDedicado:
+    """
+    One event loop running forever on a daemon thread.
+
+    Async clients keep connections bound to the loop that first used them (the
+    Gemini client's httpx pool does, and so do the limiter's asyncio primitives), so
+    agents shared by several threads must make all their async calls on one loop:
+    submit coroutines with agendar() (returns a Future) or executar() (blocks).
+    """
+
+    def __init__(self, nome="loop-agentes"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=nome, daemon=True)
+        self._thread.start()
+
+    def agendar(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def executar(self, coro):
+        return self.agendar(coro).result()
@@ -1,46 +1,226 @@
 import os
+import json
+import threading
+from hashlib import md5
+
+import pandas as pd
 from agno.knowledge import Knowledge
-from agno.vectordb.lancedb import LanceDb, SearchType
+from agno.knowledge.document import Document
+from agno.vectordb.lancedb import SearchType
 from agno.knowledge.embedder.google import GeminiEmbedder
-from agno.knowledge.reader.csv_reader import CSVReader
+
+from src.embeddings import EMBED_CACHE_PATH, CachedEmbedder, EmbeddingCache, embed_documents
+from src.utils import chaves_consulta, limpar_valor
+from src.vector_index import NPROBES, REFINE_FACTOR, LanceDbIndexada, manter_indices
 
 # Path to the vector database
 VECTOR_DB_PATH = "tmp/lancedb_medical_knowledge"
-CSV_PATH = "bases/classificacao_procedimentos.csv"
+# Row hashes of what is currently embedded in LanceDB (used by the incremental sync)
+SYNC_STATE_PATH = "tmp/kb_sync_state.json"
+# content_hash passed to LanceDb.insert for every synced row
+SYNC_CONTENT_HASH = "classificacao_procedimentos"
+
+# Columns embedded for each procedure (order matters for the document text)
+KB_COLUMNS = [
+    "CODIGO", "DESCRICAO", "ABREVIATURA", "ITEM", "SEGMENTACAO",
+    "TERAPIA_ESPECIAL", "TIPO_MEDICAMENTO", "TIPO_CANCER",
+]
 
-def initialize_knowledge_base():
+# In-memory copy of the sync state, so repeated syncs in one process skip the JSON read
+_sync_state_cache = {}
+# Held for a whole read-upsert-save of the sync state: concurrent syncs (enrichment,
+# several sessions) would otherwise drop each other's row hashes and re-insert those
+# rows as duplicate vectors on the next sync
+SYNC_LOCK = threading.Lock()
+
+def build_knowledge_base(
+    embedder=None, uri=VECTOR_DB_PATH, embed_cache_path=EMBED_CACHE_PATH, nprobes=NPROBES, refine_factor=REFINE_FACTOR
+):
     """
-    Initializes and returns the Knowledge Base with LanceDB and Gemini Embeddings.
-    Loads data if not already populated.
+    Returns the Knowledge Base (LanceDB + Gemini Embeddings) without loading any data.
+    `embedder` replaces the Gemini embedder (e.g. src.fakes.FakeEmbedder in benchmarks).
+    Embeddings go through the persistent cache at embed_cache_path (None disables it),
+    so both ingestion and search queries reuse vectors of texts seen before.
+    nprobes and refine_factor tune the ANN index searches (see src.vector_index).
     """
-
-    # Initialize the Knowledge Base
-    knowledge_base = Knowledge(
-        vector_db=LanceDb(
+    embedder = embedder or GeminiEmbedder(
+        id="models/text-embedding-004",
+        dimensions=768
+    )
+    if embed_cache_path:
+        embedder = CachedEmbedder(embedder=embedder, cache=EmbeddingCache(embed_cache_path))
+    return Knowledge(
+        vector_db=LanceDbIndexada(
             table_name="medical_procedures",
-            uri=VECTOR_DB_PATH,
+            uri=uri,
             search_type=SearchType.hybrid,  # Hybrid search for better results
-            embedder=GeminiEmbedder(
-                id="models/text-embedding-004",
-                dimensions=768
-            ),
+            embedder=embedder,
+            nprobes=nprobes,
+            refine_factor=refine_factor,
         ),
-        reader=CSVReader(
-            delimiter=";",  # Semicolon delimiter as per user spec
-            quotechar='"'
-        )
     )
 
-    # Load data if the CSV exists and DB might need population
-    # LanceDB is file-based, so we check if the path exists, but Knowledge.load(recreate=False) is safer
-    if os.path.exists(CSV_PATH):
+def initialize_knowledge_base(
+    df=None, embedder=None, uri=VECTOR_DB_PATH, state_path=SYNC_STATE_PATH, embed_cache_path=EMBED_CACHE_PATH
+):
+    """
+    Initializes and returns the Knowledge Base with LanceDB and Gemini Embeddings.
+    Syncs it with df, the official base as loaded from the ProcedureStore (src/storage.py);
+    without df the table is left as it is.
+    """
+    knowledge_base = build_knowledge_base(embedder, uri, embed_cache_path)
+
+    # Bring LanceDB in line with the official base: only new/changed rows are embedded
+    if df is not None:
         try:
-            # recreate=False ensures we don't duplicate data if it already exists
-            knowledge_base.load(path=CSV_PATH, recreate=False)
-            print(f"Knowledge Base loaded from {CSV_PATH}")
+            stats = sync_knowledge_base(knowledge_base, df, state_path)
+            print(f"Knowledge Base synced from official base: {stats}")
         except Exception as e:
             print(f"Error loading Knowledge Base: {e}")
     else:
-        print(f"Warning: CSV file not found at {CSV_PATH}. Knowledge Base might be empty.")
+        print("Warning: no official base given; Knowledge Base left unsynced.")
 
     return knowledge_base
+
+def _row_hashes(df):
+    """Vectorized content hash of the embedded columns of each row."""
+    colunas = df.reindex(columns=KB_COLUMNS).fillna("").astype(str)
+    return pd.util.hash_pandas_object(colunas, index=False).map("{:016x}".format)
+
+def _row_document(registro, row_hash):
+    partes = [f"{col}: {limpar_valor(registro.get(col))}" for col in KB_COLUMNS if limpar_valor(registro.get(col))]
+    return Document(
+        id=row_hash,
+        name=limpar_valor(registro.get("CODIGO")) or None,
+        content="; ".join(partes),
+        meta_data={"codigo": limpar_valor(registro.get("CODIGO"))},
+    )
+
+def _lance_id(row_hash):
+    # Mirrors the id LanceDb.insert derives from (document.id, content_hash)
+    return md5(f"{row_hash}_{SYNC_CONTENT_HASH}".encode()).hexdigest()
+
+def _load_sync_state(state_path):
+    if state_path in _sync_state_cache:
+        return _sync_state_cache[state_path]
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    _sync_state_cache[state_path] = state
+    return state
+
+def _save_sync_state(state, state_path):
+    os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+    _sync_state_cache[state_path] = state
+
+def prepare_sync_state(vector_db, state_path=SYNC_STATE_PATH):
+    """
+    Returns the current sync state ({row key: row hash}), creating the table if needed.
+    Without a sync state the table may hold documents from the old whole-CSV load,
+    which cannot be matched to rows, so it is recreated empty.
+    """
+    state = _load_sync_state(state_path)
+    if state is None:
+        if vector_db.exists():
+            vector_db.drop()
+        state = {}
+        _save_sync_state(state, state_path)
+    vector_db.create()
+    return state
+
+def upsert_rows(vector_db, df, state, **embed_kwargs):
+    """
+    Embeds and inserts the rows of df that are new or changed with respect to state
+    (updated in place). Previous vectors of changed rows are deleted.
+    Returns (new keys, changed keys, all keys seen in df).
+    """
+    if df is None or df.empty:
+        return [], [], set()
+
+    df = df.assign(_CHAVE=chaves_consulta(df).to_numpy(), _HASH=_row_hashes(df).to_numpy())
+    df = df.drop_duplicates(subset="_CHAVE", keep="last")
+    hashes = dict(zip(df["_CHAVE"], df["_HASH"]))
+
+    novos = [chave for chave, h in hashes.items() if chave not in state]
+    alterados = [chave for chave, h in hashes.items() if chave in state and state[chave] != h]
+    pendentes = set(novos) | set(alterados)
+
+    _delete_hashes(vector_db, [state[chave] for chave in alterados])
+
+    if pendentes:
+        documentos = [
+            _row_document(registro, registro["_HASH"])
+            for registro in df[df["_CHAVE"].isin(pendentes)].to_dict("records")
+        ]
+        embed_documents(vector_db.embedder, documentos, **embed_kwargs)
+        # Documents already carry their embedding, so this is a single bulk append
+        vector_db.insert(content_hash=SYNC_CONTENT_HASH, documents=documentos)
+
+    for chave in pendentes:
+        state[chave] = hashes[chave]
+
+    return novos, alterados, set(hashes)
+
+def remove_rows(vector_db, state, chaves):
+    """Deletes the vectors of the given row keys and drops them from state."""
+    _delete_hashes(vector_db, [state.pop(chave) for chave in chaves if chave in state])
+
+def _delete_hashes(vector_db, row_hashes):
+    for inicio in range(0, len(row_hashes), 500):
+        ids = ", ".join(f"'{_lance_id(h)}'" for h in row_hashes[inicio:inicio + 500])
+        vector_db.table.delete(f"id IN ({ids})")
+
+def save_sync_state(state, state_path=SYNC_STATE_PATH):
+    _save_sync_state(state, state_path)
+
+def sync_knowledge_base(knowledge_base, df, state_path=SYNC_STATE_PATH):
+    """
+    Incrementally syncs the LanceDB table with the official base DataFrame.
+    Each row is hashed; only new or changed rows are embedded and inserted, and rows
+    that disappeared (or changed) have their previous vectors deleted.
+    The ANN/FTS indexes are then built, retrained or compacted as needed.
+    Returns a dict with the number of inserted, updated and removed rows.
+    """
+    vector_db = knowledge_base.vector_db
+    with SYNC_LOCK:
+        state = dict(prepare_sync_state(vector_db, state_path))
+
+        novos, alterados, vistos = upsert_rows(vector_db, df, state)
+        removidos = [chave for chave in state if chave not in vistos]
+        remove_rows(vector_db, state, removidos)
+
+        if novos or alterados or removidos:
+            _save_sync_state(state, state_path)
+        # Also on a no-op sync: a table loaded before the indexes existed gets them here
+        manter_indices(vector_db)
+
+    return {"inseridos": len(novos), "atualizados": len(alterados), "removidos": len(removidos)}
+
+def sync_knowledge_rows(knowledge_base, alterados=None, removidos=None, state_path=SYNC_STATE_PATH):
+    """
+    Row-level variant of sync_knowledge_base for callers that know exactly which rows
+    were inserted/updated (alterados) and deleted (removidos), so the cost depends on
+    the size of the change rather than on the size of the base.
+    A removed key that is still used by another row of the base loses its vector until
+    the next full sync (run at startup).
+    """
+    vector_db = knowledge_base.vector_db
+    with SYNC_LOCK:
+        state = dict(prepare_sync_state(vector_db, state_path))
+
+        novos, atualizados, vistos = upsert_rows(vector_db, alterados, state)
+        chaves_removidas = set(chaves_consulta(removidos)) - vistos if removidos is not None and not removidos.empty else set()
+        removidas = [chave for chave in chaves_removidas if chave in state]
+        remove_rows(vector_db, state, removidas)
+
+        if novos or atualizados or removidas:
+            _save_sync_state(state, state_path)
+            # Appended rows are searched by flat scan until they are folded into the indexes
+            manter_indices(vector_db)
+
+    return {"inseridos": len(novos), "atualizados": len(atualizados), "removidos": len(removidas)}
@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from agno.knowledge.embedder.base import Embedder
+from agno.knowledge.embedder.google import GeminiEmbedder
+
+from src.utils import normalizar_texto
+
+# Batched embedding defaults (Gemini accepts up to 100 texts per embed_content call)
+EMBED_BATCH_SIZE = 100
+EMBED_CONCURRENCY = 4
+EMBED_MAX_RETRIES = 5
+
+# Persistent embedding cache, shared by ingestion and query-time search
+EMBED_CACHE_PATH = "tmp/embedding_cache.db"
+# ~3 KB per 768-dim vector, so 100k entries stay around 300 MB
+EMBED_CACHE_MAX_ENTRIES = 100_000
+# Eviction check frequency (in inserted vectors)
+EMBED_CACHE_EVICT_EVERY = 1_000
+
+
+def _run_coroutine(coro):
+    """Runs a coroutine from sync code, even when the current thread already has a running loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    resultado = {}
+
+    def _alvo():
+        try:
+            resultado["valor"] = asyncio.run(coro)
+        except BaseException as e:
+            resultado["erro"] = e
+
+    thread = threading.Thread(target=_alvo)
+    thread.start()
+    thread.join()
+    if "erro" in resultado:
+        raise resultado["erro"]
+    return resultado["valor"]
+
+
+def assinatura_embedder(embedder):
+    """Model identity used in the cache key: class, model id and dimensions."""
+    return f"{type(embedder).__name__}:{getattr(embedder, 'id', '')}:{embedder.dimensions}"
+
+
+class EmbeddingCache:
+    """
+    Disk-backed (SQLite) cache of embedding vectors keyed by the normalized text and
+    the embedder signature, evicted by least recent access beyond max_entries.
+    Vectors are stored as float32 blobs.
+    """
+
+    def __init__(self, path=EMBED_CACHE_PATH, max_entries=EMBED_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._insercoes = 0
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                chave TEXT PRIMARY KEY,
+                vetor BLOB NOT NULL,
+                acessado_em REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_acesso ON embeddings (acessado_em)")
+        self._conn.commit()
+
+    @staticmethod
+    def chave(assinatura, texto):
+        texto = " ".join(normalizar_texto(texto).split())
+        return hashlib.sha256(f"{assinatura}\n{texto}".encode("utf-8")).hexdigest()
+
+    def buscar(self, assinatura, textos) -> Dict[str, List[float]]:
+        """Returns {texto: vetor} for the texts already cached."""
+        chaves = {self.chave(assinatura, t): t for t in textos}
+        encontrados = {}
+        with self._lock:
+            lista = list(chaves)
+            for inicio in range(0, len(lista), 500):
+                parte = lista[inicio:inicio + 500]
+                linhas = self._conn.execute(
+                    f"SELECT chave, vetor FROM embeddings WHERE chave IN ({', '.join('?' * len(parte))})", parte
+                ).fetchall()
+                for chave, vetor in linhas:
+                    encontrados[chave] = np.frombuffer(vetor, dtype=np.float32).tolist()
+            if encontrados:
+                agora = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET acessado_em = ? WHERE chave = ?", [(agora, c) for c in encontrados]
+                )
+                self._conn.commit()
+        return {chaves[c]: v for c, v in encontrados.items()}
+
+    def gravar(self, assinatura, pares):
+        """Stores (texto, vetor) pairs."""
+        agora = time.time()
+        linhas = [
+            (self.chave(assinatura, texto), np.asarray(vetor, dtype=np.float32).tobytes(), agora)
+            for texto, vetor in pares
+        ]
+        if not linhas:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (chave, vetor, acessado_em) VALUES (?, ?, ?)", linhas
+            )
+            antes = self._insercoes
+            self._insercoes += len(linhas)
+            if self._insercoes // EMBED_CACHE_EVICT_EVERY != antes // EMBED_CACHE_EVICT_EVERY:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excesso = total - self.max_entries
+        if excesso > 0:
+            # Remove a little more than needed so eviction does not run on every insert
+            excesso += self.max_entries // 10
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE chave IN (SELECT chave FROM embeddings ORDER BY acessado_em LIMIT ?)",
+                (excesso,),
+            )
+
+
+@dataclass
+class CachedEmbedder(Embedder):
+    """
+    Wraps an embedder with an EmbeddingCache. LanceDB query embeddings (hybrid and
+    vector search) go through get_embedding; ingestion goes through aembed_textos,
+    which only sends the cache misses to the wrapped embedder.
+    """
+
+    embedder: Optional[Embedder] = None
+    cache: Optional[EmbeddingCache] = None
+
+    def __post_init__(self):
+        self.dimensions = self.embedder.dimensions
+        self.id = getattr(self.embedder, "id", None)
+        self.assinatura = assinatura_embedder(self.embedder)
+
+    def get_embedding(self, text: str) -> List[float]:
+        vetor = self.cache.buscar(self.assinatura, [text]).get(text)
+        if vetor is None:
+            vetor = self.embedder.get_embedding(text)
+            if vetor:
+                self.cache.gravar(self.assinatura, [(text, vetor)])
+        return vetor
+
+    def get_embedding_and_usage(self, text: str):
+        return self.get_embedding(text), None
+
+    async def async_get_embedding(self, text: str) -> List[float]:
+        vetor = self.cache.buscar(self.assinatura, [text]).get(text)
+        if vetor is None:
+            vetor = await self.embedder.async_get_embedding(text)
+            if vetor:
+                self.cache.gravar(self.assinatura, [(text, vetor)])
+        return vetor
+
+    async def async_get_embedding_and_usage(self, text: str):
+        return await self.async_get_embedding(text), None
+
+
+async def _embed_lote(embedder, textos):
+    if isinstance(embedder, GeminiEmbedder):
+        # One request for the whole batch instead of one request per text
+        config = {}
+        if embedder.dimensions:
+            config["output_dimensionality"] = embedder.dimensions
+        if embedder.task_type:
+            config["task_type"] = embedder.task_type
+        response = await embedder.client.aio.models.embed_content(
+            model=embedder.id.split("/")[-1],
+            contents=textos,
+            config=config or None,
+        )
+        return [list(e.values) for e in response.embeddings]
+
+    # Generic embedders: still concurrent, one call per text
+    return list(await asyncio.gather(*(embedder.async_get_embedding(t) for t in textos)))
+
+
+async def _embed_lote_com_retry(embedder, textos, semaphore, max_retries):
+    async with semaphore:
+        for tentativa in range(max_retries + 1):
+            try:
+                vetores = await _embed_lote(embedder, textos)
+                if len(vetores) != len(textos) or any(not v for v in vetores):
+                    raise ValueError(f"Embedding batch returned {len(vetores)} vectors for {len(textos)} texts")
+                return vetores
+            except Exception:
+                if tentativa == max_retries:
+                    raise
+                # Exponential backoff with jitter (rate limits are the usual cause)
+                await asyncio.sleep(min(30, 2 ** tentativa) * (0.5 + random.random()))
+
+
+async def aembed_textos(
+    embedder,
+    textos,
+    batch_size=EMBED_BATCH_SIZE,
+    concurrency=EMBED_CONCURRENCY,
+    max_retries=EMBED_MAX_RETRIES,
+):
+    """
+    Embeds a list of texts in batches of batch_size, with at most `concurrency`
+    requests in flight and per-batch retry. Returns vectors in input order.
+    With a CachedEmbedder, cached texts are not sent again.
+    """
+    if isinstance(embedder, CachedEmbedder):
+        # Only the cache misses (deduplicated) reach the wrapped embedder
+        conhecidos = embedder.cache.buscar(embedder.assinatura, textos)
+        faltantes = list(dict.fromkeys(t for t in textos if t not in conhecidos))
+        if faltantes:
+            novos = await aembed_textos(embedder.embedder, faltantes, batch_size, concurrency, max_retries)
+            embedder.cache.gravar(embedder.assinatura, zip(faltantes, novos))
+            conhecidos.update(zip(faltantes, novos))
+        return [conhecidos[t] for t in textos]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    lotes = [textos[i:i + batch_size] for i in range(0, len(textos), batch_size)]
+    resultados = await asyncio.gather(
+        *(_embed_lote_com_retry(embedder, lote, semaphore, max_retries) for lote in lotes)
+    )
+    return [vetor for lote in resultados for vetor in lote]
+
+
+def embed_documents(embedder, documentos, **kwargs):
+    """Fills document.embedding for every agno Document using the batched pipeline."""
+    if not documentos:
+        return documentos
+    vetores = _run_coroutine(aembed_textos(embedder, [d.content for d in documentos], **kwargs))
+    for documento, vetor in zip(documentos, vetores):
+        documento.embedding = vetor
+    return documentos
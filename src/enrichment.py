@@ -0,0 +1,94 @@
+import asyncio
+import queue
+import threading
+import time
+
+from src.classifier import aclassificar_item, result_to_dict
+from src.concurrency import AdaptiveLimiter
+
+
+class EnrichmentWorker:
+    """
+    Background enrichment of the official base.
+
+    Classifies (cod, desc, ids) items concurrently on its own thread and event loop, or on
+    a shared LoopDedicado (src/concurrency.py) when the agents are used by other
+    threads too, and queues (ids, result dict) pairs, `ids` being the base rows the item
+    came from. The UI drains the queue and commits the results to those rows in
+    batches, so startup never blocks on the agent. The base IDs in
+    `excluir` (the rows being enriched) are never offered as retriever candidates,
+    so a row cannot answer for itself with its own blank fields.
+    """
+
+    def __init__(self, agent, itens, cache=None, limiter=None, metricas=None, retriever=None, roteador=None, excluir=(), loop=None):
+        self.agent = agent
+        self.loop = loop
+        self.retriever = retriever
+        self.excluir = excluir
+        self.roteador = roteador
+        self.itens = list(itens)
+        self.cache = cache
+        self.limiter = limiter or AdaptiveLimiter()
+        self.metricas = metricas
+        self.total = len(self.itens)
+        self.concluidos = 0
+        self.erros = 0
+        self.iniciado_em = None
+        self.finalizado_em = None
+        self._fila = queue.Queue()
+        self._thread = None
+        self._futuro = None
+
+    @property
+    def ativo(self):
+        if self._futuro is not None:
+            return not self._futuro.done()
+        return self._thread is not None and self._thread.is_alive()
+
+    def iniciar(self):
+        self.iniciado_em = time.time()
+        if self.loop is not None:
+            self._futuro = self.loop.agendar(self._rodar_async())
+        else:
+            self._thread = threading.Thread(target=self._rodar, name="enriquecimento-base", daemon=True)
+            self._thread.start()
+        return self
+
+    def drenar(self, minimo=1):
+        """
+        Returns the queued results, or [] while fewer than `minimo` are waiting and
+        the worker is still running (so commits happen in batches).
+        """
+        if self.ativo and self._fila.qsize() < minimo:
+            return []
+        resultados = []
+        while True:
+            try:
+                resultados.append(self._fila.get_nowait())
+            except queue.Empty:
+                return resultados
+
+    def _rodar(self):
+        asyncio.run(self._rodar_async())
+
+    async def _rodar_async(self):
+        try:
+            await self._executar()
+        finally:
+            self.finalizado_em = time.time()
+
+    async def _executar(self):
+        async def _classificar(cod, desc, ids):
+            try:
+                classificacao = await aclassificar_item(
+                    self.agent, cod, desc, cache=self.cache, limiter=self.limiter, metricas=self.metricas,
+                    retriever=self.retriever, roteador=self.roteador, excluir=self.excluir,
+                    add_history_to_context=False,
+                )
+                self._fila.put((ids, result_to_dict(classificacao.resultado, cod, desc)))
+            except Exception:
+                self.erros += 1
+            finally:
+                self.concluidos += 1
+
+        await asyncio.gather(*(_classificar(cod, desc, ids) for cod, desc, ids in self.itens))
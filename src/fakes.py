@@ -0,0 +1,163 @@
+"""
+Local stand-ins for Gemini, used by the offline benchmarks (src/benchmark.py).
+
+FakeAuditorModel answers like the auditor agent (ResultadoAuditoria or ResultadoLote
+JSON) after a configurable latency, failing a configurable share of calls with a
+429-style error. FakeEmbedder returns deterministic vectors derived from the text.
+Neither makes network calls, and both are deterministic for a given seed and input.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+from agno.knowledge.embedder.base import Embedder
+from agno.models.base import Model
+from agno.models.metrics import MessageMetrics
+from agno.models.response import ModelResponse
+
+from src.agent import ResultadoLote
+
+# Packed queries: "id_linha | Código | Descrição" (see classifier.montar_query_lote)
+_LINHA_LOTE = re.compile(r"^\s*(\S+)\s*\|\s*(.*?)\s*\|\s*(.+?)\s*$")
+# Single queries: "Código: ..., Descrição: ..." (candidates, when present, follow on the next lines)
+_QUERY_ITEM = re.compile(r"(?:Código:\s*(?P<cod>[^,\n]*),\s*)?Descrição:\s*(?P<desc>[^\n]*)")
+
+SEGMENTACOES_FAKE = ["SAT", "SAD", "LABORATORIO", "HONORARIO MEDICO", "PACOTE"]
+ITENS_FAKE = ["SERVIÇO", "MEDICAMENTOS", "MATERIAIS", "TAXAS"]
+
+
+def _semente(texto):
+    return int.from_bytes(hashlib.md5(texto.encode("utf-8")).digest()[:8], "big")
+
+
+class FakeModelError(Exception):
+    """Simulated provider failure (message matches concurrency.eh_sobrecarga)."""
+
+
+@dataclass
+class FakeAuditorModel(Model):
+    id: str = "fake-auditor"
+    name: str = "FakeAuditor"
+    provider: str = "Fake"
+
+    # Seconds per call (mean) and uniform +/- jitter
+    latencia: float = 0.5
+    variacao_latencia: float = 0.2
+    # Share of calls that fail with a retryable 429 error
+    taxa_erro: float = 0.0
+    # Share of answers classified with ALTO confidence (decided per description)
+    taxa_alto: float = 0.8
+    seed: Optional[int] = 42
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+
+    # --- geração das respostas ---
+
+    def _resultado(self, cod, desc):
+        h = _semente(desc)
+        cod = (cod or "").strip()
+        codigo = cod if re.fullmatch(r"\d{8}", cod) else f"{10_000_000 + h % 90_000_000}"
+        segmentacao = SEGMENTACOES_FAKE[h % len(SEGMENTACOES_FAKE)]
+        return {
+            "codigo_sugerido": codigo,
+            "descricao_procedimento": desc.upper(),
+            "nivel_confianca": "ALTO" if (h % 1000) / 1000 < self.taxa_alto else ("MEDIO" if h % 2 else "BAIXO"),
+            "justificativa_tecnica": "Resposta sintética do modelo de benchmark.",
+            "segmentacao": segmentacao,
+            "item": ITENS_FAKE[(h >> 8) % len(ITENS_FAKE)],
+            "terapia_especial": "SIM" if segmentacao == "SAT" else "NÃO",
+        }
+
+    def _conteudo(self, messages, response_format):
+        pergunta = next((m.get_content_string() for m in reversed(messages) if m.role == "user"), "")
+        if response_format is ResultadoLote or "id_linha" in pergunta:
+            resultados = []
+            for linha in pergunta.splitlines()[1:]:
+                encontrado = _LINHA_LOTE.match(linha)
+                if encontrado:
+                    id_linha, cod, desc = encontrado.groups()
+                    resultados.append({"id_linha": id_linha, **self._resultado("" if cod == "-" else cod, desc)})
+            return json.dumps({"resultados": resultados}, ensure_ascii=False)
+
+        encontrado = _QUERY_ITEM.search(pergunta)
+        cod, desc = (encontrado.group("cod") or "", encontrado.group("desc")) if encontrado else ("", pergunta)
+        return json.dumps(self._resultado(cod, desc.strip()), ensure_ascii=False)
+
+    def _espera(self):
+        return max(0.0, self.latencia + self._rng.uniform(-self.variacao_latencia, self.variacao_latencia))
+
+    def _resposta(self, messages, response_format):
+        if self._rng.random() < self.taxa_erro:
+            raise FakeModelError("429 RESOURCE_EXHAUSTED (simulado)")
+        conteudo = self._conteudo(messages, response_format)
+        entrada = sum(len(m.get_content_string() or "") for m in messages) // 4
+        saida = len(conteudo) // 4
+        return ModelResponse(
+            role="assistant",
+            content=conteudo,
+            response_usage=MessageMetrics(input_tokens=entrada, output_tokens=saida, total_tokens=entrada + saida),
+        )
+
+    # --- interface agno.models.base.Model ---
+
+    def invoke(self, messages, assistant_message, response_format=None, tools=None, tool_choice=None, run_response=None, **kwargs) -> ModelResponse:
+        time.sleep(self._espera())
+        return self._resposta(messages, response_format)
+
+    async def ainvoke(self, messages, assistant_message, response_format=None, tools=None, tool_choice=None, run_response=None, **kwargs) -> ModelResponse:
+        await asyncio.sleep(self._espera())
+        return self._resposta(messages, response_format)
+
+    def invoke_stream(self, *args, **kwargs):
+        yield self.invoke(*args, **kwargs)
+
+    async def ainvoke_stream(self, *args, **kwargs):
+        yield await self.ainvoke(*args, **kwargs)
+
+    def _parse_provider_response(self, response: Any, **kwargs) -> ModelResponse:
+        return response
+
+    def _parse_provider_response_delta(self, response: Any) -> ModelResponse:
+        return response
+
+
+@dataclass
+class FakeEmbedder(Embedder):
+    """Deterministic unit-norm vectors expanded from the md5 of the text."""
+
+    dimensions: int = 768
+    # Simulated seconds per call
+    latencia: float = 0.0
+
+    def _vetor(self, texto: str) -> List[float]:
+        bruto = b""
+        bloco = 0
+        while len(bruto) < self.dimensions * 4:
+            bruto += hashlib.md5(f"{bloco}:{texto}".encode("utf-8")).digest()
+            bloco += 1
+        valores = [v / 2**31 - 1.0 for v in struct.unpack(f"<{self.dimensions}I", bruto[: self.dimensions * 4])]
+        norma = sum(v * v for v in valores) ** 0.5 or 1.0
+        return [v / norma for v in valores]
+
+    def get_embedding(self, text: str) -> List[float]:
+        if self.latencia:
+            time.sleep(self.latencia)
+        return self._vetor(text)
+
+    def get_embedding_and_usage(self, text: str):
+        return self.get_embedding(text), None
+
+    async def async_get_embedding(self, text: str) -> List[float]:
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+        return self._vetor(text)
+
+    async def async_get_embedding_and_usage(self, text: str):
+        return await self.async_get_embedding(text), None
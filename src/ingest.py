@@ -0,0 +1,122 @@
+"""
+Standalone knowledge base ingestion.
+
+Streams the official base from the SQLite store (src/storage.py, the same rows the
+app syncs) in chunks, embeds new/changed rows in large batches with bounded
+concurrency and retry, and appends them to LanceDB in bulk. The sync state is saved
+after every chunk, so an interrupted rebuild resumes where it stopped and the app's
+startup sync becomes a no-op. A CSV goes into the store first with
+`python -m src.storage importar oficial <csv>`.
+
+Usage:
+    python -m src.ingest [--db bases/procedimentos.db] [--recreate]
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from src.database import (
+    SYNC_LOCK, SYNC_STATE_PATH, build_knowledge_base, prepare_sync_state,
+    remove_rows, save_sync_state, upsert_rows,
+)
+from src.embeddings import EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EMBED_MAX_RETRIES
+from src.storage import DB_PATH, ProcedureStore
+from src.vector_index import manter_indices
+
+CHUNK_SIZE = 5000
+
+
+def ingest_store(
+    knowledge_base,
+    db_path=DB_PATH,
+    chunk_size=CHUNK_SIZE,
+    batch_size=EMBED_BATCH_SIZE,
+    concurrency=EMBED_CONCURRENCY,
+    max_retries=EMBED_MAX_RETRIES,
+    recreate=False,
+    state_path=SYNC_STATE_PATH,
+    log=print,
+):
+    """
+    Loads the official base of the store at db_path into the knowledge base chunk by
+    chunk and returns ingestion stats.
+    """
+    vector_db = knowledge_base.vector_db
+    # Other syncs of the same state (e.g. the app) wait until the ingestion ends
+    with SYNC_LOCK:
+        if recreate:
+            if vector_db.exists():
+                vector_db.drop()
+            save_sync_state({}, state_path)
+        state = prepare_sync_state(vector_db, state_path)
+
+        inicio = time.perf_counter()
+        linhas = inseridos = atualizados = 0
+        vistos = set()
+
+        for chunk in ProcedureStore(db_path).carregar_em_partes("oficial", chunksize=chunk_size):
+            novos, alterados, chaves = upsert_rows(
+                vector_db, chunk, state,
+                batch_size=batch_size, concurrency=concurrency, max_retries=max_retries,
+            )
+            save_sync_state(state, state_path)
+
+            linhas += len(chunk)
+            inseridos += len(novos)
+            atualizados += len(alterados)
+            vistos |= chaves
+
+            decorrido = time.perf_counter() - inicio
+            log(
+                f"{linhas} linhas lidas | {inseridos} inseridas | {atualizados} atualizadas | "
+                f"{linhas / decorrido:.1f} linhas/s"
+            )
+
+        removidos = [chave for chave in state if chave not in vistos]
+        remove_rows(vector_db, state, removidos)
+        save_sync_state(state, state_path)
+        # Indexes are built once at the end, not after every chunk
+        indices = manter_indices(vector_db)
+        log(f"Índices: {indices}")
+
+    decorrido = time.perf_counter() - inicio
+    return {
+        "linhas": linhas,
+        "inseridos": inseridos,
+        "atualizados": atualizados,
+        "removidos": len(removidos),
+        "segundos": round(decorrido, 2),
+        "linhas_por_segundo": round(linhas / decorrido, 1) if decorrido else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestão da base de procedimentos no LanceDB.")
+    parser.add_argument("--db", default=DB_PATH, help="Banco SQLite com a Base Oficial.")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Linhas lidas por vez.")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Textos por requisição de embedding.")
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY, help="Requisições de embedding simultâneas.")
+    parser.add_argument("--max-retries", type=int, default=EMBED_MAX_RETRIES, help="Tentativas por lote.")
+    parser.add_argument("--recreate", action="store_true", help="Apaga a tabela e reindexa tudo.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if os.getenv("API_PROJETOS_UNI_GMINAI"):
+        os.environ["GOOGLE_API_KEY"] = os.getenv("API_PROJETOS_UNI_GMINAI")
+
+    stats = ingest_store(
+        build_knowledge_base(),
+        db_path=args.db,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        max_retries=args.max_retries,
+        recreate=args.recreate,
+    )
+    print(f"Ingestão concluída: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import threading
+from typing import Optional
+
+from src.agent import ResultadoAuditoria
+from src.utils import limpar_valor, normalizar_texto
+
+
+def registro_para_resultado(registro) -> ResultadoAuditoria:
+    """
+    Builds a ResultadoAuditoria from a row of the official base.
+    """
+    codigo = limpar_valor(registro.get("CODIGO_SUGERIDO")) or limpar_valor(registro.get("CODIGO"))
+    descricao = limpar_valor(registro.get("DESCRICAO_SUGERIDA")) or limpar_valor(registro.get("DESCRICAO"))
+
+    return ResultadoAuditoria(
+        codigo_sugerido=codigo,
+        descricao_procedimento=descricao,
+        nivel_confianca="ALTO",
+        justificativa_tecnica=f"Correspondência exata com item validado da Base Oficial (código {codigo or 'N/D'}).",
+        segmentacao=limpar_valor(registro.get("SEGMENTACAO")) or None,
+        item=limpar_valor(registro.get("ITEM")) or None,
+        terapia_especial=limpar_valor(registro.get("TERAPIA_ESPECIAL")) or None,
+        tipo_medicamento=limpar_valor(registro.get("TIPO_MEDICAMENTO")) or None,
+        tipo_cancer=limpar_valor(registro.get("TIPO_CANCER")) or None,
+        abreviatura=limpar_valor(registro.get("ABREVIATURA")) or None,
+    )
+
+
+def registro_completo(registro) -> bool:
+    """Whether a row of the official base has ITEM and SEGMENTACAO filled (so it can answer for others)."""
+    return bool(limpar_valor(registro.get("ITEM")) and limpar_valor(registro.get("SEGMENTACAO")))
+
+
+class LookupIndex:
+    """
+    In-memory exact-match index over the official base.
+    Only complete rows (ITEM and SEGMENTACAO filled) with NIVEL_CONFIANCA == "ALTO"
+    are indexed, keyed by CODIGO and by the normalized DESCRICAO, so known items are
+    answered without calling the agent. Rows keep their base ID under "ID", so a
+    lookup can leave out the rows it is filling in. Lookups and updates may run on
+    different threads (UI reruns, enrichment worker).
+    """
+
+    def __init__(self, df=None):
+        self._lock = threading.RLock()
+        self._por_codigo = {}
+        self._por_descricao = {}
+        self._por_id = {}
+        if df is not None:
+            self.adicionar(df)
+
+    def reconstruir(self, df):
+        """
+        Rebuilds the index from scratch (remover() drops single rows without a rebuild).
+        The new index is built aside and swapped in, so lookups never see it half-built.
+        """
+        novo = type(self)(df)
+        with self._lock:
+            self._trocar(novo)
+
+    def _trocar(self, novo):
+        self._por_codigo, self._por_descricao, self._por_id = novo._por_codigo, novo._por_descricao, novo._por_id
+
+    def adicionar(self, df):
+        """Indexes the complete ALTO rows of a DataFrame. Later rows override earlier ones."""
+        if df is None or df.empty or "NIVEL_CONFIANCA" not in df.columns:
+            return
+        altos = df[df["NIVEL_CONFIANCA"] == "ALTO"]
+        for id_linha, registro in zip(altos.index, altos.to_dict("records")):
+            self.adicionar_registro({**registro, "ID": id_linha})
+
+    def adicionar_registro(self, registro):
+        if registro.get("NIVEL_CONFIANCA") != "ALTO" or not registro_completo(registro):
+            return
+        cod = limpar_valor(registro.get("CODIGO"))
+        desc = normalizar_texto(registro.get("DESCRICAO"))
+        with self._lock:
+            if cod:
+                self._por_codigo[cod] = registro
+            if desc:
+                self._por_descricao[desc] = registro
+            if registro.get("ID") is not None:
+                self._por_id[registro["ID"]] = registro
+
+    def remover(self, ids):
+        """
+        Drops the rows with the given base IDs (e.g. moved to the inconsistency queue),
+        without a rebuild. An older row shadowed by a removed one under the same code or
+        description comes back on the next rebuild.
+        """
+        with self._lock:
+            for id_linha in ids:
+                registro = self._por_id.pop(id_linha, None)
+                if registro is not None:
+                    self._remover_registro(registro)
+
+    def _remover_registro(self, registro):
+        cod = limpar_valor(registro.get("CODIGO"))
+        desc = normalizar_texto(registro.get("DESCRICAO"))
+        if cod and self._por_codigo.get(cod) is registro:
+            del self._por_codigo[cod]
+        if desc and self._por_descricao.get(desc) is registro:
+            del self._por_descricao[desc]
+
+    def buscar(self, cod="", desc="", excluir=()) -> Optional[ResultadoAuditoria]:
+        """
+        Returns the stored result for a known code (preferred) or normalized description,
+        or None when the item is not in the official base. Rows whose ID is in `excluir`
+        (e.g. the rows being enriched) never answer.
+        """
+        registro = None
+        cod = limpar_valor(cod)
+        with self._lock:
+            if cod:
+                registro = self._por_codigo.get(cod)
+            if registro is None or registro.get("ID") in excluir:
+                chave = normalizar_texto(desc)
+                registro = self._por_descricao.get(chave) if chave else None
+        if registro is None or registro.get("ID") in excluir:
+            return None
+        return registro_para_resultado(registro)
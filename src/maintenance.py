@@ -0,0 +1,117 @@
+"""
+Maintenance jobs for the local stores.
+
+Agent session storage: sessions not updated for RETENCAO_DIAS days are deleted (and
+only the newest MAX_SESSOES are kept), then the file is compacted with VACUUM.
+
+Knowledge table: the ANN/FTS indexes are built or retrained and the LanceDB
+fragments compacted (src.vector_index); `estatisticas` reports rows, fragments and
+index coverage.
+
+Usage:
+    python -m src.maintenance sessoes [--dias 7] [--max-sessoes 1000]
+    python -m src.maintenance indices [--forcar] [--compactar]
+    python -m src.maintenance estatisticas
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from src.agent import SESSION_TABLE, STORAGE_PATH
+from src.database import VECTOR_DB_PATH, build_knowledge_base
+from src.vector_index import compactar, estatisticas_indices, manter_indices
+
+# Days an idle interactive session is kept
+RETENCAO_DIAS = 7
+# Newest sessions kept regardless of age (None = no limit)
+MAX_SESSOES = 1000
+
+
+def podar_sessoes(storage_path=STORAGE_PATH, dias=RETENCAO_DIAS, max_sessoes=MAX_SESSOES, compactar=True):
+    """
+    Deletes agent sessions idle for more than `dias` days and all but the newest
+    `max_sessoes`, then VACUUMs the file. Returns removal and size stats.
+    """
+    if not os.path.exists(storage_path):
+        return {"removidas": 0, "restantes": 0, "bytes_antes": 0, "bytes_depois": 0}
+
+    bytes_antes = os.path.getsize(storage_path)
+    limite = int(time.time() - dias * 86400)
+    conn = sqlite3.connect(storage_path, timeout=30)
+    try:
+        existe = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SESSION_TABLE,)
+        ).fetchone()
+        if not existe:
+            return {"removidas": 0, "restantes": 0, "bytes_antes": bytes_antes, "bytes_depois": bytes_antes}
+
+        with conn:
+            removidas = conn.execute(
+                f'DELETE FROM "{SESSION_TABLE}" WHERE COALESCE(updated_at, created_at) < ?', (limite,)
+            ).rowcount
+            if max_sessoes is not None:
+                removidas += conn.execute(
+                    f'DELETE FROM "{SESSION_TABLE}" WHERE session_id NOT IN ('
+                    f'SELECT session_id FROM "{SESSION_TABLE}" '
+                    f'ORDER BY COALESCE(updated_at, created_at) DESC LIMIT ?)',
+                    (max_sessoes,),
+                ).rowcount
+        restantes = conn.execute(f'SELECT COUNT(*) FROM "{SESSION_TABLE}"').fetchone()[0]
+
+        if compactar and removidas:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    return {
+        "removidas": removidas,
+        "restantes": restantes,
+        "bytes_antes": bytes_antes,
+        "bytes_depois": os.path.getsize(storage_path),
+    }
+
+
+def manter_base_conhecimento(uri=VECTOR_DB_PATH, forcar=False, compactar_tabela=False):
+    """Builds/retrains the knowledge table indexes (all of them with forcar=True); returns the actions and the stats."""
+    vector_db = build_knowledge_base(uri=uri, embed_cache_path=None).vector_db
+    acoes = manter_indices(vector_db, forcar=forcar)
+    if compactar_tabela and not acoes["compactado"]:
+        compactar(vector_db)
+        acoes["compactado"] = True
+    return acoes, estatisticas_indices(vector_db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção dos armazenamentos locais.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    sessoes = comandos.add_parser("sessoes", help="Remove sessões antigas do agente e compacta o arquivo.")
+    sessoes.add_argument("--db", default=STORAGE_PATH)
+    sessoes.add_argument("--dias", type=int, default=RETENCAO_DIAS, help="Dias de retenção de sessões ociosas.")
+    sessoes.add_argument("--max-sessoes", type=int, default=MAX_SESSOES, help="Sessões mais recentes mantidas.")
+
+    indices = comandos.add_parser("indices", help="Cria/retreina os índices da Base de Conhecimento e compacta a tabela.")
+    indices.add_argument("--uri", default=VECTOR_DB_PATH)
+    indices.add_argument("--forcar", action="store_true", help="Reconstrói os índices vetorial e de texto do zero.")
+    indices.add_argument("--compactar", action="store_true", help="Compacta os fragmentos mesmo abaixo dos limites.")
+
+    estatisticas = comandos.add_parser("estatisticas", help="Linhas, fragmentos e cobertura dos índices da Base de Conhecimento.")
+    estatisticas.add_argument("--uri", default=VECTOR_DB_PATH)
+    args = parser.parse_args()
+
+    if args.comando == "sessoes":
+        print(f"Sessões: {podar_sessoes(args.db, args.dias, args.max_sessoes)}")
+    elif args.comando == "indices":
+        acoes, stats = manter_base_conhecimento(args.uri, args.forcar, args.compactar)
+        print(f"Índices: {acoes}")
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+    elif args.comando == "estatisticas":
+        vector_db = build_knowledge_base(uri=args.uri, embed_cache_path=None).vector_db
+        print(json.dumps(estatisticas_indices(vector_db), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
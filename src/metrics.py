@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from src.agent import ResultadoLote
+
+# Raw per-call metrics (one JSON object per line)
+METRICS_PATH = "tmp/agent_metrics.jsonl"
+# Calls kept in memory for the sidebar summary
+MAX_REGISTROS_MEMORIA = 10_000
+# USD per million tokens (Gemini 2.0 Flash list price); adjust when the model changes
+PRECO_ENTRADA_POR_MILHAO = 0.10
+PRECO_SAIDA_POR_MILHAO = 0.40
+# (input, output) USD per million tokens of the other models used by tiered routing
+PRECOS_POR_MODELO = {
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+# Tool that performs the knowledge base search (agno search_knowledge=True)
+FERRAMENTA_BUSCA = "search_knowledge_base"
+
+
+def _confiancas(conteudo):
+    if isinstance(conteudo, ResultadoLote):
+        return [linha.nivel_confianca for linha in conteudo.resultados]
+    nivel = getattr(conteudo, "nivel_confianca", None)
+    return [nivel] if nivel else []
+
+
+def metricas_resposta(response):
+    """Extracts tokens, tool round-trips and knowledge search time from an agent RunOutput."""
+    metrics = getattr(response, "metrics", None)
+    ferramentas = getattr(response, "tools", None) or []
+    busca = sum(
+        (t.metrics.duration or 0.0) for t in ferramentas
+        if t.tool_name == FERRAMENTA_BUSCA and t.metrics is not None
+    )
+    entrada = getattr(metrics, "input_tokens", 0) or 0
+    saida = getattr(metrics, "output_tokens", 0) or 0
+    modelo = getattr(response, "model", None)
+    preco_entrada, preco_saida = PRECOS_POR_MODELO.get(modelo, (PRECO_ENTRADA_POR_MILHAO, PRECO_SAIDA_POR_MILHAO))
+    return {
+        "modelo": modelo,
+        "tokens_entrada": entrada,
+        "tokens_saida": saida,
+        "tokens_total": getattr(metrics, "total_tokens", 0) or entrada + saida,
+        "primeiro_token_s": getattr(metrics, "time_to_first_token", None),
+        "chamadas_modelo": sum(1 for m in (getattr(response, "messages", None) or []) if m.role == "assistant"),
+        "chamadas_ferramentas": len(ferramentas),
+        "busca_s": round(busca, 4),
+        "custo_usd": (entrada * preco_entrada + saida * preco_saida) / 1e6,
+        "confiancas": _confiancas(getattr(response, "content", None)),
+    }
+
+
+class _Destino:
+    """File + in-memory buffer shared by every MetricsRecorder view of one path."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.recentes = deque(maxlen=MAX_REGISTROS_MEMORIA)
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+
+class MetricsRecorder:
+    """
+    Records one entry per agent invocation (each retry counts as an invocation):
+    latency, model/search time split, tokens, cost, tool round-trips, row ids and
+    confidence levels. Entries are appended to a JSONL file and kept in memory for
+    resumo(). `fonte` tags where the call came from ("individual", "lote", "enriquecimento").
+    """
+
+    def __init__(self, path=METRICS_PATH, fonte="individual", _destino=None):
+        self.fonte = fonte
+        self._destino = _destino or _Destino(path)
+
+    @property
+    def path(self):
+        return self._destino.path
+
+    def com_fonte(self, fonte):
+        """Same file and buffer, different source tag."""
+        return MetricsRecorder(fonte=fonte, _destino=self._destino)
+
+    def registrar(self, inicio, response=None, ids=(), erro=None):
+        """Records a call that started at `inicio` (time.perf_counter()) and just ended."""
+        latencia = time.perf_counter() - inicio
+        registro = {
+            "ts": time.time(),
+            "fonte": self.fonte,
+            "ids": list(ids),
+            "linhas": len(ids),
+            "latencia_s": round(latencia, 4),
+            "status": "erro" if erro is not None else "ok",
+        }
+        if erro is not None:
+            registro["erro"] = f"{type(erro).__name__}: {erro}"[:300]
+        if response is not None:
+            registro.update(metricas_resposta(response))
+            registro["modelo_s"] = round(max(latencia - registro["busca_s"], 0.0), 4)
+
+        destino = self._destino
+        with destino.lock:
+            destino.recentes.append(registro)
+            if destino.path:
+                with open(destino.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        return registro
+
+    def resumo(self, fonte=None):
+        """Aggregates of the in-memory calls (optionally of one source)."""
+        with self._destino.lock:
+            registros = [r for r in self._destino.recentes if fonte is None or r["fonte"] == fonte]
+        if not registros:
+            return None
+
+        latencias = np.array([r["latencia_s"] for r in registros])
+        ok = [r for r in registros if r["status"] == "ok"]
+        confiancas = {}
+        por_modelo = {}
+        for r in ok:
+            for nivel in r.get("confiancas", []):
+                confiancas[nivel] = confiancas.get(nivel, 0) + 1
+            modelo = por_modelo.setdefault(r.get("modelo") or "-", {"chamadas": 0, "linhas": 0, "custo_usd": 0.0})
+            modelo["chamadas"] += 1
+            modelo["linhas"] += r["linhas"]
+            modelo["custo_usd"] += r["custo_usd"]
+        return {
+            "chamadas": len(registros),
+            "erros": len(registros) - len(ok),
+            "linhas": sum(r["linhas"] for r in registros),
+            "p50_s": float(np.percentile(latencias, 50)),
+            "p95_s": float(np.percentile(latencias, 95)),
+            "p99_s": float(np.percentile(latencias, 99)),
+            "busca_media_s": float(np.mean([r["busca_s"] for r in ok])) if ok else 0.0,
+            "ferramentas_por_chamada": float(np.mean([r["chamadas_ferramentas"] for r in ok])) if ok else 0.0,
+            "tokens_entrada": sum(r["tokens_entrada"] for r in ok),
+            "tokens_saida": sum(r["tokens_saida"] for r in ok),
+            "custo_usd": sum(r["custo_usd"] for r in ok),
+            "confiancas": confiancas,
+            "por_modelo": por_modelo,
+        }
@@ -0,0 +1,192 @@
+import math
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from src.agent import ResultadoAuditoria
+from src.lookup import LookupIndex, registro_completo, registro_para_resultado
+from src.utils import limpar_valor, normalizar_texto
+
+# Candidates injected into each prompt
+TOP_K = 5
+# Candidates rescored with trigram similarity after the token pass
+POOL = 50
+# Tokens present in more rows than this only count when the query has no rarer token
+MAX_POSTINGS = 5000
+# Score at or above which the best candidate is accepted without calling the agent
+LIMIAR_AUTO = 0.92
+# Best local score below which the knowledge base (LanceDB hybrid search) is also queried;
+# reworded near matches score around 0.4-0.5, unrelated wording well below
+LIMIAR_VETORIAL = 0.3
+# Leading digits shared by codes of the same procedure group (TUSS)
+PREFIXO_CODIGO = 6
+
+CAMPOS_CANDIDATO = ["ITEM", "SEGMENTACAO", "TERAPIA_ESPECIAL", "TIPO_MEDICAMENTO", "TIPO_CANCER", "ABREVIATURA"]
+
+
+def _tokens(texto):
+    return {t for t in re.findall(r"[A-Z0-9]+", texto) if len(t) >= 2}
+
+
+def _trigramas(texto):
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def similaridade(a, b):
+    """Trigram Jaccard similarity of two normalized strings (0..1)."""
+    ta, tb = _trigramas(a), _trigramas(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+class CandidateRetriever(LookupIndex):
+    """
+    LookupIndex plus fuzzy top-k retrieval over the official base.
+
+    An inverted token index (IDF-weighted) on the normalized DESCRICAO and a
+    code-prefix index collect a candidate pool, which is rescored with trigram
+    similarity (and a bonus for the same code / code group). The best candidates go
+    into the prompt so the agent answers in one turn without the search tool.
+    """
+
+    def __init__(self, df=None):
+        self._postings = defaultdict(set)
+        self._por_prefixo = defaultdict(set)
+        super().__init__(df)
+
+    def _trocar(self, novo):
+        super()._trocar(novo)
+        self._postings, self._por_prefixo = novo._postings, novo._por_prefixo
+
+    def adicionar_registro(self, registro):
+        if registro.get("NIVEL_CONFIANCA") != "ALTO" or not registro_completo(registro):
+            return
+        desc = normalizar_texto(registro.get("DESCRICAO"))
+        cod = limpar_valor(registro.get("CODIGO"))
+        with self._lock:
+            super().adicionar_registro(registro)
+            if not desc:
+                return
+            for token in _tokens(desc):
+                self._postings[token].add(desc)
+            if len(cod) >= PREFIXO_CODIGO:
+                self._por_prefixo[cod[:PREFIXO_CODIGO]].add(desc)
+
+    def _remover_registro(self, registro):
+        desc = normalizar_texto(registro.get("DESCRICAO"))
+        if desc and self._por_descricao.get(desc) is registro:
+            cod = limpar_valor(registro.get("CODIGO"))
+            for token in _tokens(desc):
+                self._postings[token].discard(desc)
+            self._por_prefixo.get(cod[:PREFIXO_CODIGO], set()).discard(desc)
+        super()._remover_registro(registro)
+
+    def _idf(self, token):
+        return math.log(1 + len(self._por_descricao) / (1 + len(self._postings.get(token, ()))))
+
+    def candidatos(self, cod="", desc="", k=TOP_K, knowledge_base=None, excluir=(), limiar_vetorial=LIMIAR_VETORIAL) -> List[Dict]:
+        """
+        Returns up to k candidate rows (dicts with the official fields plus "SCORE"),
+        best first. With a knowledge_base, LanceDB hybrid results join the pool when the
+        local pool is empty or its best score is below limiar_vetorial (wording that
+        shares no token or trigram with the base). Rows whose ID is in `excluir`
+        (e.g. the rows being enriched) are left out.
+        """
+        cod = limpar_valor(cod)
+        consulta = normalizar_texto(limpar_valor(desc))
+        tokens = _tokens(consulta)
+
+        # The pool is read under the lock: reconstruir() swaps all the maps at once
+        with self._lock:
+            idf = {t: self._idf(t) for t in tokens}
+            pesos = defaultdict(float)
+            raros = [t for t in tokens if 0 < len(self._postings.get(t, ())) <= MAX_POSTINGS] or list(tokens)
+            for token in raros:
+                for chave in self._postings.get(token, ()):
+                    pesos[chave] += idf[token]
+            pool = set(sorted(pesos, key=pesos.get, reverse=True)[:POOL])
+
+            if len(cod) >= PREFIXO_CODIGO:
+                pool |= self._por_prefixo.get(cod[:PREFIXO_CODIGO], set())
+
+            registros = {chave: self._por_descricao[chave] for chave in pool}
+        registros = {chave: r for chave, r in registros.items() if r.get("ID") not in excluir}
+        pontuados = self._pontuar(registros, cod, consulta, tokens, idf)
+
+        if knowledge_base is not None and consulta and candidatos_fracos(pontuados, limiar_vetorial):
+            vetoriais = {}
+            for registro in self._vetoriais(knowledge_base, consulta, k):
+                chave = normalizar_texto(registro.get("DESCRICAO"))
+                if chave not in registros and registro_completo(registro):
+                    vetoriais.setdefault(chave, registro)
+            pontuados = sorted(
+                pontuados + self._pontuar(vetoriais, cod, consulta, tokens, idf), key=lambda r: r["SCORE"], reverse=True
+            )
+        return pontuados[:k]
+
+    @staticmethod
+    def _pontuar(registros, cod, consulta, tokens, idf):
+        # Trigram similarity plus the IDF share of the query tokens, with a bonus for the same code / code group
+        peso_consulta = sum(idf.values()) or 1.0
+        pontuados = []
+        for chave, registro in registros.items():
+            comuns = tokens & _tokens(chave)
+            score = 0.5 * similaridade(consulta, chave) + 0.5 * sum(idf[t] for t in comuns) / peso_consulta
+            cod_registro = limpar_valor(registro.get("CODIGO"))
+            if cod and cod_registro == cod:
+                score = min(1.0, score + 0.2)
+            elif cod and cod_registro[:PREFIXO_CODIGO] == cod[:PREFIXO_CODIGO]:
+                score = min(1.0, score + 0.05)
+            pontuados.append({**registro, "SCORE": round(score, 3)})
+        pontuados.sort(key=lambda r: r["SCORE"], reverse=True)
+        return pontuados
+
+    @staticmethod
+    def _vetoriais(knowledge_base, consulta, k):
+        # Documents are "COL: valor; COL: valor" (see database._row_document)
+        for documento in knowledge_base.vector_db.search(consulta, limit=k):
+            campos = dict(
+                parte.split(": ", 1) for parte in documento.content.split("; ") if ": " in parte
+            )
+            if campos.get("DESCRICAO"):
+                yield campos
+
+
+def candidatos_fracos(candidatos, limiar=LIMIAR_VETORIAL) -> bool:
+    """Whether the local candidates are missing or all score below limiar (so the knowledge base is worth a search)."""
+    return not candidatos or candidatos[0]["SCORE"] < limiar
+
+
+def resultado_por_candidato(candidato, cod="", desc="", limiar=LIMIAR_AUTO) -> Optional[ResultadoAuditoria]:
+    """
+    ResultadoAuditoria for a near-exact, complete candidate (score >= limiar, ITEM and
+    SEGMENTACAO filled and, when the input has a code, the same code), or None when
+    the agent must decide.
+    """
+    if candidato is None or candidato["SCORE"] < limiar or not registro_completo(candidato):
+        return None
+    cod = limpar_valor(cod)
+    if cod and cod != limpar_valor(candidato.get("CODIGO")):
+        return None
+    resultado = registro_para_resultado(candidato)
+    resultado.justificativa_tecnica = (
+        f"Candidato quase idêntico da Base Oficial (similaridade {candidato['SCORE']:.2f}) "
+        f"para '{limpar_valor(desc)}'."
+    )
+    return resultado
+
+
+def formatar_candidatos(candidatos, recuo=""):
+    """Candidate block appended to the agent query (no '|' so packed rows stay parseable)."""
+    if not candidatos:
+        return f"{recuo}Candidatos da Base Oficial: nenhum."
+    linhas = [f"{recuo}Candidatos da Base Oficial (código · descrição · campos · similaridade):"]
+    for c in candidatos:
+        campos = ", ".join(f"{col}={limpar_valor(c.get(col))}" for col in CAMPOS_CANDIDATO if limpar_valor(c.get(col)))
+        linhas.append(
+            f"{recuo}- {limpar_valor(c.get('CODIGO')) or '-'} · {limpar_valor(c.get('DESCRICAO'))} · "
+            f"{campos or '-'} · {c['SCORE']:.2f}"
+        )
+    return "\n".join(linhas)
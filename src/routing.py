@@ -0,0 +1,121 @@
+"""
+Tiered model routing.
+
+Each row is answered by the cheapest tier first; only answers with a confidence in
+ESCALATION_CONFIDENCE, a schema failure (row missing or malformed) or an invalid
+8-digit code move on to the next, stronger tier. The last tier's answer is final,
+and a valid answer from a lower tier is kept when an escalation call fails. The
+classifier (src/classifier.py) drives the tiers; RoteadorModelos holds their agents
+and counts, per tier, how many rows were answered there and why the others moved up.
+"""
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from src.agent import ESCALATION_CONFIDENCE, MODEL_TIERS, ResultadoAuditoria, get_auditor_agent, get_batch_auditor_agent
+from src.classifier import resultado_valido
+
+# Escalation reasons counted per tier ("erro": the tier call failed after its retries)
+MOTIVOS = ["confianca", "schema", "codigo", "erro"]
+
+
+class NivelModelo(NamedTuple):
+    nome: str
+    agent: Any
+    agent_lote: Any = None
+
+
+class RoteadorModelos:
+    """Ordered model tiers (cheapest first) with thread-safe per-tier hit/escalation counts."""
+
+    def __init__(self, niveis: List[NivelModelo], confianca_escalonar=ESCALATION_CONFIDENCE):
+        if not niveis:
+            raise ValueError("O roteamento precisa de ao menos um nível de modelo.")
+        self.niveis = list(niveis)
+        self.confianca_escalonar = set(confianca_escalonar)
+        self._lock = threading.Lock()
+        self._contagem = {n.nome: {"linhas": 0, "aceitas": 0, **{m: 0 for m in MOTIVOS}} for n in self.niveis}
+
+    @property
+    def agent(self):
+        """Single-row agent of the first tier."""
+        return self.niveis[0].agent
+
+    @property
+    def agent_lote(self):
+        """Packed agent of the first tier."""
+        return self.niveis[0].agent_lote
+
+    def motivo_escalonamento(self, resultado) -> Optional[str]:
+        """Why an answer should go to the next tier, or None when it is accepted."""
+        if not isinstance(resultado, ResultadoAuditoria):
+            return "schema"
+        if not resultado_valido(resultado):
+            return "codigo"
+        if resultado.nivel_confianca in self.confianca_escalonar:
+            return "confianca"
+        return None
+
+    def registrar(self, nivel, motivo=None):
+        """Counts one row answered at `nivel` (motivo=None) or moved up for `motivo`."""
+        with self._lock:
+            contagem = self._contagem[nivel]
+            contagem["linhas"] += 1
+            contagem["aceitas" if motivo is None else motivo] += 1
+
+    def estatisticas(self) -> List[Dict[str, Any]]:
+        """One dict per tier: rows received, accepted and escalated (by reason), and the hit rate."""
+        with self._lock:
+            return _resumir({nome: dict(c) for nome, c in self._contagem.items()})
+
+
+def _resumir(contagens):
+    return [
+        {
+            "nivel": nome,
+            **c,
+            "escalonadas": sum(c[m] for m in MOTIVOS),
+            "taxa_acerto": round(c["aceitas"] / c["linhas"], 4) if c["linhas"] else 0.0,
+        }
+        for nome, c in contagens.items()
+    ]
+
+
+def somar_estatisticas(*listas) -> List[Dict[str, Any]]:
+    """Adds up estatisticas() of several routers (e.g. one per batch worker), keeping tier order."""
+    total: Dict[str, Dict[str, int]] = {}
+    for estatisticas in listas:
+        for e in estatisticas:
+            atual = total.setdefault(e["nivel"], {"linhas": 0, "aceitas": 0, **{m: 0 for m in MOTIVOS}})
+            for chave in atual:
+                atual[chave] += e[chave]
+    return _resumir(total)
+
+
+def get_roteador(
+    knowledge_base,
+    niveis=MODEL_TIERS,
+    confianca_escalonar=ESCALATION_CONFIDENCE,
+    candidatos=False,
+    models=None,
+):
+    """
+    Builds a RoteadorModelos with stateless single-row and packed agents for each
+    Gemini model id in `niveis`. `models` maps tier names to replacement models
+    (e.g. src.fakes.FakeAuditorModel in benchmarks).
+    """
+    models = models or {}
+    return RoteadorModelos(
+        [
+            NivelModelo(
+                nome,
+                get_auditor_agent(
+                    knowledge_base, storage_path=None, model=models.get(nome), candidatos=candidatos, model_id=nome
+                ),
+                get_batch_auditor_agent(
+                    knowledge_base, model=models.get(nome), candidatos=candidatos, model_id=nome
+                ),
+            )
+            for nome in niveis
+        ],
+        confianca_escalonar,
+    )
@@ -0,0 +1,139 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from src.agent import ResultadoAuditoria
+from src.utils import limpar_valor
+
+# Deterministic rules from prompt_classificacao.md, applied to a whole DataFrame at once.
+# Keywords are written in normalized form (no accents, upper case), matching normalizar_texto.
+
+# Segmentation rules in priority order: (segment, keywords, code prefix regex)
+REGRAS_SEGMENTACAO = [
+    ("PACOTE", ["PACOTE", "KIT", "TAXA DE SALA", "DIARIA"], r"^[89]"),
+    ("HONORARIO MEDICO", ["VISITA HOSPITALAR"], r"^3"),
+    ("LABORATORIO", ["DOSAGEM", "PESQUISA"], r"^403"),
+    ("SAD", ["RX", "TC", "RM", "ECG", "RADIOGRAFIA", "TOMOGRAFIA", "RESSONANCIA", "ELETROCARDIOGRAMA"], None),
+    ("SAT", ["SESSAO", "FONOAUDIOLOGIA", "FISIOTERAPIA", "PSICOLOGIA", "NUTRICAO", "TERAPIA OCUPACIONAL"], None),
+]
+
+# ITEM implied by the segment (PACOTE depends on the keyword, see ITEM_TAXAS)
+ITEM_POR_SEGMENTACAO = {
+    "HONORARIO MEDICO": "SERVIÇO",
+    "LABORATORIO": "SERVIÇO",
+    "SAD": "SERVIÇO",
+    "SAT": "SERVIÇO",
+}
+ITEM_TAXAS = ["TAXA DE SALA", "DIARIA"]
+
+TERAPIAS_ESPECIAIS = [
+    "ABA", "BOBATH", "PEDIASUIT", "THERASUIT", "INTEGRACAO SENSORIAL", "DENVER",
+    "PROMPT", "HANEN", "TEACCH", "EQUOTERAPIA", "PSICOMOTRICIDADE",
+]
+
+
+def _padrao(palavras):
+    # Whole-word match so short keywords ("ABA", "RM", "TC") do not hit inside other words
+    return r"\b(?:" + "|".join(re.escape(p) for p in palavras) + r")\b"
+
+
+def _normalizar_serie(serie):
+    return (
+        serie.fillna("").astype(str)
+        .str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+        .str.upper().str.strip()
+    )
+
+
+def _so_digitos(codigo):
+    # The code as validated (8 digits) and as returned by the rules: everything but digits removed
+    return re.sub(r"\D", "", limpar_valor(codigo))
+
+
+def _terapia_especial(descricoes):
+    especial = descricoes.str.contains(_padrao(TERAPIAS_ESPECIAIS), regex=True)
+    return pd.Series(np.where(especial, "SIM", "NÃO"), index=descricoes.index)
+
+
+def aplicar_regras(df, col_codigo="CODIGO", col_descricao="DESCRICAO"):
+    """
+    Applies the prompt_classificacao.md rules to every row of df.
+
+    Returns a DataFrame aligned with df containing SEGMENTACAO, ITEM and
+    TERAPIA_ESPECIAL ("" where no rule applies), REGRA_RESOLVIDA (exactly one
+    segmentation rule matched) and AUTOMATICO (segment and item resolved and the
+    row carries a valid 8-digit code, so it needs no agent call).
+    """
+    descricoes = _normalizar_serie(df[col_descricao]) if col_descricao in df.columns else pd.Series("", index=df.index)
+    codigos = df[col_codigo].map(_so_digitos) if col_codigo in df.columns else pd.Series("", index=df.index)
+
+    condicoes = []
+    for _, palavras, prefixo in REGRAS_SEGMENTACAO:
+        cond = descricoes.str.contains(_padrao(palavras), regex=True)
+        if prefixo:
+            cond = cond | codigos.str.contains(prefixo, regex=True)
+        condicoes.append(cond.to_numpy())
+
+    segmentos = [seg for seg, _, _ in REGRAS_SEGMENTACAO]
+    total_regras = np.sum(condicoes, axis=0)
+    resolvida = total_regras == 1
+
+    segmentacao = pd.Series(np.select(condicoes, segmentos, default=""), index=df.index)
+    segmentacao = segmentacao.where(resolvida, "")
+
+    item = segmentacao.map(ITEM_POR_SEGMENTACAO).fillna("")
+    taxas = (segmentacao == "PACOTE") & descricoes.str.contains(_padrao(ITEM_TAXAS), regex=True)
+    item = item.mask(taxas, "TAXAS")
+
+    terapia = _terapia_especial(descricoes).where(segmentacao == "SAT", "")
+
+    automatico = pd.Series(resolvida, index=df.index) & (item != "") & codigos.str.fullmatch(r"\d{8}")
+
+    return pd.DataFrame({
+        "SEGMENTACAO": segmentacao,
+        "ITEM": item,
+        "TERAPIA_ESPECIAL": terapia,
+        "REGRA_RESOLVIDA": resolvida,
+        "AUTOMATICO": automatico,
+    }, index=df.index)
+
+
+def preencher_por_regras(df, col_codigo="CODIGO", col_descricao="DESCRICAO"):
+    """
+    Fills blank SEGMENTACAO/ITEM/TERAPIA_ESPECIAL cells of df in place using the rules.
+    Returns the index labels of the rows changed.
+    """
+    if df.empty:
+        return df.index
+
+    regras = aplicar_regras(df, col_codigo, col_descricao)
+    alteradas = pd.Series(False, index=df.index)
+
+    for col in ["SEGMENTACAO", "ITEM"]:
+        vazio = df[col].isna() | (df[col] == "")
+        preencher = vazio & (regras[col] != "")
+        df.loc[preencher, col] = regras.loc[preencher, col]
+        alteradas |= preencher
+
+    # Terapia especial only applies to rows whose (final) segment is SAT
+    terapia = _terapia_especial(_normalizar_serie(df[col_descricao]))
+    vazio = df["TERAPIA_ESPECIAL"].isna() | (df["TERAPIA_ESPECIAL"] == "")
+    preencher = vazio & (df["SEGMENTACAO"] == "SAT")
+    df.loc[preencher, "TERAPIA_ESPECIAL"] = terapia[preencher]
+    alteradas |= preencher
+
+    return df.index[alteradas.to_numpy()]
+
+
+def resultado_por_regra(regra, cod, desc) -> ResultadoAuditoria:
+    """Builds the ResultadoAuditoria for a row marked AUTOMATICO by aplicar_regras."""
+    return ResultadoAuditoria(
+        codigo_sugerido=_so_digitos(cod),
+        descricao_procedimento=str(desc).strip(),
+        nivel_confianca="ALTO",
+        justificativa_tecnica=f"Classificado por regra determinística (prompt_classificacao.md): segmentação {regra['SEGMENTACAO']}.",
+        segmentacao=regra["SEGMENTACAO"],
+        item=regra["ITEM"],
+        terapia_especial=regra["TERAPIA_ESPECIAL"] or None,
+    )
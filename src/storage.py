@@ -0,0 +1,339 @@
+"""
+Row-level storage for the official base and the inconsistency queue.
+
+Both tables live in one SQLite database (WAL mode) with an INTEGER PRIMARY KEY "ID"
+and an index on CODIGO. Inserts, updates and moves between tables touch only the
+rows involved and run in a single transaction, so concurrent Streamlit sessions no
+longer overwrite each other's work. CSV remains the import/export format:
+
+    python -m src.storage exportar oficial bases/classificacao_procedimentos.csv
+    python -m src.storage importar inconsistencias bases/inconsistencias.csv
+"""
+import argparse
+import os
+import sqlite3
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+DB_PATH = "bases/procedimentos.db"
+TABELAS = ("oficial", "inconsistencias")
+
+# Colunas Oficiais
+COLS_FULL = [
+    "CODIGO", "DESCRICAO", "ABREVIATURA", "ITEM", "SEGMENTACAO",
+    "TERAPIA_ESPECIAL", "TIPO_MEDICAMENTO", "TIPO_CANCER",
+    "CODIGO_SUGERIDO", "DESCRICAO_SUGERIDA", "NIVEL_CONFIANCA",
+    "JUSTIFICATIVA", "DATA_MODIFICACAO"
+]
+
+
+# DATA_MODIFICACAO is stored as zero-padded dd/mm/YYYY (see _data_padrao); this SQL
+# expression turns it into YYYY-MM-DD
+_DATA_ISO = "substr(DATA_MODIFICACAO, 7, 4) || '-' || substr(DATA_MODIFICACAO, 4, 2) || '-' || substr(DATA_MODIFICACAO, 1, 2)"
+_DATA_PADRAO_GLOB = "[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]"
+
+
+def _valor(valor):
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return None
+    return str(valor)
+
+
+def _data_padrao(valor):
+    """
+    DATA_MODIFICACAO as zero-padded dd/mm/YYYY, from d/m/YYYY or YYYY-MM-DD (a time
+    part is dropped). Values in other formats are kept as they are.
+    """
+    texto = _valor(valor)
+    if not texto:
+        return texto
+    data = texto.strip().split(" ")[0].split("T")[0]
+    partes = data.split("/")
+    if len(partes) == 3 and all(p.isdigit() for p in partes) and len(partes[2]) == 4:
+        return f"{int(partes[0]):02d}/{int(partes[1]):02d}/{partes[2]}"
+    partes = data.split("-")
+    if len(partes) == 3 and all(p.isdigit() for p in partes) and len(partes[0]) == 4:
+        return f"{int(partes[2]):02d}/{int(partes[1]):02d}/{partes[0]}"
+    return texto
+
+
+class ProcedureStore:
+    """SQLite-backed storage with row-level insert/update/move operations."""
+
+    def __init__(self, path=DB_PATH, colunas=COLS_FULL):
+        self.path = path
+        self.colunas = list(colunas)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._criar_tabelas()
+
+    # --- infraestrutura ---
+
+    def _conectar(self):
+        # One short-lived connection per operation: safe across Streamlit threads
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def transacao(self):
+        """Atomic block: BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error)."""
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _criar_tabelas(self):
+        colunas_sql = ", ".join(f'"{col}" TEXT' for col in self.colunas)
+        with self.transacao() as conn:
+            for tabela in TABELAS:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{tabela}" (ID INTEGER PRIMARY KEY AUTOINCREMENT, {colunas_sql})')
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{tabela}_codigo" ON "{tabela}" (CODIGO)')
+                self._padronizar_datas(conn, tabela)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('geracao', ?)", (uuid.uuid4().hex,))
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('versao_oficial', '0')")
+
+    def _padronizar_datas(self, conn, tabela):
+        # Rows written before dates were normalized (or by other tools) would escape the date filters
+        if "DATA_MODIFICACAO" not in self.colunas:
+            return
+        linhas = conn.execute(
+            f'SELECT ID, DATA_MODIFICACAO FROM "{tabela}" WHERE DATA_MODIFICACAO NOT GLOB ?', (_DATA_PADRAO_GLOB,)
+        ).fetchall()
+        corrigidas = [(_data_padrao(data), id_) for id_, data in linhas if _data_padrao(data) != data]
+        conn.executemany(f'UPDATE "{tabela}" SET DATA_MODIFICACAO = ? WHERE ID = ?', corrigidas)
+
+    def _validar(self, tabela):
+        if tabela not in TABELAS:
+            raise ValueError(f"Tabela desconhecida: {tabela}")
+
+    def _tocar(self, conn, tabela):
+        # Every write to the official base bumps its version (used to invalidate caches)
+        if tabela == "oficial":
+            conn.execute("UPDATE meta SET valor = CAST(valor AS INTEGER) + 1 WHERE chave = 'versao_oficial'")
+
+    def _registros(self, linhas):
+        if isinstance(linhas, pd.DataFrame):
+            linhas = linhas.to_dict("records")
+        conversores = [_data_padrao if col == "DATA_MODIFICACAO" else _valor for col in self.colunas]
+        return [tuple(f(linha.get(col)) for f, col in zip(conversores, self.colunas)) for linha in linhas]
+
+    # --- leitura ---
+
+    def _meta(self):
+        conn = self._conectar()
+        try:
+            return dict(conn.execute("SELECT chave, valor FROM meta").fetchall())
+        finally:
+            conn.close()
+
+    def versao(self):
+        """Version of the official base ("<generation>:<counter>"), changed by every write."""
+        valores = self._meta()
+        return f"{valores['geracao']}:{valores['versao_oficial']}"
+
+    def geracao(self):
+        """Generation of the database, which only changes when it is created from scratch."""
+        return self._meta()["geracao"]
+
+    def contar(self, tabela):
+        self._validar(tabela)
+        conn = self._conectar()
+        try:
+            return conn.execute(f'SELECT COUNT(*) FROM "{tabela}"').fetchone()[0]
+        finally:
+            conn.close()
+
+    def carregar(self, tabela):
+        """Returns the whole table as a DataFrame indexed by ID."""
+        self._validar(tabela)
+        conn = self._conectar()
+        try:
+            df = pd.read_sql_query(f'SELECT * FROM "{tabela}" ORDER BY ID', conn, index_col="ID", dtype=str)
+        finally:
+            conn.close()
+        df.index = df.index.astype(int)
+        return df
+
+    def carregar_em_partes(self, tabela, chunksize=10_000):
+        """Streams the table as DataFrames of up to `chunksize` rows indexed by ID (bounded memory)."""
+        self._validar(tabela)
+        conn = self._conectar()
+        try:
+            for df in pd.read_sql_query(
+                f'SELECT * FROM "{tabela}" ORDER BY ID', conn, index_col="ID", dtype=str, chunksize=chunksize
+            ):
+                df.index = df.index.astype(int)
+                yield df
+        finally:
+            conn.close()
+
+    def buscar_por_codigo(self, tabela, codigo):
+        """Indexed lookup of the rows with a given CODIGO."""
+        self._validar(tabela)
+        conn = self._conectar()
+        try:
+            df = pd.read_sql_query(
+                f'SELECT * FROM "{tabela}" WHERE CODIGO = ? ORDER BY ID', conn,
+                params=(str(codigo),), index_col="ID", dtype=str,
+            )
+        finally:
+            conn.close()
+        df.index = df.index.astype(int)
+        return df
+
+    def _filtro(self, confianca=None, segmentacoes=None, data_inicio=None, data_fim=None):
+        condicoes, parametros = [], []
+        for coluna, valores in (("NIVEL_CONFIANCA", confianca), ("SEGMENTACAO", segmentacoes)):
+            if valores:
+                condicoes.append(f'"{coluna}" IN ({", ".join("?" for _ in valores)})')
+                parametros += list(valores)
+        if data_inicio:
+            condicoes.append(f"{_DATA_ISO} >= ?")
+            parametros.append(data_inicio.isoformat())
+        if data_fim:
+            condicoes.append(f"{_DATA_ISO} <= ?")
+            parametros.append(data_fim.isoformat())
+        return (f"WHERE {' AND '.join(condicoes)}" if condicoes else ""), parametros
+
+    def filtrar(self, tabela, confianca=None, segmentacoes=None, data_inicio=None, data_fim=None, limite=None, deslocamento=0):
+        """
+        One page of the rows matching the filters (DataFrame indexed by ID, oldest
+        first) and the total number of matches, without loading the rest of the table.
+        confianca/segmentacoes are lists of accepted values; the dates are datetime.date.
+        """
+        self._validar(tabela)
+        where, parametros = self._filtro(confianca, segmentacoes, data_inicio, data_fim)
+        conn = self._conectar()
+        try:
+            total = conn.execute(f'SELECT COUNT(*) FROM "{tabela}" {where}', parametros).fetchone()[0]
+            df = pd.read_sql_query(
+                f'SELECT * FROM "{tabela}" {where} ORDER BY ID LIMIT ? OFFSET ?', conn,
+                params=[*parametros, -1 if limite is None else int(limite), int(deslocamento)],
+                index_col="ID", dtype=str,
+            )
+        finally:
+            conn.close()
+        df.index = df.index.astype(int)
+        return df, total
+
+    def valores_distintos(self, tabela, coluna):
+        """Sorted non-empty values of a column (filter options)."""
+        self._validar(tabela)
+        if coluna not in self.colunas:
+            raise ValueError(f"Coluna desconhecida: {coluna}")
+        conn = self._conectar()
+        try:
+            linhas = conn.execute(
+                f'SELECT DISTINCT "{coluna}" FROM "{tabela}" WHERE "{coluna}" IS NOT NULL AND "{coluna}" != \'\' ORDER BY 1'
+            ).fetchall()
+        finally:
+            conn.close()
+        return [valor for (valor,) in linhas]
+
+    # --- escrita ---
+
+    def _inserir(self, conn, tabela, registros):
+        colunas_sql = ", ".join(f'"{col}"' for col in self.colunas)
+        marcadores = ", ".join("?" for _ in self.colunas)
+        sql = f'INSERT INTO "{tabela}" ({colunas_sql}) VALUES ({marcadores})'
+        ids = [conn.execute(sql, registro).lastrowid for registro in registros]
+        if ids:
+            self._tocar(conn, tabela)
+        return ids
+
+    def inserir(self, tabela, linhas):
+        """Inserts rows (DataFrame or list of dicts) and returns their new IDs."""
+        self._validar(tabela)
+        with self.transacao() as conn:
+            return self._inserir(conn, tabela, self._registros(linhas))
+
+    def atualizar(self, tabela, linhas_df):
+        """
+        Writes the given rows (DataFrame indexed by ID) back to the table, one
+        UPDATE ... WHERE ID = ? each. IDs no longer in the table (moved or deleted by
+        another session) are skipped, never re-inserted. Returns the IDs updated.
+        """
+        self._validar(tabela)
+        if linhas_df.empty:
+            return []
+        atribuicoes = ", ".join(f'"{col}" = ?' for col in self.colunas)
+        sql = f'UPDATE "{tabela}" SET {atribuicoes} WHERE ID = ?'
+        atualizados = []
+        with self.transacao() as conn:
+            for id_, registro in zip(linhas_df.index, self._registros(linhas_df)):
+                if conn.execute(sql, (*registro, int(id_))).rowcount:
+                    atualizados.append(id_)
+            if atualizados:
+                self._tocar(conn, tabela)
+        return atualizados
+
+    def mover(self, origem, destino, linhas_df):
+        """
+        Moves rows (DataFrame indexed by their ID in `origem`, with the values to store)
+        to `destino` in one transaction. Returns the new IDs in `destino`.
+        """
+        self._validar(origem)
+        self._validar(destino)
+        if linhas_df.empty:
+            return []
+        with self.transacao() as conn:
+            conn.executemany(f'DELETE FROM "{origem}" WHERE ID = ?', [(int(i),) for i in linhas_df.index])
+            self._tocar(conn, origem)
+            return self._inserir(conn, destino, self._registros(linhas_df))
+
+    # --- importação / exportação ---
+
+    def importar_csv(self, tabela, csv_path, sep=";", encoding="latin1", chunksize=10_000, ao_inserir=None):
+        """
+        Appends a CSV to the table (streamed in chunks). Returns the number of rows.
+        ao_inserir, when given, is called with each chunk after it is inserted.
+        """
+        self._validar(tabela)
+        total = 0
+        for chunk in pd.read_csv(csv_path, sep=sep, dtype=str, encoding=encoding, chunksize=chunksize):
+            chunk = chunk.reindex(columns=self.colunas)
+            total += len(self.inserir(tabela, chunk))
+            if ao_inserir is not None:
+                ao_inserir(chunk)
+        return total
+
+    def exportar_csv(self, tabela, csv_path, sep=";", encoding="latin1"):
+        self.carregar(tabela).to_csv(csv_path, sep=sep, index=False, encoding=encoding)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importação/exportação CSV das bases.")
+    parser.add_argument("acao", choices=["importar", "exportar"])
+    parser.add_argument("tabela", choices=TABELAS)
+    parser.add_argument("csv")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    store = ProcedureStore(args.db)
+    if args.acao == "importar":
+        ao_inserir = None
+        if args.tabela == "oficial":
+            # Imported rows may change cached answers; the cache module loads agno, so it is imported here
+            from src.cache import ResultCache
+            from src.utils import chaves_consulta
+
+            cache = ResultCache()
+            ao_inserir = lambda chunk: cache.invalidar(chaves_consulta(chunk))
+        print(f"{store.importar_csv(args.tabela, args.csv, ao_inserir=ao_inserir)} linhas importadas em '{args.tabela}'.")
+    else:
+        store.exportar_csv(args.tabela, args.csv)
+        print(f"'{args.tabela}' exportada para {args.csv}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Streaming reader for uploaded and command-line input CSVs.
+
+The encoding and delimiter are sniffed from the first bytes and the rows are read
+in DataFrame chunks, so memory is bounded by the chunk size, not the file size.
+Sources are paths or binary file objects (e.g. Streamlit's UploadedFile).
+"""
+import codecs
+import csv
+from typing import Iterator, NamedTuple
+
+import pandas as pd
+
+from src.utils import chaves_consulta
+
+# Bytes inspected to detect the encoding and the delimiter
+AMOSTRA_BYTES = 64 * 1024
+# Rows per chunk when the caller does not choose
+CHUNK_SIZE = 5_000
+DELIMITADORES = [";", ",", "\t", "|"]
+# Tried in order; latin1 decodes any byte sequence, so it is the fallback
+ENCODINGS = ["utf-8-sig", "cp1252", "latin1"]
+COLUNA_BUSCA = "DESCRICAO_BUSCA"
+
+
+class FormatoCSV(NamedTuple):
+    encoding: str
+    separador: str
+
+
+def _amostra(fonte, tamanho=AMOSTRA_BYTES):
+    if isinstance(fonte, str):
+        with open(fonte, "rb") as f:
+            return f.read(tamanho)
+    fonte.seek(0)
+    amostra = fonte.read(tamanho)
+    fonte.seek(0)
+    return amostra
+
+
+def _rebobinar(fonte):
+    if not isinstance(fonte, str):
+        fonte.seek(0)
+
+
+def detectar_formato(fonte, coluna=COLUNA_BUSCA) -> FormatoCSV:
+    """
+    Sniffs the encoding (first of ENCODINGS that decodes the sample) and the delimiter
+    (the one whose header split contains `coluna`, else csv.Sniffer, else ';').
+    """
+    amostra = _amostra(fonte)
+    for encoding in ENCODINGS:
+        try:
+            # final=False: a multi-byte character cut at the end of the sample is not an error
+            texto = codecs.getincrementaldecoder(encoding)().decode(amostra, final=False)
+            break
+        except UnicodeDecodeError:
+            continue
+
+    linhas = texto.splitlines()
+    if len(amostra) == AMOSTRA_BYTES and len(linhas) > 1:
+        # The last line of a full sample is usually truncated
+        linhas = linhas[:-1]
+    cabecalho = linhas[0] if linhas else ""
+
+    # Delimiters present in the header first (a one-column header matches any of them)
+    for separador in sorted(DELIMITADORES, key=cabecalho.count, reverse=True):
+        if coluna in [c.strip().strip('"') for c in cabecalho.split(separador)]:
+            return FormatoCSV(encoding, separador)
+    try:
+        separador = csv.Sniffer().sniff("\n".join(linhas[:50]), delimiters="".join(DELIMITADORES)).delimiter
+    except csv.Error:
+        separador = ";"
+    return FormatoCSV(encoding, separador)
+
+
+def ler_colunas(fonte, formato: FormatoCSV):
+    """Header of the file."""
+    _rebobinar(fonte)
+    colunas = list(pd.read_csv(fonte, sep=formato.separador, encoding=formato.encoding, dtype=str, nrows=0).columns)
+    _rebobinar(fonte)
+    return colunas
+
+
+def ler_em_chunks(fonte, formato: FormatoCSV, chunk_size=CHUNK_SIZE, pular=0, usecols=None) -> Iterator[pd.DataFrame]:
+    """
+    Yields the rows as DataFrames of up to chunk_size rows (all columns as str),
+    skipping the first `pular` data rows (to resume a job) without loading them.
+    """
+    _rebobinar(fonte)
+    leitor = pd.read_csv(
+        fonte,
+        sep=formato.separador,
+        encoding=formato.encoding,
+        dtype=str,
+        chunksize=chunk_size,
+        # Row 0 is the header; a callable keeps memory flat for large skips
+        skiprows=(lambda i: 0 < i <= pular) if pular else None,
+        usecols=usecols,
+    )
+    with leitor:
+        yield from leitor
+
+
+def resumir_arquivo(fonte, formato: FormatoCSV, col_codigo="CODIGO", col_descricao=COLUNA_BUSCA, chunk_size=CHUNK_SIZE):
+    """
+    One streaming pass over the code/description columns: row count, distinct
+    chave_consulta keys (kept as 64-bit hashes) and the share of repeated rows.
+    """
+    linhas = 0
+    unicas = set()
+    for chunk in ler_em_chunks(fonte, formato, chunk_size, usecols=lambda c: c in (col_codigo, col_descricao)):
+        linhas += len(chunk)
+        unicas.update(pd.util.hash_array(chaves_consulta(chunk, col_codigo, col_descricao).to_numpy()).tolist())
+    _rebobinar(fonte)
+    return {
+        "linhas": linhas,
+        "unicas": len(unicas),
+        "taxa_deduplicacao": round(1 - len(unicas) / linhas, 4) if linhas else 0.0,
+    }
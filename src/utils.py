@@ -0,0 +1,35 @@
+import pandas as pd
+from unidecode import unidecode
+
+
+def normalizar_texto(texto):
+    """Remove acentos, espaços extras (inclusive internos) e converte para maiúsculo."""
+    if not isinstance(texto, str):
+        return ""
+    return " ".join(unidecode(texto).split()).upper()
+
+
+def limpar_valor(valor):
+    """Converts a DataFrame cell to a stripped string, treating NaN/None as empty."""
+    if valor is None:
+        return ""
+    texto = str(valor).strip()
+    return "" if texto.lower() == "nan" else texto
+
+
+def chave_consulta(cod, desc):
+    """Normalized (code, description) key shared by every classification path."""
+    return f"{limpar_valor(cod)}|{normalizar_texto(limpar_valor(desc))}"
+
+
+def chaves_consulta(df, col_codigo="CODIGO", col_descricao="DESCRICAO"):
+    """chave_consulta for every row of a DataFrame (missing columns count as empty)."""
+    vazio = pd.Series("", index=df.index, dtype=object)
+    codigos = df[col_codigo].map(limpar_valor) if col_codigo in df.columns else vazio
+    descricoes = df[col_descricao].map(lambda d: normalizar_texto(limpar_valor(d))) if col_descricao in df.columns else vazio
+    return codigos + "|" + descricoes
+
+
+def montar_query(cod, desc):
+    """Builds the agent query used by every classification path."""
+    return f"Código: {cod}, Descrição: {desc}" if cod else f"Descrição: {desc}"
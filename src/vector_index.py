@@ -0,0 +1,228 @@
+"""
+ANN and full-text index management for the LanceDB knowledge table.
+
+Without indexes every hybrid search scans all vectors, so latency grows with the
+table. manter_indices() (run after every sync) builds an IVF vector index once the
+table has MIN_LINHAS_ANN rows, retrains it when the table outgrows the rows its
+partitions were trained on, folds rows appended since into the indexes and
+compacts small fragments. The FTS index on "payload" is created once and kept,
+instead of being rebuilt by agno on the first hybrid search of every process.
+
+Usage:
+    python -m src.maintenance indices [--forcar]
+    python -m src.maintenance estatisticas
+"""
+import json
+import math
+import os
+from datetime import timedelta
+
+from agno.utils.log import log_error
+from agno.vectordb.lancedb import LanceDb
+from lancedb.index import FTS, IvfHnswSq, IvfPq
+
+# "IVF_PQ" (compact, refined with REFINE_FACTOR) or "IVF_HNSW_SQ" (more memory, better recall)
+TIPO_INDICE = "IVF_PQ"
+# Below this many rows a flat scan is as fast as the index (and PQ training needs data)
+MIN_LINHAS_ANN = 5_000
+# PQ sub-vector width: 768-dim embeddings -> 48 sub-vectors
+DIMENSOES_POR_SUBVETOR = 16
+# IVF partitions probed per query and PQ candidates re-ranked with the full vectors
+NPROBES = 20
+REFINE_FACTOR = 10
+# The vector index is retrained when the table has this many times the rows it was trained on
+FATOR_RETREINO = 2.0
+# Unindexed rows (searched by flat scan) tolerated before they are folded into the indexes
+MAX_NAO_INDEXADAS = 2_000
+# Small fragments (one per append/delete) tolerated before compaction
+MAX_FRAGMENTOS_PEQUENOS = 32
+# Table versions older than this are removed by the compaction
+RETENCAO_VERSOES = timedelta(hours=1)
+
+COLUNA_TEXTO = "payload"
+
+
+class LanceDbIndexada(LanceDb):
+    """
+    LanceDb whose searches pass refine_factor (as well as nprobes) to the ANN index
+    and reuse an existing FTS index instead of recreating it in every process.
+    """
+
+    def __init__(self, *args, refine_factor=REFINE_FACTOR, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refine_factor = refine_factor
+
+    def _garantir_fts(self):
+        if not self.fts_index_exists:
+            if not _indices_texto(self.table):
+                criar_indice_texto(self)
+            self.fts_index_exists = True
+
+    def _ajustar(self, consulta):
+        if self.nprobes:
+            consulta = consulta.nprobes(self.nprobes)
+        if self.refine_factor:
+            consulta = consulta.refine_factor(self.refine_factor)
+        return consulta
+
+    def vector_search(self, query, limit=5, filters=None):
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None or self.table is None:
+            log_error(f"Vector search unavailable for query: {query}")
+            return None
+        consulta = self.table.search(query=query_embedding, vector_column_name=self._vector_col).limit(limit)
+        return self._ajustar(consulta).to_list()
+
+    def hybrid_search(self, query, limit=5, filters=None):
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None or self.table is None:
+            log_error(f"Hybrid search unavailable for query: {query}")
+            return []
+        self._garantir_fts()
+        consulta = (
+            self.table.search(vector_column_name=self._vector_col, query_type="hybrid")
+            .vector(query_embedding)
+            .text(query)
+            .limit(limit)
+        )
+        return self._ajustar(consulta).to_list()
+
+    def keyword_search(self, query, limit=5, filters=None):
+        if self.table is None:
+            log_error("Table not initialized. Please create the table first")
+            return []
+        self._garantir_fts()
+        return self.table.search(query=query, query_type="fts").limit(limit).to_list()
+
+
+def _indices_texto(table):
+    return [i for i in table.list_indices() if i.index_type == "FTS"]
+
+
+def _indices_vetoriais(table):
+    return [i for i in table.list_indices() if i.index_type != "FTS"]
+
+
+def _caminho_estado(vector_db):
+    # Rows the vector index was trained on, kept next to the table
+    return os.path.join(vector_db.uri, f"{vector_db.table_name}_indices.json")
+
+
+def _carregar_estado(vector_db):
+    caminho = _caminho_estado(vector_db)
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _salvar_estado(vector_db, estado):
+    caminho = _caminho_estado(vector_db)
+    with open(f"{caminho}.tmp", "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+    os.replace(f"{caminho}.tmp", caminho)
+
+
+def parametros_ivf(linhas, dimensoes):
+    """(num_partitions, num_sub_vectors) for a table of `linhas` vectors of `dimensoes` dims."""
+    particoes = max(1, min(int(math.sqrt(linhas)), linhas // 256))
+    subvetores = max(1, dimensoes // DIMENSOES_POR_SUBVETOR)
+    # PQ needs sub-vectors that split the vector evenly
+    while dimensoes % subvetores:
+        subvetores -= 1
+    return particoes, subvetores
+
+
+def criar_indice_vetorial(vector_db, tipo=TIPO_INDICE):
+    """(Re)trains the vector index on the whole table; returns the rows it was trained on."""
+    table = vector_db.table
+    linhas = table.count_rows()
+    dimensoes = table.schema.field(vector_db._vector_col).type.list_size
+    particoes, subvetores = parametros_ivf(linhas, dimensoes)
+    if tipo == "IVF_HNSW_SQ":
+        config = IvfHnswSq(distance_type=vector_db.distance.value, num_partitions=particoes)
+    else:
+        config = IvfPq(distance_type=vector_db.distance.value, num_partitions=particoes, num_sub_vectors=subvetores)
+    table.create_index(vector_db._vector_col, config=config, replace=True)
+    _salvar_estado(vector_db, {"linhas_treino": linhas, "tipo": tipo})
+    return linhas
+
+
+def criar_indice_texto(vector_db):
+    """(Re)builds the full-text index used by hybrid and keyword search."""
+    vector_db.table.create_index(COLUNA_TEXTO, config=FTS(), replace=True)
+    vector_db.fts_index_exists = True
+
+
+def compactar(vector_db, retencao=RETENCAO_VERSOES):
+    """
+    Merges small fragments, adds rows appended since the last build to the existing
+    indexes (without retraining) and removes table versions older than `retencao`.
+    """
+    vector_db.table.optimize(cleanup_older_than=retencao)
+
+
+def manter_indices(vector_db, forcar=False, tipo=TIPO_INDICE):
+    """
+    Brings the indexes of the table in line with its size. With forcar=True both
+    indexes are rebuilt from scratch. Returns the actions taken.
+    """
+    table = vector_db.table
+    acoes = {"vetorial": None, "texto": None, "compactado": False}
+    if table is None:
+        return acoes
+    linhas = table.count_rows()
+    if linhas == 0:
+        return acoes
+
+    if forcar or not _indices_texto(table):
+        criar_indice_texto(vector_db)
+        acoes["texto"] = "criado"
+    vector_db.fts_index_exists = True
+
+    vetoriais = _indices_vetoriais(table)
+    if linhas >= MIN_LINHAS_ANN:
+        treino = _carregar_estado(vector_db).get("linhas_treino", 0)
+        if forcar or not vetoriais:
+            criar_indice_vetorial(vector_db, tipo)
+            acoes["vetorial"] = "criado"
+        elif linhas >= FATOR_RETREINO * treino:
+            # IVF centroids trained on a much smaller table leave partitions unbalanced
+            criar_indice_vetorial(vector_db, tipo)
+            acoes["vetorial"] = "retreinado"
+
+    nao_indexadas = max((table.index_stats(i.name).num_unindexed_rows for i in table.list_indices()), default=0)
+    fragmentos = table.stats()["fragment_stats"]["num_small_fragments"]
+    if nao_indexadas > MAX_NAO_INDEXADAS or fragmentos > MAX_FRAGMENTOS_PEQUENOS:
+        compactar(vector_db)
+        acoes["compactado"] = True
+    return acoes
+
+
+def estatisticas_indices(vector_db):
+    """Rows, fragments, size and per-index coverage of the knowledge table."""
+    table = vector_db.table
+    if table is None:
+        return {"linhas": 0, "indices": {}}
+    stats = table.stats()
+    indices = {}
+    for indice in table.list_indices():
+        uso = table.index_stats(indice.name)
+        indices[indice.name] = {
+            "tipo": uso.index_type,
+            "colunas": list(indice.columns),
+            "distancia": uso.distance_type,
+            "indexadas": uso.num_indexed_rows,
+            "nao_indexadas": uso.num_unindexed_rows,
+        }
+    return {
+        "linhas": stats["num_rows"],
+        "versao": table.version,
+        "bytes": stats["total_bytes"],
+        "fragmentos": stats["fragment_stats"]["num_fragments"],
+        "fragmentos_pequenos": stats["fragment_stats"]["num_small_fragments"],
+        "linhas_treino": _carregar_estado(vector_db).get("linhas_treino"),
+        "nprobes": vector_db.nprobes,
+        "refine_factor": getattr(vector_db, "refine_factor", None),
+        "indices": indices,
+    }